@@ -1,8 +1,8 @@
 import tkinter as tk
-import requests
 import threading
 import time
 from PIL import Image, ImageTk
+from environment_service import get_environment_service
 
 class EnvironmentalInfoDisplay:
     def __init__(self, root):
@@ -105,6 +105,7 @@ class EnvironmentalInfoDisplay:
         self.update_label.pack(pady=5)
         
         # Bắt đầu luồng cập nhật thông tin
+        self.environment = get_environment_service()
         self.stop_thread = False
         self.update_thread = threading.Thread(target=self.update_environmental_info)
         self.update_thread.daemon = True
@@ -117,103 +118,22 @@ class EnvironmentalInfoDisplay:
         self.stop_thread = True
         self.root.destroy()
     def get_ho_chi_minh_weather(self):
-        """Lấy thông tin thời tiết từ API OpenWeatherMap"""
-        try:
-            # Khóa API của bạn
-            api_key = "56d1bc96c2b004e6bd34089b5154da42"  
-            city = "Ho+Chi+Minh+City"
-            url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric&lang=vi"
-            
-            # In ra URL để kiểm tra
-            print(f"Weather API URL: {url}")
-            
-            response = requests.get(url)
-            # In ra toàn bộ response để debug
-            print(f"Weather API Response: {response.text}")
-            
-            data = response.json()
-            
-            # Kiểm tra lỗi từ API
-            if 'cod' in data and data['cod'] != 200:
-                print(f"Lỗi API: {data.get('message', 'Không rõ')}")
-                return None
-            
-            # Kiểm tra cấu trúc dữ liệu
-            if 'main' not in data:
-                print("Dữ liệu thời tiết không đúng định dạng")
-                return None
-            
-            # Trích xuất thêm thông tin
-            return {
-                'temperature': round(data['main']['temp'], 1),
-                'humidity': data['main']['humidity'],
-                'pressure': data['main']['pressure'],
-                'wind_speed': round(data['wind']['speed'], 1),
-                'clouds': data['clouds']['all'],
-                'description': data['weather'][0]['description']
-            }
-        except Exception as e:
-            print(f"Lỗi khi lấy thông tin thời tiết: {e}")
-            return None
+        """Lấy thông tin thời tiết (qua cache của environment_service)"""
+        return self.environment.weather()
     
     def get_uv_index(self):
         """Lấy chỉ số UV"""
-        try:
-            lat, lon = 10.7758, 106.7018  # Tọa độ TP. Hồ Chí Minh
-            api_key = "56d1bc96c2b004e6bd34089b5154da42"
-            
-            url = f"http://api.openweathermap.org/data/2.5/uvi?appid={api_key}&lat={lat}&lon={lon}"
-            
-            response = requests.get(url)
-            data = response.json()
-            
-            # Phân loại chỉ số UV
-            uv_value = data['value']
-            if uv_value <= 2:
-                uv_description = "Thấp"
-            elif uv_value <= 5:
-                uv_description = "Trung bình"
-            elif uv_value <= 7:
-                uv_description = "Cao"
-            elif uv_value <= 10:
-                uv_description = "Rất cao"
-            else:
-                uv_description = "Nguy hiểm"
-            
-            return f"{uv_value} ({uv_description})"
-        except Exception as e:
-            print(f"Lỗi khi lấy chỉ số UV: {e}")
+        uv = self.environment.uv_index()
+        if uv is None:
             return "Không thể tải"
+        return f"{uv['value']} ({uv['description']})"
     
     def get_air_quality(self):
         """Lấy thông tin chất lượng không khí"""
-        try:
-            # Khóa API của bạn
-            api_key = "56d1bc96c2b004e6bd34089b5154da42"
-            lat, lon = 10.7758, 106.7018  # Tọa độ TP. Hồ Chí Minh
-            url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lon}&appid={api_key}"
-            
-            response = requests.get(url)
-            data = response.json()
-            
-            # Kiểm tra lỗi từ API
-            if 'list' not in data or not data['list']:
-                print("Dữ liệu chất lượng không khí không đúng định dạng")
-                return "Không xác định"
-            
-            aqi = data['list'][0]['main']['aqi']
-            aqi_descriptions = {
-                1: "Rất tốt",
-                2: "Tốt",
-                3: "Trung bình",
-                4: "Kém",
-                5: "Rất kém"
-            }
-            
-            return aqi_descriptions.get(aqi, "Không xác định")
-        except Exception as e:
-            print(f"Lỗi khi lấy thông tin chất lượng không khí: {e}")
+        air = self.environment.air_quality()
+        if air is None:
             return "Không thể tải"
+        return air['description']
     
     def update_environmental_info(self):
         """Cập nhật thông tin môi trường định kỳ"""
@@ -251,15 +171,16 @@ class EnvironmentalInfoDisplay:
                 uv_index = self.get_uv_index()
                 self.uv_label.config(text=f"Chỉ số UV: {uv_index}")
                 
-                # Cập nhật thời gian
-                current_time = time.strftime("%H:%M:%S %d/%m/%Y")
+                # Thời điểm dữ liệu thời tiết được lấy về (có thể là bản lưu từ lần chạy trước)
+                fetched_at = self.environment.fetched_at("weather") or time.time()
+                current_time = time.strftime("%H:%M:%S %d/%m/%Y", time.localtime(fetched_at))
                 self.update_label.config(text=f"Cập nhật lúc: {current_time}")
             
             except Exception as e:
                 print(f"Lỗi cập nhật: {e}")
                 self.update_label.config(text=f"Lỗi: {e}")
             
-            # Chờ 15 phút trước khi cập nhật lại
+            # Dịch vụ chỉ gọi API khi dữ liệu hết hạn (ENV_TTL), nên đọc lại thường xuyên không tốn gì
             time.sleep(5)
     
     def on_closing(self):
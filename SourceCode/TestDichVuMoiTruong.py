@@ -0,0 +1,130 @@
+# TestDichVuMoiTruong.py - Kiểm tra cache của environment_service với máy chủ giả lập OpenWeatherMap (không cần mạng)
+
+import os
+import sys
+import time
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import environment_service
+
+RESPONSES = {
+    "weather": {
+        'cod': 200,
+        'main': {'temp': 31.26, 'humidity': 70, 'pressure': 1008},
+        'weather': [{'description': 'mây rải rác'}],
+        'wind': {'speed': 3.6},
+        'clouds': {'all': 40}
+    },
+    "uvi": {'value': 6.2},
+    "air_pollution": {'list': [{'main': {'aqi': 2}}]}
+}
+
+class StubOpenWeatherMap:
+    """Máy chủ giả lập api.openweathermap.org/data/2.5: đếm số lần gọi, có thể chậm"""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                name = urlparse(self.path).path.strip('/')
+                stub.requests.append(name)
+                time.sleep(stub.delay)
+                body = json.dumps(RESPONSES.get(name, {'cod': 404, 'message': 'not found'})).encode('utf-8')
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    stub = StubOpenWeatherMap()
+    snapshot_path = os.path.join(tempfile.mkdtemp(prefix="env_test_"), "environment_snapshot.json")
+    # Các hằng số được chép vào environment_service bởi `from config import *`
+    environment_service.ENV_TTL = {"weather": 1, "uv": 60, "air": 60}
+    environment_service.ENV_TIMEOUT = 1
+    environment_service.ENV_RETRY_BACKOFF = 60
+    service = environment_service.EnvironmentService(stub.url, "test", snapshot_path)
+    ok = True
+
+    print("1. Trong TTL: nhiều lần đọc chỉ gọi API một lần")
+    for _ in range(20):
+        weather = service.weather()
+    print(f"   {weather}")
+    print(f"   {stub.requests.count('weather')} lần gọi API")
+    ok &= weather is not None and stub.requests.count('weather') == 1
+
+    print("2. Single-flight: 10 luồng cùng đọc lần đầu chỉ gọi API một lần")
+    stub.delay = 0.3
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.air_quality())) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"   {stub.requests.count('air_pollution')} lần gọi API, {sum(r is not None for r in results)}/10 luồng có dữ liệu")
+    ok &= stub.requests.count('air_pollution') == 1 and all(r is not None for r in results)
+
+    print("3. Stale-while-revalidate: hết TTL vẫn trả ngay bản cũ, làm mới trong nền")
+    time.sleep(1.1)
+    fetched = service.fetched_at("weather")
+    started = time.time()
+    weather = service.weather()
+    elapsed = time.time() - started
+    print(f"   Trả về sau {elapsed * 1000:.1f} ms (API chậm {stub.delay * 1000:.0f} ms)")
+    ok &= weather is not None and elapsed < stub.delay
+    time.sleep(stub.delay + 0.2)
+    print(f"   {stub.requests.count('weather')} lần gọi API, dữ liệu mới hơn: {service.fetched_at('weather') > fetched}")
+    ok &= stub.requests.count('weather') == 2 and service.fetched_at("weather") > fetched
+
+    print("4. Khởi động lại khi API không truy cập được: dùng bản lưu gần nhất")
+    service.uv_index()
+    stub.close()
+    restarted = environment_service.EnvironmentService(stub.url, "test", snapshot_path)
+    weather, uv, air = restarted.weather(), restarted.uv_index(), restarted.air_quality()
+    print(f"   Thời tiết: {weather is not None}, UV: {uv}, Không khí: {air}")
+    ok &= weather is not None and uv is not None and air is not None
+
+    print("5. API hỏng: sau một lần lỗi không gọi lại trong ENV_RETRY_BACKOFF giây")
+    environment_service.ENV_TTL = {"weather": 0, "uv": 60, "air": 60}
+    for _ in range(10):
+        weather = restarted.weather()
+    time.sleep(0.2)  # Chờ lần làm mới nền kết thúc
+    for _ in range(10):
+        weather = restarted.weather()
+    print(f"   Hết TTL: {restarted.api_calls} lần gọi API, vẫn có dữ liệu: {weather is not None}")
+    ok &= restarted.api_calls == 1 and weather is not None
+    cold = environment_service.EnvironmentService(stub.url, "test", snapshot_path + ".cold")
+    started = time.time()
+    for _ in range(10):
+        weather = cold.weather()
+    elapsed = time.time() - started
+    print(f"   Chưa có dữ liệu: {cold.api_calls} lần gọi API, 10 lần đọc mất {elapsed * 1000:.0f} ms")
+    ok &= cold.api_calls == 1 and weather is None
+
+    print("THÀNH CÔNG" if ok else "THẤT BẠI")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# TestTTS.py - Kiểm tra hàng đợi tạo lời chào với máy chủ giả lập API VoiceRSS (không cần mạng)
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import tts_generator
+
+class StubVoiceRSS:
+    """Máy chủ giả lập api.voicerss.org: trả về 'mp3' giả, có thể chậm hoặc báo lỗi"""
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                text = parse_qs(urlparse(self.path).query).get('src', [''])[0]
+                stub.requests.append(text)
+                time.sleep(stub.delay)
+                body = b"ERROR: stub" if stub.fail else b"ID3stub " + text.encode('utf-8')
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'audio/mpeg')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client đã hết thời gian chờ
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def run_checks(stub, work_dir):
+    # Các hằng số được chép vào tts_generator bởi `from config import *`
+    tts_generator.TTS_API_URL = stub.url
+    tts_generator.TTS_CACHE_DIR = os.path.join(work_dir, "tts")
+    tts_generator.FACES_DIR = os.path.join(work_dir, "faces")
+    tts_generator.TTS_TIMEOUT = 1
+    ok = True
+
+    print("1. Hàng đợi nền: hai người trùng tên chỉ gọi API một lần cho mỗi câu")
+    started = time.time()
+    synthesizer = tts_generator.queue_time_based_greetings(1, "An")
+    tts_generator.queue_time_based_greetings(2, "An")
+    tts_generator.queue_time_based_greetings(3, "Bình")
+    print(f"   Xếp hàng xong sau {(time.time() - started) * 1000:.1f} ms")
+    synthesizer.wait()
+    files = sorted(os.listdir(tts_generator.FACES_DIR))
+    print(f"   {len(stub.requests)} lần gọi API, {len(os.listdir(tts_generator.TTS_CACHE_DIR))} file cache, {len(files)} file lời chào")
+    ok &= len(stub.requests) == 6 and len(files) == 9
+
+    print("2. Câu đã có trong cache không gọi API lần nữa")
+    calls = len(stub.requests)
+    tts_generator.create_time_based_greetings(4, "Bình")
+    print(f"   {len(stub.requests) - calls} lần gọi API")
+    ok &= len(stub.requests) == calls
+
+    print(f"3. API chậm hơn TTS_TIMEOUT ({tts_generator.TTS_TIMEOUT}s): chuyển sang espeak")
+    stub.delay = 3
+    started = time.time()
+    text = "Câu chưa có trong cache"
+    path = tts_generator.synthesize(text)
+    print(f"   Kết quả: {path} sau {time.time() - started:.1f}s")
+    ok &= time.time() - started < stub.delay
+    if shutil.which("espeak") and shutil.which("lame"):
+        ok &= path == tts_generator.tts_cache_path(text, engine="espeak")
+    else:
+        print("   Bỏ qua kiểm tra file dự phòng: máy không có espeak/lame")
+
+    return ok
+
+def main():
+    stub = StubVoiceRSS()
+    try:
+        # Thư mục tạm (cache, lời chào) được xóa kể cả khi kiểm tra lỗi giữa chừng
+        with tempfile.TemporaryDirectory(prefix="tts_test_") as work_dir:
+            ok = run_checks(stub, work_dir)
+    finally:
+        stub.close()
+    print("THÀNH CÔNG" if ok else "THẤT BẠI")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# ai_control.py - Máy chủ HTTP nhỏ điều khiển module_ai khi chạy không màn hình (đăng ký, huấn luyện, xem trước MJPEG)
+
+import hmac
+import json
+import time
+import ipaddress
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import cv2
+from config import *
+
+class ControlServer:
+    """Nhận lệnh từ app.py hoặc curl thay cho phím 'r'/'t' của cửa sổ OpenCV.
+
+    POST /register  {"name": "..."}  -> đăng ký khuôn mặt, trả về kết quả khi xong
+    POST /rebuild                     -> huấn luyện lại toàn bộ mô hình (chạy nền)
+    GET  /status                      -> thống kê pipeline
+    GET  /preview.mjpg                -> ảnh xem trước MJPEG tốc độ thấp (khi bật preview)
+
+    Máy chủ có thể lắng nghe trên mọi giao diện để xem preview từ xa, nhưng các
+    lệnh POST chỉ được nhận từ loopback hoặc khi header X-Control-Token khớp `token`.
+
+    `register(name)` trả về (thành công, thông báo); `snapshot()` trả về khung
+    hình đã vẽ kết quả, chỉ được gọi khi có người đang xem preview.
+    """
+    def __init__(self, register, rebuild, status, snapshot=None,
+                 host=AI_CONTROL_BIND, port=AI_CONTROL_PORT, token=AI_CONTROL_TOKEN):
+        self.register = register
+        self.rebuild = rebuild
+        self.status = status
+        self.snapshot = snapshot
+        self.token = token
+        self.register_lock = threading.Lock()  # Mỗi lần chỉ một phiên đăng ký
+        self.running = True
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="ai-control")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        control = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass  # Không ghi log mỗi request (preview gửi liên tục)
+
+            def send_json(self, status, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def authorized(self):
+                """Lệnh từ chính Pi luôn được nhận; từ máy khác phải có token đúng"""
+                try:
+                    if ipaddress.ip_address(self.client_address[0]).is_loopback:
+                        return True
+                except ValueError:
+                    pass
+                token = self.headers.get('X-Control-Token') or ''
+                return bool(control.token) and hmac.compare_digest(token, control.token)
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if not self.authorized():
+                    return self.send_json(403, {'success': False, 'message': 'Chỉ nhận lệnh từ máy cục bộ hoặc có token hợp lệ'})
+                if path == '/register':
+                    length = int(self.headers.get('Content-Length') or 0)
+                    try:
+                        data = json.loads(self.rfile.read(length) or b'{}')
+                    except ValueError:
+                        return self.send_json(400, {'success': False, 'message': 'Dữ liệu JSON không hợp lệ'})
+                    name = (data.get('name') or '').strip()
+                    if not name:
+                        return self.send_json(400, {'success': False, 'message': 'Thiếu tên người dùng'})
+                    if not control.register_lock.acquire(blocking=False):
+                        return self.send_json(409, {'success': False, 'message': 'Đang có phiên đăng ký khác'})
+                    try:
+                        success, message = control.register(name)
+                    finally:
+                        control.register_lock.release()
+                    return self.send_json(200, {'success': success, 'message': message})
+                if path == '/rebuild':
+                    control.rebuild()
+                    return self.send_json(202, {'success': True, 'message': 'Đang huấn luyện lại mô hình'})
+                self.send_json(404, {'success': False, 'message': 'Không tìm thấy'})
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path == '/status':
+                    return self.send_json(200, {'status': control.status()})
+                if parsed.path == '/preview.mjpg' and control.snapshot is not None:
+                    fps = float(parse_qs(parsed.query).get('fps', [AI_PREVIEW_FPS])[0])
+                    return self.stream_preview(max(0.1, min(fps, AI_PREVIEW_FPS)))
+                self.send_json(404, {'success': False, 'message': 'Không tìm thấy'})
+
+            def stream_preview(self, fps):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                try:
+                    while control.running:
+                        started = time.time()
+                        frame = control.snapshot()
+                        if frame is not None:
+                            ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, AI_PREVIEW_QUALITY])
+                            if ok:
+                                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                                                 + f'Content-Length: {len(jpeg)}\r\n\r\n'.encode()
+                                                 + jpeg.tobytes() + b'\r\n')
+                        time.sleep(max(0, 1.0 / fps - (time.time() - started)))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Trình duyệt đã đóng preview
+
+        return Handler
@@ -0,0 +1,60 @@
+# ai_pipeline.py - Hàng đợi bỏ phần tử cũ và thống kê FPS/độ trễ cho pipeline camera
+
+import time
+import threading
+from collections import deque
+
+class DropOldestQueue:
+    """Hàng đợi có giới hạn nối các tầng của pipeline.
+
+    Khi đầy, phần tử cũ nhất bị bỏ để nhận phần tử mới, nên tầng chậm luôn
+    xử lý khung hình gần nhất thay vì làm tắc tầng phía trước.
+    """
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Lấy phần tử cũ nhất còn trong hàng đợi, None nếu hết thời gian chờ"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout):
+                return None
+            return self.items.popleft()
+
+class StageStats:
+    """FPS và độ trễ trung bình của một tầng trên cửa sổ trượt"""
+    def __init__(self, name, window=30):
+        self.name = name
+        self.finished = deque(maxlen=window)  # Thời điểm hoàn thành từng lần xử lý
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.finished.append(time.monotonic())
+            self.latencies.append(latency)
+            self.count += 1
+
+    def fps(self):
+        with self.lock:
+            if len(self.finished) < 2 or self.finished[-1] == self.finished[0]:
+                return 0.0
+            return (len(self.finished) - 1) / (self.finished[-1] - self.finished[0])
+
+    def latency_ms(self):
+        with self.lock:
+            if not self.latencies:
+                return 0.0
+            return 1000 * sum(self.latencies) / len(self.latencies)
+
+    def summary(self):
+        return f"{self.name}: {self.fps():.1f} FPS, {self.latency_ms():.0f} ms"
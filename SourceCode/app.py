@@ -1,18 +1,27 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import threading
 import time
 from datetime import datetime, timedelta
-import sqlite3
 import logging
 from gpiozero import DigitalOutputDevice, Button, DistanceSensor, Device
 import json
 import warnings
 from gpiozero.exc import DistanceSensorNoEcho
-import concurrent.futures
 import os
 import sys
 import requests
 import subprocess
+import database
+from step_generator import create_step_engine
+from motion_planner import plan_move, expected_move_time, STEPS_PER_CM
+from height_sampler import HeightSampler
+from height_estimator import HeightEstimator
+from light_sensor import BH1750, LightSampler, HysteresisSwitch
+from step_odometry import StepOdometer
+from event_bus import event_bus
+from detection_bus import DetectionListener
+from environment_service import get_environment_service
+from config import AI_CONTROL_HOST, AI_CONTROL_PORT, ENROLL_DURATION
 
 # Cấu hình logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -36,8 +45,7 @@ app = Flask(__name__)
 
 # Đường dẫn cơ bản và DB_PATH
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_PATH, "data", "usage_stats.db")
-DETECTED_USER_FILE = os.path.join(BASE_PATH, "data", "detected_user.json")
+DB_PATH = database.DB_PATH
 
 # Kiểm tra quyền truy cập file cơ sở dữ liệu
 def check_db_permissions():
@@ -83,61 +91,10 @@ def create_directories():
 
 create_directories()
 
-# Khóa để đồng bộ hóa truy cập cơ sở dữ liệu và file
-db_lock = threading.Lock()
-file_lock = threading.Lock()
-
 # Khởi tạo cơ sở dữ liệu
 def init_db():
     try:
-        with db_lock:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS sessions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id TEXT UNIQUE,
-                        user_name TEXT,
-                        start_time TIMESTAMP,
-                        end_time TIMESTAMP,
-                        duration REAL,
-                        notes TEXT
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS positions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        session_id INTEGER,
-                        user_id TEXT,
-                        position TEXT,
-                        start_time TIMESTAMP,
-                        end_time TIMESTAMP,
-                        duration REAL,
-                        FOREIGN KEY (session_id) REFERENCES sessions(id)
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS user_heights (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id TEXT,
-                        sitting_height REAL,
-                        standing_height REAL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES sessions(user_id)
-                    )
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS height_history (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id TEXT,
-                        position TEXT,
-                        height REAL,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                conn.commit()
-                logging.info("Khởi tạo cơ sở dữ liệu thành công")
+        database.init_database()
     except Exception as e:
         logging.error(f"Lỗi khởi tạo cơ sở dữ liệu: {e}")
         raise
@@ -161,8 +118,21 @@ LIGHT_PIN = 26  # Chân LED
 # Cài đặt điều khiển động cơ
 PULSE_SPEED = 500  # Microseconds
 PULSE_SLOW = 1000  # Microseconds (chậm hơn khi gần mục tiêu)
+STEP_ENGINE = "batch"  # Bộ tạo xung: "batch" (bảng thời gian tính trước) hoặc "sleep" (dự phòng)
+STEP_BURST = 20  # Số bước phát liên tục giữa hai lần kiểm tra cảm biến
+HEIGHT_FILTER = "kalman"  # Bộ lọc độ cao: "median", "ema" hoặc "kalman"
+ODOMETRY_MAX_RETRIES = 1  # Số lần chạy bù khi kiểm tra cuối cho thấy chưa tới mục tiêu
+TARGET_TOLERANCE_CM = 2  # Sai lệch (cm) được coi là đã tới mục tiêu
 CONFIG_FILE = os.path.join(BASE_PATH, "table_heights.json")
 
+# Cài đặt đèn tự động (cảm biến BH1750)
+LIGHT_SENSOR_BUS = 1  # Bus I2C 1 trên Raspberry Pi
+LIGHT_ON_LUX = 40  # Bật đèn khi độ rọi đã làm mượt dưới ngưỡng này
+LIGHT_OFF_LUX = 70  # Tắt đèn khi độ rọi đã làm mượt từ ngưỡng này trở lên
+LIGHT_MIN_DWELL = 30  # Giữ trạng thái đèn ít nhất x giây sau mỗi lần tự động chuyển
+LIGHT_MIN_INTERVAL = 0.2  # Chu kỳ đọc khi ánh sáng đang thay đổi (giây)
+LIGHT_MAX_INTERVAL = 5  # Chu kỳ đọc khi ánh sáng ổn định (giây)
+
 # Biến toàn cục
 processes = {}
 ai_detection_active = True  # AI luôn chạy khi khởi động
@@ -173,6 +143,11 @@ current_height = -1
 moving_to_position = False
 target_position = -1
 running = True
+steps_per_cm = STEPS_PER_CM  # Hiệu chuẩn số bước/cm, lưu trong table_heights.json
+motion_plan = None  # Lịch nửa chu kỳ tính trước cho lần di chuyển tới vị trí nhớ
+plan_index = 0
+odometer = StepOdometer(STEPS_PER_CM)  # Đếm bước để suy ra độ cao khi di chuyển tới vị trí nhớ
+move_retries = 0
 auto_light_enabled = False  # Trạng thái Auto-light
 manual_light_state = None  # None = tự động, True = bật, False = tắt
 # Khởi tạo phần cứng
@@ -186,6 +161,8 @@ except Exception as e:
     logging.error(f"Lỗi khởi tạo chân GPIO động cơ: {e}")
     ena_pin = dir_pin = pul_pin = None
 
+step_engine = create_step_engine(pul_pin, STEP_ENGINE) if pul_pin else None
+
 try:
     btn_up = Button(BTN_UP_PIN, pull_up=True)
     btn_down = Button(BTN_DOWN_PIN, pull_up=True)
@@ -222,13 +199,25 @@ except Exception as e:
     has_light = False   
     logging.error(f"Không thể khởi tạo đèn: {e}")
 
+try:
+    light_sensor = BH1750(LIGHT_SENSOR_BUS)
+    has_light_sensor = True
+    logging.info("Đã khởi tạo cảm biến ánh sáng BH1750")
+except Exception as e:
+    light_sensor = None
+    has_light_sensor = False
+    logging.error(f"Không thể khởi tạo cảm biến ánh sáng: {e}")
+
 # Tải vị trí bộ nhớ
 def load_positions():
-    global memory_positions
+    global memory_positions, steps_per_cm
     try:
         with open(CONFIG_FILE, 'r') as file:
             loaded_data = json.load(file)
             memory_positions = {1: loaded_data.get('position1', -1), 2: loaded_data.get('position2', -1)}
+            steps_per_cm = loaded_data.get('steps_per_cm', STEPS_PER_CM)
+            height_estimator.cm_per_step = 1 / steps_per_cm
+            odometer.steps_per_cm = steps_per_cm
         logging.info(f"Đã tải vị trí bộ nhớ: 1={memory_positions[1]}cm, 2={memory_positions[2]}cm")
     except (FileNotFoundError, json.JSONDecodeError):
         memory_positions = {1: -1, 2: -1}
@@ -237,41 +226,96 @@ def load_positions():
 
 def save_positions():
     try:
-        data = {'position1': memory_positions[1], 'position2': memory_positions[2]}
+        data = {'position1': memory_positions[1], 'position2': memory_positions[2], 'steps_per_cm': steps_per_cm}
         with open(CONFIG_FILE, 'w') as file:
             json.dump(data, file)
         logging.info(f"Đã lưu vị trí: 1={memory_positions[1]}cm, 2={memory_positions[2]}cm")
+        publish_table_state()
     except Exception as e:
         logging.error(f"Lỗi khi lưu vị trí: {e}")
 
-# Đo chiều cao với timeout
-def get_current_height(timeout=2):
-    if not has_distance_sensor:
-        logging.warning("Không có cảm biến khoảng cách, trả về -1")
-        return -1
+# Đọc cảm biến khoảng cách (chỉ được gọi từ luồng height_sampler)
+def read_distance_cm():
     try:
         with warnings.catch_warnings(record=True) as w:
             warnings.simplefilter("always")
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(lambda: distance_sensor.distance)
-                try:
-                    distance_m = future.result(timeout=timeout)
-                except concurrent.futures.TimeoutError:
-                    logging.error("Timeout khi đo khoảng cách - cảm biến có thể không phản hồi")
-                    return -1
+            distance_m = distance_sensor.distance
             for warning in w:
                 if isinstance(warning.message, DistanceSensorNoEcho):
                     logging.error(f"Lỗi cảm biến khoảng cách: {warning.message}")
                     return -1
             distance_cm = distance_m * 100
             if 2 <= distance_cm <= 400:
-                return round(distance_cm)
+                return distance_cm
             logging.warning(f"Chiều cao ngoài phạm vi: {distance_cm} cm")
             return -1
     except Exception as e:
         logging.error(f"Lỗi nghiêm trọng khi đo chiều cao: {e}")
         return -1
 
+height_estimator = HeightEstimator(mode=HEIGHT_FILTER, cm_per_step=1 / STEPS_PER_CM)
+height_sampler = HeightSampler(read_distance_cm) if has_distance_sensor else None
+if height_sampler:
+    height_sampler.add_listener(height_estimator.update)
+    height_sampler.add_listener(lambda timestamp, value: publish_table_state())
+
+# Ước lượng chiều cao đã lọc (cm, số thực) cùng vận tốc và độ tin cậy, không chặn
+def get_height_estimate(timeout=2):
+    if not has_distance_sensor or height_sampler.latest(max_age=timeout) < 0:
+        return -1, 0.0, 0.0
+    return height_estimator.estimate(max_age=timeout)
+
+def get_raw_height(n=5, timeout=2):
+    # Trung vị các mẫu cảm biến gần nhất, không qua bộ lọc (dùng để hiệu chuẩn số bước/cm)
+    if not has_distance_sensor:
+        return -1
+    return height_sampler.median(n, max_age=timeout)
+
+# Đọc chiều cao đã lọc từ bộ ước lượng (không chặn)
+def get_current_height(timeout=2):
+    if not has_distance_sensor:
+        logging.warning("Không có cảm biến khoảng cách, trả về -1")
+        return -1
+    height, _, _ = get_height_estimate(timeout)
+    if height < 0:
+        logging.error("Không có mẫu chiều cao mới - cảm biến có thể không phản hồi")
+        return -1
+    return round(height)
+
+# Đẩy trạng thái tới giao diện qua /events (event_bus chỉ gửi các trường thay đổi)
+def publish_table_state():
+    height, _, _ = get_height_estimate()
+    height = round(height) if height > 0 else -1
+    event_bus.publish('table', {
+        'height': height,
+        'status_text': "Đang di chuyển" if motor_running else "Dừng",
+        'memory_positions': memory_positions,
+        'sensor_error': height == -1
+    })
+
+def publish_light_state(lux=None):
+    state = {
+        'light_state': "Bật" if has_light and light and light.value else "Tắt",
+        'auto_light_enabled': auto_light_enabled
+    }
+    if lux is not None:
+        state['lux'] = lux
+    event_bus.publish('light', state)
+
+def publish_user_state():
+    current_user = usage_tracker.get_current_user() if has_usage_tracker else None
+    preferred_heights = {'sitting': -1, 'standing': -1}
+    if has_height_prefs and current_user and current_user.get('user_id'):
+        try:
+            preferred_heights = height_prefs.get_heights(current_user['user_id'])
+        except Exception as e:
+            logging.error(f"Lỗi khi lấy preferred_heights: {e}")
+    event_bus.publish('user', {
+        'current_user': current_user,
+        'user_name': current_user.get('user_name') if current_user else None,
+        'preferred_heights': preferred_heights
+    })
+
 # Các hàm điều khiển động cơ
 def check_limits(direction):
     if not has_limit_switches:
@@ -285,12 +329,19 @@ def check_limits(direction):
     return False
 
 def stop_motor():
-    global motor_running, moving_to_position
+    global motor_running, moving_to_position, motion_plan
     motor_running = False
     moving_to_position = False
+    motion_plan = None
     if pul_pin:
         pul_pin.off()
     logging.info("Động cơ đã dừng, DIR=%s", dir_pin.value if dir_pin else "N/A")
+    publish_table_state()
+
+def set_direction(up):
+    # Quy ước duy nhất cho chân DIR, khớp với hướng thực tế của bàn: lên = OFF, xuống = ON
+    if dir_pin:
+        dir_pin.off() if up else dir_pin.on()
 
 # Thay thế hàm start_motor_up()
 def start_motor_up():
@@ -305,10 +356,11 @@ def start_motor_up():
         stop_motor()
         time.sleep(0.1)  # Đợi để đảm bảo động cơ dừng
     logging.info("Di chuyển LÊN, Đặt DIR=OFF")
-    dir_pin.off()  # Đổi từ on() thành off() để khớp với hướng lên thực tế
+    set_direction(True)
     current_direction = True
     moving_to_position = False
     motor_running = True
+    publish_table_state()
 
 # Thay thế hàm start_motor_down()
 def start_motor_down():
@@ -323,10 +375,31 @@ def start_motor_down():
         stop_motor()
         time.sleep(0.1)  # Đợi để đảm bảo động cơ dừng
     logging.info("Di chuyển XUỐNG, Đặt DIR=ON")
-    dir_pin.on()  # Đổi từ off() thành on() để khớp với hướng xuống thực tế
+    set_direction(False)
     current_direction = False
     moving_to_position = False
     motor_running = True
+    publish_table_state()
+
+def start_planned_move(target, retry=0):
+    """Lập lịch tăng/giảm tốc từ độ cao hiện tại tới mục tiêu rồi khởi động động cơ"""
+    global target_position, moving_to_position, motor_running, current_direction, motion_plan, plan_index
+    global move_retries
+    target_position = target
+    move_retries = retry
+    start_height, _, _ = get_height_estimate()
+    if start_height <= 0:
+        start_height = current_height
+    odometer.begin(start_height, get_raw_height())
+    motion_plan = plan_move(start_height, target, steps_per_cm)
+    plan_index = 0
+    if motion_plan is not None and dir_pin:
+        current_direction = start_height < target
+        set_direction(current_direction)
+        logging.info(f"Lập lịch {len(motion_plan)} bước, dự kiến {expected_move_time(motion_plan):.2f}s")
+    moving_to_position = True
+    motor_running = True
+    publish_table_state()
 
 def move_to_position(position_num):
     global memory_positions, current_height, moving_to_position, target_position, motor_running
@@ -347,9 +420,7 @@ def move_to_position(position_num):
                 logging.info(f"Sử dụng độ cao đứng cá nhân: {user_height}cm")
     if user_height:
         logging.info(f"Di chuyển đến vị trí cá nhân {position_num}: {user_height}cm")
-        target_position = user_height
-        moving_to_position = True
-        motor_running = True
+        start_planned_move(user_height)
         if has_usage_tracker and current_user:
             try:
                 usage_tracker.update_position('sitting' if position_num == 1 else 'standing')
@@ -364,9 +435,7 @@ def move_to_position(position_num):
     elif memory_positions[position_num] > 0:
         if current_height > 0:
             logging.info(f"Di chuyển đến vị trí {position_num}: {memory_positions[position_num]}cm")
-            target_position = memory_positions[position_num]
-            moving_to_position = True
-            motor_running = True
+            start_planned_move(memory_positions[position_num])
             if has_usage_tracker and current_user:
                 try:
                     usage_tracker.update_position('sitting' if position_num == 1 else 'standing')
@@ -376,29 +445,72 @@ def move_to_position(position_num):
         else:
             logging.error("Không thể di chuyển - cảm biến khoảng cách không hoạt động")
 
+def finish_odometry_move():
+    """Kiểm tra độ cao thật sau khi dừng, học lại số bước/cm và chạy bù nếu cần"""
+    global steps_per_cm, current_height
+    time.sleep(0.3)  # Chờ bàn ổn định và cảm biến có mẫu mới
+    end_height, _, _ = get_height_estimate()
+    # Học từ trung vị 5 mẫu thô (~0.3s, đều lấy sau khi dừng), không dùng độ cao Kalman
+    # vì nó đã được dự đoán bằng chính số bước/cm đang hiệu chỉnh
+    raw_end_height = get_raw_height()
+    new_steps_per_cm = odometer.learn(raw_end_height)
+    logging.info(f"Kết thúc di chuyển: {odometer.sensor_reads} lần đọc cảm biến, "
+                 f"{odometer.corrections} lần hiệu chỉnh, độ cao đo được {raw_end_height:.1f}cm")
+    if new_steps_per_cm != steps_per_cm:
+        steps_per_cm = new_steps_per_cm
+        height_estimator.cm_per_step = 1 / steps_per_cm
+        save_positions()
+    if end_height > 0:
+        current_height = round(end_height)
+        if abs(end_height - target_position) > TARGET_TOLERANCE_CM and move_retries < ODOMETRY_MAX_RETRIES:
+            logging.warning(f"Chưa tới mục tiêu {target_position}cm, chạy bù")
+            start_planned_move(target_position, retry=move_retries + 1)
+
+def motor_should_stop():
+    """Điều kiện dừng giữa loạt xung: động cơ bị tắt hoặc chạm công tắc giới hạn"""
+    return not motor_running or check_limits(current_direction)
+
 def motor_control_thread():
     global running, motor_running, current_direction, moving_to_position, target_position, current_height
+    global motion_plan, plan_index
     logging.info("Motor control thread started")
+    last_publish = 0
     while running:
         try:
             if motor_running and pul_pin:
+                planned_burst = None
                 if moving_to_position and has_distance_sensor:
-                    current_height = get_current_height()
-                    if current_height > 0 and target_position > 0:
-                        distance_to_target = abs(current_height - target_position)
-                        if distance_to_target <= 2:
+                    # Chỉ đối chiếu cảm biến sau mỗi vài cm, còn lại suy ra từ số bước
+                    if odometer.due_for_check() or odometer.position() < 0:
+                        estimated_height, _, _ = get_height_estimate()
+                        odometer.correct(estimated_height)
+                    position = odometer.position()
+                    if position > 0 and target_position > 0:
+                        current_height = round(position)
+                        distance_to_target = abs(position - target_position)
+                        plan = motion_plan
+                        # Có lịch: dừng khi đã phát hết lịch (kể cả đoạn giảm tốc), khoảng cách
+                        # chỉ dùng khi không có lịch (tiếp cận chậm sau khi vượt quá mục tiêu)
+                        arrived = plan_index >= len(plan) if plan is not None else distance_to_target <= TARGET_TOLERANCE_CM
+                        if arrived:
                             logging.info(f"Đã đến vị trí mục tiêu: {current_height}cm")
                             stop_motor()
+                            finish_odometry_move()
                             continue
-                        new_direction = current_height < target_position
-                        if new_direction != current_direction:
+                        new_direction = position < target_position
+                        # Chỉ coi là vượt quá mục tiêu khi ra ngoài vùng dung sai (bảo vệ khi lịch sai)
+                        if new_direction != current_direction and distance_to_target > TARGET_TOLERANCE_CM:
                             logging.info(f"Đổi hướng từ {current_direction} sang {new_direction}")
+                            motion_plan = None  # Lịch không còn đúng khi vượt quá mục tiêu
                             stop_motor()  # Dừng trước khi đổi hướng
                             time.sleep(0.1)  # Đợi để đảm bảo dừng
                             current_direction = new_direction
-                            dir_pin.on() if current_direction else dir_pin.off()
+                            set_direction(current_direction)
                             logging.info(f"Đã đặt DIR={dir_pin.value if dir_pin else 'N/A'}")
                         pulse_time = PULSE_SLOW if distance_to_target < 10 else PULSE_SPEED
+                        plan = motion_plan
+                        if plan is not None and plan_index < len(plan):
+                            planned_burst = plan[plan_index:plan_index + STEP_BURST]
                     else:
                         stop_motor()
                         continue
@@ -407,80 +519,66 @@ def motor_control_thread():
                 if check_limits(current_direction):
                     stop_motor()
                     continue
-                pul_pin.on()
-                time.sleep(pulse_time / 1000000)  # Chuyển từ micro giây sang giây
-                pul_pin.off()
-                time.sleep(pulse_time / 1000000)
+                if planned_burst is not None:
+                    # Chỉ đi theo lịch đã tính trước; hết lịch thì quay về tiếp cận chậm
+                    steps = step_engine.run_schedule(planned_burst, should_stop=motor_should_stop)
+                    plan_index += steps
+                else:
+                    steps = step_engine.run(STEP_BURST, pulse_time, should_stop=motor_should_stop)
+                height_estimator.add_steps(steps, current_direction)
+                odometer.add_steps(steps, current_direction)
             else:
+                if step_engine and step_engine.steps:
+                    logging.info(f"Tốc độ bước: {step_engine.stats()}")
+                    step_engine.reset_stats()
+                # Phát định kỳ để giao diện thấy lỗi cảm biến khi không còn mẫu mới
+                if time.monotonic() - last_publish >= 1:
+                    last_publish = time.monotonic()
+                    publish_table_state()
                 time.sleep(0.01)
         except Exception as e:
             logging.error(f"Error in motor control thread: {e}")
             time.sleep(1)
 
-# Cập nhật auto_light_thread
-def auto_light_thread():
-    global running, auto_light_enabled, light, manual_light_state
-    logging.info("Auto-light thread started")
-    while running:
-        if auto_light_enabled and has_light and light:
-            lux = read_light_level()
-            logging.debug(f"Auto-light: lux = {lux}, light.value = {light.value}, manual_light_state = {manual_light_state}")
-            if manual_light_state is not None:
-                manual_light_state = None
-                logging.info("Auto-light: Đã reset trạng thái thủ công")
-            if lux < 50:
-                if not light.value:
-                    light.on()
-                    logging.info("Auto-light: Bật đèn do mức ánh sáng thấp")
-            elif lux >= 50:
-                if light.value:
-                    light.off()
-                    logging.info("Auto-light: Tắt đèn do mức ánh sáng cao")
-                else:
-                    # Buộc tắt nếu phần cứng không phản hồi
-                    light.off()
-                    logging.warning("Auto-light: Trạng thái không khớp, buộc tắt đèn")
-        time.sleep(1)  # Giảm thời gian sleep để phản hồi nhanh hơn
-def height_monitor_thread():
-    global running, current_height
-    while running and has_distance_sensor:
-        current_height = get_current_height()
-        time.sleep(0.2)
-
-def get_detected_user():
-    try:
-        for _ in range(3):  # Thử 3 lần
-            with file_lock:
-                if os.path.exists(DETECTED_USER_FILE):
-                    with open(DETECTED_USER_FILE, 'r') as f:
-                        user_data = json.load(f)
-                    return user_data if user_data.get('user_id') and user_data.get('user_name') else None
-            time.sleep(0.1)  # Chờ 100ms trước khi thử lại
-        logging.warning("Không thể đọc detected_user.json sau 3 lần thử")
-        return None
-    except Exception as e:
-        logging.error(f"Lỗi khi đọc detected_user.json: {e}")
-        return None
+# Xử lý mỗi mẫu ánh sáng (gọi từ luồng light_sampler)
+def on_light_sample(timestamp, lux):
+    global manual_light_state
+    if auto_light_enabled and has_light and light:
+        if manual_light_state is not None:
+            manual_light_state = None
+            logging.info("Auto-light: Đã reset trạng thái thủ công")
+        state = light_switch.update(lux, light.value, timestamp)
+        if state is not None:
+            light.value = state
+            logging.info(f"Auto-light: {'Bật' if state else 'Tắt'} đèn, lux = {lux}")
+    publish_light_state(lux)
+
+light_switch = HysteresisSwitch(LIGHT_ON_LUX, LIGHT_OFF_LUX, LIGHT_MIN_DWELL)
+# Chỉ đọc BH1750 khi cần tự động hoặc có trang đang theo dõi
+light_sampler = LightSampler(light_sensor.read, LIGHT_MIN_INTERVAL, LIGHT_MAX_INTERVAL,
+                             active=lambda: auto_light_enabled or event_bus.has_subscribers("light")) if has_light_sensor else None
+if light_sampler:
+    light_sampler.add_listener(on_light_sample)
 
 def user_detection_thread():
     global running, has_usage_tracker
     logging.info("User detection thread started")
-    last_user_id = None
+    # Chặn trên socket cho tới khi module_ai gửi bản ghi, không đọc file định kỳ
     while running and has_usage_tracker:
         try:
-            detected_user = get_detected_user()
-            if detected_user:
-                current_user = usage_tracker.get_current_user()
-                current_user_id = current_user.get('user_id') if current_user else None
-                if detected_user.get('user_id') != current_user_id:
-                    with db_lock:
-                        if current_user_id and usage_tracker.tracking_active:
-                            usage_tracker.stop_tracking()
-                            logging.info(f"Kết thúc phiên cho user_id={current_user_id}")
-                        user_data = usage_tracker.start_tracking(user_name=detected_user.get('user_name'), user_id=detected_user.get('user_id'))
-                        logging.info(f"Tự động chuyển sang phiên user: {user_data.get('user_name')}, user_id={user_data.get('user_id')}")
-                last_user_id = detected_user.get('user_id')
-            time.sleep(2)  # Kiểm tra mỗi 2 giây
+            record, changed = detection_listener.wait(timeout=1)
+            if record is None or not changed or not record.user_id or not record.user_name:
+                continue
+            current_user = usage_tracker.get_current_user()
+            current_user_id = current_user.get('user_id') if current_user else None
+            if record.user_id != current_user_id:
+                if current_user_id and usage_tracker.tracking_active:
+                    usage_tracker.stop_tracking()
+                    logging.info(f"Kết thúc phiên cho user_id={current_user_id}")
+                user_data = usage_tracker.start_tracking(user_name=record.user_name, user_id=record.user_id)
+                logging.info(f"Tự động chuyển sang phiên user: {user_data.get('user_name')}, user_id={user_data.get('user_id')} "
+                             f"(độ tin cậy {record.confidence:.1f}%, trễ {time.time() - record.timestamp:.3f}s)")
+                publish_user_state()
         except Exception as e:
             logging.error(f"Lỗi trong user_detection_thread: {e}")
             time.sleep(5)
@@ -500,20 +598,29 @@ motor_thread.daemon = True
 motor_thread.start()
 
 if has_distance_sensor:
-    height_thread = threading.Thread(target=height_monitor_thread)
-    height_thread.daemon = True
-    height_thread.start()
+    height_sampler.start()
 
-if has_light:
-    auto_light_thread = threading.Thread(target=auto_light_thread)
-    auto_light_thread.daemon = True
-    auto_light_thread.start()
+if light_sampler:
+    light_sampler.start()
 
-if has_usage_tracker:
+try:
+    detection_listener = DetectionListener()
+except (AttributeError, OSError) as e:  # AttributeError: hệ điều hành không có AF_UNIX
+    detection_listener = None
+    logging.error(f"Không mở được kênh nhận diện từ module_ai: {e}")
+
+if has_usage_tracker and detection_listener:
     user_detection_thread = threading.Thread(target=user_detection_thread)
     user_detection_thread.daemon = True
     user_detection_thread.start()
 
+def script_args(script_name):
+    # Thiết bị không gắn màn hình (không có DISPLAY): module_ai chạy headless,
+    # đăng ký khuôn mặt qua /register_face thay cho phím 'r'
+    if script_name == 'module_ai.py' and not os.environ.get('DISPLAY'):
+        return ['--headless']
+    return []
+
 def run_script(script_name):
     script_path = os.path.join(BASE_PATH, script_name)
     if not os.path.exists(script_path):
@@ -523,7 +630,7 @@ def run_script(script_name):
         if sys.platform.startswith('linux'):
             subprocess.run(["pkill", "-f", "python.*module_ai.py"], check=False)
             time.sleep(1)
-        process = subprocess.Popen([sys.executable, script_path])
+        process = subprocess.Popen([sys.executable, script_path] + script_args(script_name))
         processes[script_name] = process
         logging.info(f"Đã chạy {script_name}")
         return True, f"Đã chạy {script_name}"
@@ -531,6 +638,8 @@ def run_script(script_name):
         logging.error(f"Lỗi khi chạy {script_name}: {e}")
         return False, f"Lỗi khi chạy {script_name}: {str(e)}"
 
+environment_service = get_environment_service()
+
 # Khởi động AI detection
 def start_ai_detection():
     global ai_detection_active
@@ -544,6 +653,7 @@ def start_ai_detection():
 
 start_ai_detection()
 load_positions()
+publish_user_state()
 
 # Các route Flask
 @app.route('/')
@@ -568,9 +678,9 @@ def set_user():
         logging.warning("Tên người dùng không hợp lệ")
         return jsonify({'success': False, 'message': 'Tên người dùng không hợp lệ'})
     try:
-        with db_lock:
-            user_data = usage_tracker.start_tracking(user_name=user_name)
+        user_data = usage_tracker.start_tracking(user_name=user_name)
         logging.info(f"Started tracking for user: {user_name}, user_data={user_data}")
+        publish_user_state()
         return jsonify({
             'success': True,
             'message': f'Đã thiết lập người dùng: {user_name}',
@@ -590,9 +700,9 @@ def end_session():
         if not hasattr(usage_tracker, 'tracking_active') or not usage_tracker.tracking_active:
             logging.warning("No active session to end")
             return jsonify({'success': False, 'message': 'Không có phiên đang hoạt động'})
-        with db_lock:
-            session_data = usage_tracker.stop_tracking()
+        session_data = usage_tracker.stop_tracking()
         logging.info(f"Session ended, session_data={session_data}")
+        publish_user_state()
         return jsonify({'success': True, 'message': 'Đã kết thúc phiên'})
     except Exception as e:
         logging.error(f"Error ending session: {e}")
@@ -630,6 +740,7 @@ def toggle_light():
         light.value = manual_light_state
         new_state = "Bật" if light.value else "Tắt"
         lux = read_light_level()
+        publish_light_state(lux)
         # Kiểm tra nếu trạng thái không thay đổi (lỗi phần cứng)
         if light.value != manual_light_state:
             logging.error("Phần cứng không phản hồi lệnh điều khiển đèn")
@@ -651,6 +762,9 @@ def toggle_auto_light():
     try:
         auto_light_enabled = not auto_light_enabled
         logging.info(f"Auto-light: {'Bật' if auto_light_enabled else 'Tắt'}")
+        if auto_light_enabled and light_sampler:
+            light_sampler.wake()  # Quyết định ngay theo mẫu mới thay vì chờ chu kỳ chậm
+        publish_light_state()
         return jsonify({
             'status': 'success',
             'auto_light_enabled': auto_light_enabled
@@ -737,12 +851,12 @@ def set_height():
         logging.error("Không thể đọc chiều cao hiện tại")
         return jsonify({'success': False, 'message': 'Không thể đọc chiều cao hiện tại'})
     try:
-        with db_lock:
-            if position == 'sitting':
-                height_prefs.save_height(current_user['user_id'], sitting_height=current_height)
-            else:
-                height_prefs.save_height(current_user['user_id'], standing_height=current_height)
+        if position == 'sitting':
+            height_prefs.save_height(current_user['user_id'], sitting_height=current_height)
+        else:
+            height_prefs.save_height(current_user['user_id'], standing_height=current_height)
         logging.info(f"Đã thiết lập độ cao {position}: {current_height} cm cho user_id={current_user['user_id']}")
+        publish_user_state()
         return jsonify({'success': True, 'message': f'Đã thiết lập độ cao {position}: {current_height} cm'})
     except Exception as e:
         logging.error(f"Lỗi khi lưu độ cao {position}: {e}")
@@ -754,6 +868,21 @@ def run_script_route(script_name):
     success, message = run_script(script_name)
     return jsonify({'success': success, 'message': message})
 
+@app.route('/register_face', methods=['POST'])
+def register_face():
+    # Chuyển yêu cầu đăng ký sang máy chủ điều khiển của module_ai (chế độ headless)
+    data = request.get_json(silent=True) or request.form
+    name = (data.get('name') or '').strip()
+    if not name:
+        return jsonify({'success': False, 'message': 'Vui lòng nhập tên'}), 400
+    try:
+        response = requests.post(f"http://{AI_CONTROL_HOST}:{AI_CONTROL_PORT}/register",
+                                 json={'name': name}, timeout=ENROLL_DURATION + 30)
+        return jsonify(response.json()), response.status_code
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Không kết nối được module_ai để đăng ký: {e}")
+        return jsonify({'success': False, 'message': 'Module AI không chạy ở chế độ headless'}), 503
+
 @app.route('/usage_stats_detail', methods=['GET'])
 def usage_stats():
     stats = get_usage_stats()
@@ -762,75 +891,31 @@ def usage_stats():
         return render_template('usage_stats_detail.html', stats=stats, current_user=current_user)
     return jsonify({'error': 'Không thể lấy thống kê'}), 500
 
+@app.route('/events')
+def events():
+    # Luồng Server-Sent Events: bản chụp trạng thái rồi chỉ các thay đổi (table, light, user)
+    topics = request.args.get('topics')
+    topics = set(topics.split(',')) if topics else None
+    return Response(stream_with_context(event_bus.stream(topics)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/get_current_user')
 def get_current_user():
     current_user = usage_tracker.get_current_user() if has_usage_tracker else None
     return jsonify({'user_name': current_user.get('user_name') if current_user else None})
 
-# Hằng số cho cảm biến BH1750
-DEVICE = 0x23  # Địa chỉ I2C của BH1750
-POWER_DOWN = 0x00
-POWER_ON = 0x01
-RESET = 0x07
-CONTINUOUS_HIGH_RES_MODE = 0x10
-
-# Khởi tạo I2C bus toàn cục
-try:
-    import smbus2
-    bus = smbus2.SMBus(1)  # Bus 1 trên Raspberry Pi
-    logging.info("Khởi tạo I2C bus thành công")
-except Exception as e:
-    bus = None
-    logging.error(f"Lỗi khởi tạo I2C bus: {e}")
-
 def read_light_level():
-    logging.debug("Gọi read_light_level")
-    if bus is None:
-        logging.error("I2C bus không khả dụng")
-        return 0.0
-    try:
-        bus.write_byte(DEVICE, CONTINUOUS_HIGH_RES_MODE)
-        time.sleep(0.2)
-        data = bus.read_i2c_block_data(DEVICE, CONTINUOUS_HIGH_RES_MODE, 2)
-        lux = (data[1] + (256 * data[0])) / 1.2
-        lux = round(lux, 2)
-        return lux
-    except Exception as e:
-        logging.error(f"Lỗi khi đọc cảm biến BH1750: {e}")
+    # Giá trị đã làm mượt của light_sampler; chỉ đọc cảm biến khi chưa có mẫu gần đây
+    if light_sampler is None:
         return 0.0
+    lux = light_sampler.latest(max_age=2 * LIGHT_MAX_INTERVAL)
+    if lux is None:
+        lux = light_sampler.sample_now()
+    return lux if lux is not None else 0.0
 
 def get_environment_info():
-    logging.debug("Gọi get_environment_info")
-    try:
-        api_key = "56d1bc96c2b004e6bd34089b5154da42"
-        city = "Ho+Chi+Minh+City"
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric&lang=vi"
-        logging.debug(f"OpenWeatherMap API URL: {url}")
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        logging.debug(f"OpenWeatherMap API Response: {data}")
-        if 'cod' in data and data['cod'] != 200:
-            logging.error(f"Lỗi API OpenWeatherMap: {data.get('message', 'Không rõ')}")
-            return None
-        if 'main' not in data or 'weather' not in data or 'wind' not in data or 'clouds' not in data:
-            logging.error("Dữ liệu thời tiết không đúng định dạng")
-            return None
-        info = {
-            'temperature': round(data['main']['temp'], 1),
-            'humidity': int(data['main']['humidity']),
-            'description': data['weather'][0]['description'].capitalize(),
-            'wind_speed': round(data['wind']['speed'], 1),
-            'pressure': int(data['main']['pressure']),
-            'clouds': int(data['clouds']['all'])
-        }
-        logging.info(f"Thông tin môi trường: {info}")
-        return info
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Lỗi khi gọi API OpenWeatherMap: {e}")
-        return None
-    except Exception as e:
-        logging.error(f"Lỗi không xác định trong get_environment_info: {e}")
-        return None
+    # Dữ liệu từ cache dùng chung: chỉ gọi OpenWeatherMap khi hết TTL, trả bản cũ trong lúc làm mới
+    return environment_service.weather()
 
 def stop_process(process_name):
     if process_name in processes:
@@ -860,64 +945,69 @@ def get_usage_stats():
             'users': []
         }
     try:
-        with db_lock:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT SUM(duration) FROM sessions")
-                total_time = cursor.fetchone()[0] or 0
-                today = datetime.now().strftime("%Y-%m-%d")
-                cursor.execute("SELECT SUM(duration) FROM sessions WHERE date(start_time) = ?", (today,))
-                today_time = cursor.fetchone()[0] or 0
-                week_start = (datetime.now() - timedelta(days=datetime.now().weekday())).strftime("%Y-%m-%d")
-                cursor.execute("SELECT SUM(duration) FROM sessions WHERE date(start_time) >= ?", (week_start,))
-                week_time = cursor.fetchone()[0] or 0
-                cursor.execute("SELECT COUNT(DISTINCT date(start_time)) FROM sessions")
-                days_count = cursor.fetchone()[0] or 1
-                avg_time = total_time / days_count
-                cursor.execute("SELECT position, SUM(duration) FROM positions GROUP BY position")
-                position_results = cursor.fetchall()
-                sit_time = stand_time = 0
-                for position, duration in position_results:
-                    position = position.lower() if position else ""
-                    if position in ("sit", "ngoi"):
-                        sit_time += duration
-                    elif position in ("stand", "dung"):
-                        stand_time += duration
-                total_position_time = sit_time + stand_time
-                sit_percent = (sit_time / total_position_time * 100) if total_position_time > 0 else 0
-                stand_percent = (stand_time / total_position_time * 100) if total_position_time > 0 else 0
-                cursor.execute('''
-                    SELECT COALESCE(user_name, 'Không xác định') as user,
-                           SUM(duration) as total_duration,
-                           COUNT(*) as session_count,
-                           AVG(duration) as avg_duration
-                    FROM sessions
-                    GROUP BY user_id
-                    ORDER BY total_duration DESC
-                    LIMIT 5
-                ''')
-                user_results = cursor.fetchall()
-                users = [
-                    {
-                        'user': user,
-                        'total': total_duration / 3600 if total_duration else 0,
-                        'count': session_count,
-                        'average': avg_duration / 60 if avg_duration else 0
-                    }
-                    for user, total_duration, session_count, avg_duration in user_results
-                ]
-                logging.debug(f"Usage stats: total_time={total_time/3600}, today_time={today_time/3600}, users={users}")
-                return {
-                    'total_time': total_time / 3600,
-                    'today_time': today_time / 3600,
-                    'week_time': week_time / 3600,
-                    'avg_time': avg_time / 3600,
-                    'sit_time': sit_time / 3600,
-                    'stand_time': stand_time / 3600,
-                    'sit_percent': sit_percent,
-                    'stand_percent': stand_percent,
-                    'users': users
-                }
+        cursor = database.get_connection().cursor()
+        total = database.SESSION_TOTAL
+        today = datetime.now().strftime("%Y-%m-%d")
+        week_start = (datetime.now() - timedelta(days=datetime.now().weekday())).strftime("%Y-%m-%d")
+        # Thời gian của các phiên đang mở (chưa vào bảng daily_usage), dùng chỉ mục idx_sessions_open
+        cursor.execute("SELECT date(start_time), COALESCE(duration, 0) FROM sessions WHERE end_time IS NULL")
+        open_sessions = cursor.fetchall()
+        cursor.execute("SELECT SUM(seconds) FROM daily_usage WHERE position = ?", (total,))
+        total_time = (cursor.fetchone()[0] or 0) + sum(d for _, d in open_sessions)
+        cursor.execute("SELECT SUM(seconds) FROM daily_usage WHERE position = ? AND day = ?", (total, today))
+        today_time = (cursor.fetchone()[0] or 0) + sum(d for day, d in open_sessions if day == today)
+        cursor.execute("SELECT SUM(seconds) FROM daily_usage WHERE position = ? AND day >= ?", (total, week_start))
+        week_time = (cursor.fetchone()[0] or 0) + sum(d for day, d in open_sessions if day and day >= week_start)
+        cursor.execute("SELECT COUNT(DISTINCT day) FROM daily_usage WHERE position = ?", (total,))
+        days_count = cursor.fetchone()[0] or 1
+        avg_time = total_time / days_count
+        cursor.execute("SELECT position, SUM(seconds) FROM daily_usage WHERE position != ? GROUP BY position", (total,))
+        position_results = cursor.fetchall()
+        sit_time = stand_time = 0
+        for position, duration in position_results:
+            position = position.lower() if position else ""
+            if position in ("sit", "ngoi", "sitting"):
+                sit_time += duration
+            elif position in ("stand", "dung", "standing"):
+                stand_time += duration
+        total_position_time = sit_time + stand_time
+        sit_percent = (sit_time / total_position_time * 100) if total_position_time > 0 else 0
+        stand_percent = (stand_time / total_position_time * 100) if total_position_time > 0 else 0
+        cursor.execute('''
+            SELECT COALESCE((SELECT s.user_name FROM sessions s
+                             WHERE s.user_id = d.user_id AND s.user_name IS NOT NULL
+                             ORDER BY s.id DESC LIMIT 1), 'Không xác định') as user,
+                   SUM(seconds) as total_duration,
+                   SUM(entries) as session_count,
+                   SUM(seconds) / MAX(SUM(entries), 1) as avg_duration
+            FROM daily_usage d
+            WHERE position = ?
+            GROUP BY user_id
+            ORDER BY total_duration DESC
+            LIMIT 5
+        ''', (total,))
+        user_results = cursor.fetchall()
+        users = [
+            {
+                'user': user,
+                'total': total_duration / 3600 if total_duration else 0,
+                'count': session_count,
+                'average': avg_duration / 60 if avg_duration else 0
+            }
+            for user, total_duration, session_count, avg_duration in user_results
+        ]
+        logging.debug(f"Usage stats: total_time={total_time/3600}, today_time={today_time/3600}, users={users}")
+        return {
+            'total_time': total_time / 3600,
+            'today_time': today_time / 3600,
+            'week_time': week_time / 3600,
+            'avg_time': avg_time / 3600,
+            'sit_time': sit_time / 3600,
+            'stand_time': stand_time / 3600,
+            'sit_percent': sit_percent,
+            'stand_percent': stand_percent,
+            'users': users
+        }
     except Exception as e:
         logging.error(f"Lỗi khi lấy thống kê: {e}")
         return {
@@ -936,6 +1026,10 @@ def cleanup_gpio():
     global running
     running = False
     stop_motor()
+    if height_sampler:
+        height_sampler.stop()
+    if light_sampler:
+        light_sampler.stop()
     if ena_pin:
         ena_pin.on()  # Tắt driver động cơ
     pins = [LIGHT_PIN, ENA_PIN, DIR_PIN, PUL_PIN, BTN_UP_PIN, BTN_DOWN_PIN,
@@ -957,6 +1051,9 @@ def cleanup():
     for script_name in list(processes.keys()):
         stop_process(script_name)
     cleanup_gpio()
+    if detection_listener:
+        detection_listener.close()
+    database.shutdown()
 
 if __name__ == '__main__':
     try:
@@ -1,121 +1,366 @@
 # audio_player.py - Các hàm phát âm thanh
 
 import os
+import re
+import time
+import heapq
+import shutil
+import threading
 import subprocess
+import itertools
+import wave
+from collections import OrderedDict
 from datetime import datetime
 from config import *
 
+# File chào mặc định theo buổi
+GREETING_SOUNDS = {
+    "morning": "chao_buoi_sang.mp3",
+    "afternoon": "chao_buoi_chieu.mp3",
+    "evening": "chao_buoi_toi.mp3"
+}
+WELCOME_SOUND = "welcome.mp3"
+PERSONAL_GREETING_PATTERN = re.compile(r"face_(\d+)_(morning|afternoon|evening)\.mp3$")
+
+# Độ ưu tiên trong hàng đợi phát (số nhỏ phát trước)
+PRIORITY_PERSONAL = 0
+PRIORITY_WELCOME = 1
+
+def time_bucket(hour=None):
+    """Buổi trong ngày ("morning", "afternoon", "evening") của giờ `hour` (mặc định giờ hiện tại)"""
+    if hour is None:
+        hour = datetime.now().hour
+    if 5 <= hour < 12:
+        return "morning"
+    if 12 <= hour < 18:
+        return "afternoon"
+    return "evening"
+
+def next_bucket(bucket):
+    """Buổi tiếp theo sau `bucket` (sau buổi tối là buổi sáng)"""
+    buckets = list(GREETING_SOUNDS)
+    return buckets[(buckets.index(bucket) + 1) % len(buckets)]
+
+def discover_players():
+    """Tìm các trình phát có sẵn một lần, theo thứ tự ưu tiên"""
+    players = []
+    for player_cmd in (["mpg123", "-q"], ["aplay", "-q"], ["mplayer", "-really-quiet"]):
+        path = shutil.which(player_cmd[0])
+        if path:
+            players.append([path] + player_cmd[1:])
+    return players
+
+class AudioService:
+    """Dịch vụ phát âm thanh chạy suốt vòng đời tiến trình.
+
+    Trình phát được tìm một lần khi khởi tạo. Các file chào được giải mã sẵn
+    thành PCM trong bộ nhớ và ghi vào một tiến trình aplay thường trực, nên
+    mỗi lần chào không phải tạo tiến trình mới. Yêu cầu phát đi qua hàng đợi
+    ưu tiên: yêu cầu trùng khóa với một yêu cầu đang chờ, hoặc vừa phát trong
+    AUDIO_COALESCE_WINDOW giây, bị bỏ; yêu cầu chờ quá AUDIO_MAX_DELAY giây
+    cũng bị bỏ vì chào muộn không còn ý nghĩa.
+    """
+    def __init__(self, preload=()):
+        self.players = discover_players()
+        self.mpg123 = shutil.which("mpg123")
+        self.aplay = shutil.which("aplay")
+        self.pcm = OrderedDict()  # đường dẫn -> (mtime, bytes PCM)
+        self.pcm_lock = threading.Lock()
+        self.sink = None  # Tiến trình aplay nhận PCM qua stdin
+        self.cond = threading.Condition()
+        self.heap = []
+        self.queued_keys = set()
+        self.last_played = {}
+        self.counter = itertools.count()
+        self.played = 0
+        self.dropped = 0
+        self.running = True
+        for path in preload:
+            self.load_pcm(path)
+        self.thread = threading.Thread(target=self._run, name="audio-player")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def submit(self, sound_path, key=None, priority=PRIORITY_WELCOME, pcm=None):
+        """Xếp hàng một file cần phát (kèm PCM nếu đã giải mã sẵn), trả về False nếu yêu cầu bị gộp/bỏ"""
+        key = key or sound_path
+        now = time.time()
+        with self.cond:
+            if key in self.queued_keys or now - self.last_played.get(key, 0) < AUDIO_COALESCE_WINDOW:
+                self.dropped += 1
+                return False
+            self.queued_keys.add(key)
+            heapq.heappush(self.heap, (priority, next(self.counter), now, key, sound_path, pcm))
+            self.cond.notify()
+        return True
+    
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(timeout=2)
+        if self.sink is not None:
+            self.sink.stdin.close()
+            self.sink.wait(timeout=2)
+    
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.heap or not self.running)
+                if not self.running:
+                    return
+                _, _, queued, key, sound_path, pcm = heapq.heappop(self.heap)
+                self.queued_keys.discard(key)
+                if time.time() - queued > AUDIO_MAX_DELAY:
+                    self.dropped += 1
+                    continue
+                self.last_played[key] = time.time()
+            try:
+                self.play(sound_path, pcm)
+                self.played += 1
+            except Exception as e:
+                print(f"Lỗi khi phát âm thanh: {e}")
+    
+    def play(self, sound_path, pcm=None):
+        """Phát một file (chặn cho tới khi ghi xong PCM hoặc trình phát kết thúc)"""
+        if pcm is None:
+            pcm = self.load_pcm(sound_path)
+        if pcm is not None and self._write_sink(pcm):
+            return True
+        return self._spawn(sound_path)
+    
+    def load_pcm(self, sound_path):
+        """PCM 16-bit của file (giải mã một lần, giữ trong bộ nhớ), None nếu không giải mã được"""
+        try:
+            mtime = os.stat(sound_path).st_mtime_ns
+        except OSError:
+            return None
+        with self.pcm_lock:
+            cached = self.pcm.get(sound_path)
+            if cached is not None and cached[0] == mtime:
+                self.pcm.move_to_end(sound_path)
+                return cached[1]
+        pcm = self._decode(sound_path)
+        if pcm is None:
+            return None
+        with self.pcm_lock:
+            self.pcm[sound_path] = (mtime, pcm)
+            while len(self.pcm) > AUDIO_PCM_CACHE_SIZE:
+                self.pcm.popitem(last=False)
+        return pcm
+    
+    def _decode(self, sound_path):
+        if sound_path.endswith(".wav"):
+            with wave.open(sound_path, 'rb') as f:
+                if (f.getsampwidth(), f.getframerate(), f.getnchannels()) == (2, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS):
+                    return f.readframes(f.getnframes())
+            return None
+        if self.mpg123 is None:
+            return None
+        # mpg123 -s: ghi PCM 16-bit ra stdout theo tần số/số kênh của dịch vụ
+        channels = "--stereo" if AUDIO_CHANNELS == 2 else "--mono"
+        result = subprocess.run([self.mpg123, "-q", "-s", "-r", str(AUDIO_SAMPLE_RATE), channels, sound_path],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return result.stdout if result.returncode == 0 and result.stdout else None
+    
+    def _write_sink(self, pcm):
+        if self.aplay is None:
+            return False
+        for _ in range(2):  # aplay có thể đã thoát (thiết bị âm thanh bị rút): khởi động lại một lần
+            if self.sink is None or self.sink.poll() is not None:
+                self.sink = subprocess.Popen(
+                    [self.aplay, "-q", "-t", "raw", "-f", "S16_LE", "-r", str(AUDIO_SAMPLE_RATE),
+                     "-c", str(AUDIO_CHANNELS), "-"],
+                    stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                self.sink.stdin.write(pcm)
+                self.sink.stdin.flush()
+                return True
+            except (BrokenPipeError, OSError):
+                self.sink = None
+        return False
+    
+    def _spawn(self, sound_path):
+        """Phát bằng trình phát ngoài (khi không có PCM hoặc aplay)"""
+        for player_cmd in self.players:
+            try:
+                subprocess.run(player_cmd + [sound_path], check=True)
+                return True
+            except subprocess.SubprocessError:
+                continue
+        print("Không tìm thấy trình phát âm thanh nào")
+        return False
+
+class GreetingIndex:
+    """Bảng chọn lời chào trong bộ nhớ: (face_id, buổi) -> file và PCM đã giải mã.
+
+    Bảng được dựng khi khởi động và dựng lại bởi luồng theo dõi khi thư mục
+    âm thanh hoặc thư mục khuôn mặt thay đổi (các file lời chào được ghi bằng
+    os.replace nên luôn làm đổi mtime của thư mục), hoặc khi sang buổi mới.
+    PCM của buổi hiện tại và buổi kế tiếp được giải mã sẵn và thuộc về bảng
+    (không qua LRU của AudioService, nên không bị đẩy ra khi có nhiều người
+    dùng); lần dựng lại chỉ giải mã các file mới hoặc đã đổi. Khi vừa sang buổi
+    mới, lookup() dùng ngay PCM đã giải mã cho buổi đó, không truy cập hệ thống
+    file.
+    """
+    def __init__(self, service, sounds_dir=SOUNDS_DIR, faces_dir=FACES_DIR):
+        self.service = service
+        self.sounds_dir = sounds_dir
+        self.faces_dir = faces_dir
+        self.lock = threading.Lock()
+        self.personal = {}  # (face_id, buổi) -> đường dẫn
+        self.generic = {}  # buổi hoặc "welcome" -> đường dẫn
+        self.pcm = {}  # đường dẫn -> (mtime, PCM) của các file thuộc buổi hiện tại và buổi kế tiếp
+        self.bucket = None
+        self.dir_mtimes = None
+        self.refresh()
+        self.thread = threading.Thread(target=self._watch, name="greeting-index")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def _listdir(self, directory):
+        try:
+            return os.listdir(directory)
+        except OSError:
+            return []
+    
+    def _dir_mtimes(self):
+        mtimes = []
+        for directory in (self.sounds_dir, self.faces_dir):
+            try:
+                mtimes.append(os.stat(directory).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+    
+    def refresh(self, force=False):
+        """Dựng lại bảng nếu thư mục hoặc buổi đã đổi, trả về True nếu đã dựng lại"""
+        mtimes = self._dir_mtimes()
+        bucket = time_bucket()
+        if not force and mtimes == self.dir_mtimes and bucket == self.bucket:
+            return False
+        personal = {}
+        for name in self._listdir(self.faces_dir):
+            match = PERSONAL_GREETING_PATTERN.match(name)
+            if match:
+                personal[(int(match.group(1)), match.group(2))] = os.path.join(self.faces_dir, name)
+        sounds = set(self._listdir(self.sounds_dir))
+        generic = {key: os.path.join(self.sounds_dir, name)
+                   for key, name in list(GREETING_SOUNDS.items()) + [("welcome", WELCOME_SOUND)] if name in sounds}
+        # Giải mã sẵn các file có thể được phát trong buổi này và buổi kế tiếp
+        buckets = (bucket, next_bucket(bucket))
+        wanted = [path for (_, key), path in personal.items() if key in buckets]
+        wanted += [path for path in [generic.get(key) for key in buckets] + [generic.get("welcome")] if path]
+        with self.lock:
+            previous = self.pcm
+        pcm = {}
+        for path in wanted:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            cached = previous.get(path)
+            if cached is not None and cached[0] == mtime:
+                pcm[path] = cached  # File không đổi: dùng lại, không gọi mpg123
+                continue
+            data = self.service._decode(path)
+            if data is not None:
+                pcm[path] = (mtime, data)
+        with self.lock:
+            self.personal, self.generic, self.pcm = personal, generic, pcm
+            self.bucket, self.dir_mtimes = bucket, mtimes
+        return True
+    
+    def lookup(self, face_id=None):
+        """(đường dẫn, PCM hoặc None) của lời chào cho face_id ở buổi hiện tại, dự phòng lời chào chung"""
+        bucket = time_bucket()
+        with self.lock:
+            path = self.personal.get((face_id, bucket)) if face_id is not None else None
+            path = path or self.generic.get(bucket) or self.generic.get("welcome")
+            cached = self.pcm.get(path)
+            return path, cached[1] if cached else None
+    
+    def missing_generic(self):
+        """Các file chào chung chưa có trong thư mục âm thanh"""
+        with self.lock:
+            present = set(self.generic)
+        return [name for key, name in [("welcome", WELCOME_SOUND)] + list(GREETING_SOUNDS.items()) if key not in present]
+    
+    def _watch(self):
+        while self.service.running:
+            time.sleep(GREETING_WATCH_INTERVAL)
+            try:
+                if self.refresh():
+                    print(f"Đã cập nhật bảng lời chào: {len(self.personal)} lời chào cá nhân")
+            except Exception as e:
+                print(f"Lỗi khi cập nhật bảng lời chào: {e}")
+
+_service = None
+_greetings = None
+_service_lock = threading.Lock()
+
+def get_audio_service():
+    """Dịch vụ phát dùng chung, khởi động cùng bảng lời chào ở lần dùng đầu tiên"""
+    global _service, _greetings
+    with _service_lock:
+        if _service is None:
+            _service = AudioService()
+            _greetings = GreetingIndex(_service)
+        return _service
+
+def get_greeting_index():
+    get_audio_service()
+    return _greetings
+
 def play_welcome_sound():
-    """Hàm phát âm thanh chào mừng sử dụng các công cụ có sẵn trên hệ thống"""
+    """Xếp hàng âm thanh chào mừng theo buổi, trả về True nếu được xếp hàng"""
     try:
-        # Kiểm tra thời gian để phát âm thanh phù hợp
-        current_hour = datetime.now().hour
-        
-        # Chọn file âm thanh phù hợp theo thời gian
-        if 5 <= current_hour < 12:
-            sound_file = "chao_buoi_sang.mp3"  # Âm thanh buổi sáng
-        elif 12 <= current_hour < 18:
-            sound_file = "chao_buoi_chieu.mp3"  # Âm thanh buổi chiều
-        else:
-            sound_file = "chao_buoi_toi.mp3"  # Âm thanh buổi tối
-            
-        # Đường dẫn đến file âm thanh
-        sound_path = os.path.join(SOUNDS_DIR, sound_file)
-        
-        # Nếu không tìm thấy file âm thanh cụ thể, sử dụng file mặc định
-        if not os.path.exists(sound_path):
-            default_sound = os.path.join(SOUNDS_DIR, "welcome.mp3")
-            if os.path.exists(default_sound):
-                sound_path = default_sound
-            else:
-                print(f"Không tìm thấy file âm thanh. Vui lòng tạo thư mục 'sounds' và thêm file 'welcome.mp3'")
-                return False
+        # Chọn file theo buổi (dự phòng welcome.mp3) từ bảng lời chào, không đọc thư mục
+        sound_path, pcm = get_greeting_index().lookup()
+        if sound_path is None:
+            print(f"Không tìm thấy file âm thanh. Vui lòng tạo thư mục 'sounds' và thêm file 'welcome.mp3'")
+            return False
         
         # Phát âm thanh
-        return play_sound(sound_path)
-        
+        return get_audio_service().submit(sound_path, key="welcome", priority=PRIORITY_WELCOME, pcm=pcm)
+    
     except Exception as e:
         print(f"Lỗi khi phát âm thanh: {e}")
         return False
 
 def play_personalized_greeting(person_name, face_id):
-    """Phát âm thanh chào với tên người dùng sử dụng âm thanh mặc định theo buổi"""
+    """Xếp hàng lời chào theo buổi của một người dùng, trả về True nếu được xếp hàng"""
     try:
-        # Lấy thời gian hiện tại
-        current_hour = datetime.now().hour
-        
-        # Chọn file âm thanh phù hợp theo thời gian - chỉ dùng âm thanh mặc định
-        if 5 <= current_hour < 12:
-            sound_file = "chao_buoi_sang.mp3"  # Buổi sáng
-        elif 12 <= current_hour < 18:
-            sound_file = "chao_buoi_chieu.mp3"  # Buổi chiều
-        else:
-            sound_file = "chao_buoi_toi.mp3"  # Buổi tối
-        
-        # Đường dẫn đến file âm thanh mặc định
-        default_sound = os.path.join(SOUNDS_DIR, sound_file)
-        welcome_sound = os.path.join(SOUNDS_DIR, "welcome.mp3")
-        
-        # Ưu tiên sử dụng âm thanh theo thời gian
-        if os.path.exists(default_sound):
-            sound_path = default_sound
-            print(f"Phát âm thanh theo thời gian cho {person_name}")
-        elif os.path.exists(welcome_sound):
-            sound_path = welcome_sound
-            print(f"Phát âm thanh chào mặc định cho {person_name}")
-        else:
+        # Ưu tiên face_{id}_{buổi}.mp3, dự phòng âm thanh chung theo buổi rồi welcome.mp3
+        sound_path, pcm = get_greeting_index().lookup(face_id)
+        if sound_path is None:
             print("Không tìm thấy file âm thanh")
             return False
         
-        # Phát âm thanh
-        return play_sound(sound_path)
+        # Chào cá nhân được ưu tiên hơn lời chào chung đang chờ
+        queued = get_audio_service().submit(sound_path, key=f"face:{face_id}", priority=PRIORITY_PERSONAL, pcm=pcm)
+        if queued:
+            print(f"Phát âm thanh chào cho {person_name}")
+        return queued
     
     except Exception as e:
         print(f"Lỗi khi phát âm thanh cá nhân hóa: {e}")
         return False
 
 def play_sound(sound_path):
-    """Phát file âm thanh sử dụng các trình phát có sẵn"""
-    players = [
-        ["mpg123", "-q"],
-        ["aplay", "-q"],
-        ["mplayer", "-really-quiet"]
-    ]
-    
-    for player_cmd in players:
-        try:
-            # Kiểm tra xem command có tồn tại không
-            subprocess.run(["which", player_cmd[0]], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            # Chạy lệnh phát nhạc
-            cmd = player_cmd + [sound_path]
-            subprocess.run(cmd, check=True)
-            
-            # Nếu thành công, dừng vòng lặp
-            print(f"Đã phát âm thanh bằng {player_cmd[0]}")
-            return True
-        except subprocess.SubprocessError:
-            continue
-    
-    print("Không tìm thấy trình phát âm thanh nào")
-    return False
+    """Phát file âm thanh ngay (chặn) qua dịch vụ phát, không qua hàng đợi"""
+    try:
+        return get_audio_service().play(sound_path)
+    except Exception as e:
+        print(f"Lỗi khi phát âm thanh: {e}")
+        return False
 
 def check_sound_files():
     """Kiểm tra xem các file âm thanh có tồn tại không"""
     os.makedirs(SOUNDS_DIR, exist_ok=True)
-    
-    required_files = [
-        "welcome.mp3",
-        "chao_buoi_sang.mp3",
-        "chao_buoi_chieu.mp3",
-        "chao_buoi_toi.mp3"
-    ]
-    
-    missing_files = []
-    for filename in required_files:
-        file_path = os.path.join(SOUNDS_DIR, filename)
-        if not os.path.exists(file_path):
-            missing_files.append(filename)
+    greetings = get_greeting_index()
+    greetings.refresh()
+    missing_files = greetings.missing_generic()
     
     if missing_files:
         print("Cảnh báo: Các file âm thanh sau không tồn tại:")
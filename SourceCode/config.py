@@ -13,13 +13,100 @@ MODELS_DIR = os.path.join(BASE_PATH, "models")
 
 # Cấu hình nhận diện
 FACE_MODEL_PATH = os.path.join(MODELS_DIR, "face_model.yml")
-FACE_MAPPING_PATH = os.path.join(FACES_DIR, "face_mapping.pkl")
+FACE_MAPPING_PATH = os.path.join(FACES_DIR, "face_mapping.pkl")  # Định dạng cũ, chỉ dùng khi nhập vào kho mẫu
+FACE_STORE_PATH = os.path.join(FACES_DIR, "face_samples.u8")  # Mẫu khuôn mặt đã chuẩn hóa, ghi liên tiếp
+FACE_INDEX_PATH = os.path.join(FACES_DIR, "face_index.json")  # Nhãn của từng mẫu và thông tin người dùng
+FACE_SAMPLE_SIZE = 100  # Kích thước (pixel) của mẫu khuôn mặt đã chuẩn hóa
 FACE_CONFIDENCE_THRESHOLD = 70  # Ngưỡng tin cậy cho nhận diện khuôn mặt
 
+# Backend nhận diện (face_recognizers.py): "lbph" hoặc "embedding"
+FACE_RECOGNIZER_BACKEND = "lbph"
+FACE_EMBEDDING_MODEL = os.path.join(MODELS_DIR, "nn4.small2.v1.t7")  # Mô hình OpenFace cho OpenCV DNN
+FACE_EMBEDDING_PATH = os.path.join(MODELS_DIR, "face_embeddings.npz")  # Ma trận embedding của các mẫu
+FACE_EMBEDDING_INPUT = 96  # Kích thước đầu vào của mô hình embedding
+FACE_EMBEDDING_SIZE = 128  # Số chiều của vector đặc trưng
+FACE_EMBEDDING_THRESHOLD = 0.6  # Độ tương đồng cosine tối thiểu để coi là cùng một người
+
+# Đăng ký khuôn mặt nhiều khung hình
+ENROLL_FRAMES = 15  # Số khung hình chụp trong một lần đăng ký
+ENROLL_DURATION = 3  # Thời gian chụp (giây), người dùng nên xoay nhẹ đầu
+ENROLL_KEEP_SAMPLES = 5  # Số mẫu tốt nhất được lưu
+ENROLL_MIN_FACE_SIZE = 60  # Bỏ khuôn mặt nhỏ hơn x pixel
+ENROLL_TARGET_FACE_SIZE = 150  # Khuôn mặt từ x pixel trở lên được điểm kích thước tối đa
+ENROLL_SHARPNESS_TARGET = 100  # Phương sai Laplacian của mẫu chuẩn hóa được coi là đủ nét
+ENROLL_MIN_SCORE = 0.2  # Điểm chất lượng tối thiểu của một mẫu
+ENROLL_MIN_DIFFERENCE = 4  # Chênh lệch mức xám trung bình tối thiểu giữa hai mẫu được giữ
+
 # Cấu hình YOLO
 YOLO_CONFIG = os.path.join(BASE_PATH, 'yolov4-tiny.cfg')
 YOLO_WEIGHTS = os.path.join(BASE_PATH, 'yolov4-tiny.weights')
 YOLO_CLASSES = os.path.join(BASE_PATH, 'coco.names')
+YOLO_CONFIDENCE_THRESHOLD = 0.5  # Ngưỡng tin cậy của lớp 'person'
+YOLO_NMS_THRESHOLD = 0.4  # Ngưỡng IoU khi loại bỏ các box chồng chéo (NMS)
+
+# Hồ sơ phát hiện người: kích thước đầu vào YOLO (320/416/608) và có cắt vùng
+# quanh box người lần trước (ROI) hay không
+DETECTION_PROFILES = {
+    "fast": {"input_size": 320, "roi": True},
+    "balanced": {"input_size": 416, "roi": False},
+    "accurate": {"input_size": 608, "roi": False}
+}
+DETECTION_PROFILE = "balanced"
+ROI_MARGIN = 0.5  # Nới box người thêm x lần chiều rộng/cao về mỗi phía
+ROI_FULL_SCAN_INTERVAL = 10  # Quét toàn khung hình sau mỗi x lần chỉ quét ROI
+
+# Hồ sơ phát hiện khuôn mặt (Haar cascade): tỷ lệ thu nhỏ ảnh trước khi quét,
+# tham số detectMultiScale (min_size tính theo pixel khung hình gốc) và có chỉ
+# quét vùng quanh khuôn mặt lần trước/phần trên box người (ROI) hay không
+FACE_DETECTION_PROFILES = {
+    "fast": {"scale": 0.5, "scale_factor": 1.2, "min_neighbors": 4, "min_size": 48, "roi": True},
+    "balanced": {"scale": 0.5, "scale_factor": 1.1, "min_neighbors": 5, "min_size": 48, "roi": True},
+    "accurate": {"scale": 1.0, "scale_factor": 1.1, "min_neighbors": 5, "min_size": 30, "roi": False}
+}
+FACE_DETECTION_PROFILE = "balanced"
+FACE_ROI_MARGIN = 0.5  # Nới vùng khuôn mặt lần trước thêm x lần kích thước về mỗi phía
+FACE_PERSON_UPPER = 0.5  # Khuôn mặt nằm trong x phần trên của box người
+FACE_FULL_SCAN_INTERVAL = 10  # Quét toàn khung hình sau mỗi x lần chỉ quét ROI
+
+# Điều khiển module_ai khi chạy không màn hình (ai_control.py)
+AI_CONTROL_HOST = "127.0.0.1"  # Địa chỉ app.py dùng để gửi lệnh tới module_ai
+# Giao diện mạng máy chủ điều khiển lắng nghe: "0.0.0.0" để xem preview từ máy khác,
+# "127.0.0.1" để chỉ truy cập trên Pi
+AI_CONTROL_BIND = os.environ.get("AI_CONTROL_BIND", "0.0.0.0")
+# /register và /rebuild chỉ nhận từ loopback; máy khác phải gửi header X-Control-Token
+# trùng giá trị này (rỗng = không cho phép từ máy khác)
+AI_CONTROL_TOKEN = os.environ.get("AI_CONTROL_TOKEN", "")
+AI_CONTROL_PORT = 8765
+AI_PREVIEW_FPS = 2  # Tốc độ tối đa của ảnh xem trước MJPEG
+AI_PREVIEW_WIDTH = 320  # Ảnh xem trước được thu nhỏ về chiều rộng này
+AI_PREVIEW_QUALITY = 70  # Chất lượng JPEG của ảnh xem trước
+
+# Tổng hợp giọng nói lời chào (tts_generator.py)
+TTS_ENGINE = "voicerss"
+TTS_VOICE = "vi-vn"
+TTS_API_URL = os.environ.get("TTS_API_URL", "https://api.voicerss.org/")
+TTS_API_KEY = os.environ.get("VOICERSS_API_KEY", "YOUR_API_KEY")  # Đăng ký tại https://www.voicerss.org/
+TTS_TIMEOUT = 5  # Chờ API tối đa x giây rồi chuyển sang espeak
+TTS_CACHE_DIR = os.path.join(SOUNDS_DIR, "tts")  # File âm thanh đặt tên theo hash(văn bản, giọng, engine)
+
+# Dịch vụ phát âm thanh (audio_player.py)
+AUDIO_SAMPLE_RATE = 44100  # PCM giải mã sẵn và tiến trình aplay thường trực dùng chung định dạng này
+AUDIO_CHANNELS = 2
+AUDIO_PCM_CACHE_SIZE = 16  # Số file đã giải mã giữ trong bộ nhớ
+AUDIO_COALESCE_WINDOW = 10  # Bỏ yêu cầu trùng khóa với lần phát cách đây chưa tới x giây
+AUDIO_MAX_DELAY = 5  # Bỏ yêu cầu đã chờ quá x giây trong hàng đợi
+GREETING_WATCH_INTERVAL = 5  # Kiểm tra thư mục âm thanh/khuôn mặt thay đổi mỗi x giây
+
+# Dữ liệu môi trường OpenWeatherMap (environment_service.py)
+ENV_API_BASE_URL = os.environ.get("OPENWEATHER_BASE_URL", "http://api.openweathermap.org/data/2.5")
+ENV_API_KEY = os.environ.get("OPENWEATHER_API_KEY", "56d1bc96c2b004e6bd34089b5154da42")
+ENV_CITY = "Ho Chi Minh City"
+ENV_LAT, ENV_LON = 10.7758, 106.7018  # Tọa độ TP. Hồ Chí Minh
+ENV_TTL = {"weather": 600, "uv": 1800, "air": 1800}  # Thời gian (giây) dữ liệu của mỗi endpoint còn mới
+ENV_MAX_STALE = 24 * 3600  # Dữ liệu cũ hơn x giây không được trả ngay mà phải chờ lấy lại
+ENV_TIMEOUT = 5  # Thời gian chờ tối đa mỗi lần gọi API (giây)
+ENV_RETRY_BACKOFF = 60  # Sau một lần gọi lỗi, không gọi lại endpoint đó trong x giây
+ENV_SNAPSHOT_PATH = os.path.join(BASE_PATH, "data", "environment_snapshot.json")
 
 # Cấu hình camera
 CAMERA_WIDTH = 640
@@ -33,6 +120,24 @@ WELCOME_COOLDOWN = 30  # Thời gian chờ giữa các lần chào chung (giây)
 DETECTION_INTERVAL = 5  # Phát hiện người mỗi x khung hình
 FACE_DETECTION_INTERVAL = 10  # Nhận diện khuôn mặt mỗi x khung hình
 
+# Cổng chuyển động (motion_gate.py)
+MOTION_THUMBNAIL_SIZE = (80, 60)  # Kích thước ảnh xám thu nhỏ dùng để so sánh
+MOTION_PIXEL_THRESHOLD = 15  # Chênh lệch mức xám để coi một điểm ảnh là thay đổi
+MOTION_MIN_AREA = 0.005  # Tỷ lệ điểm ảnh thay đổi tối thiểu để coi là có chuyển động
+MOTION_BACKGROUND_RATE = 0.05  # Tốc độ cập nhật nền
+MOTION_ACTIVE_HOLD = 3  # Giữ chu kỳ gốc thêm x giây sau chuyển động cuối cùng
+MOTION_IDLE_RAMP = 10  # Mỗi x giây đứng yên, chu kỳ dài thêm một lần chu kỳ gốc
+MOTION_MAX_IDLE_FACTOR = 20  # Chu kỳ tối đa khi cảnh đứng yên (bội số của chu kỳ gốc)
+
+# Theo dõi khuôn mặt (face_tracker.py)
+TRACK_IOU_THRESHOLD = 0.3  # IoU tối thiểu để ghép box mới với track cũ
+TRACK_MAX_CENTROID_DISTANCE = 1.0  # Hoặc tâm lệch không quá x lần kích thước box
+TRACK_MAX_MISSED = 5  # Xóa track không được ghép trong x lần phát hiện khuôn mặt liên tiếp (đếm lần chạy, không đếm giây, vì cổng chuyển động kéo dài chu kỳ khi cảnh đứng yên)
+TRACK_HISTORY = 10  # Số kết quả nhận diện giữ lại cho mỗi track
+TRACK_CONFIDENCE_HALF_LIFE = 30  # Độ tin cậy giảm một nửa sau x giây không nhận diện lại
+TRACK_MIN_CONFIDENCE = 35  # Nhận diện lại khi độ tin cậy (%) giảm dưới ngưỡng này
+TRACK_UNKNOWN_RETRY = 3  # Thử nhận diện lại khuôn mặt chưa biết sau x giây
+
 # Tạo các thư mục cần thiết
 def create_directories():
     """Tạo các thư mục cần thiết nếu chưa tồn tại"""
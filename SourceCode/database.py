@@ -0,0 +1,314 @@
+# database.py - Lớp truy cập SQLite dùng chung cho app, usage_tracker và height_preferences
+import os
+import queue
+import sqlite3
+import threading
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import Future
+
+# Đường dẫn đến file database
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_PATH, "data", "usage_stats.db")
+
+# Pragma áp dụng cho mọi kết nối. WAL cho phép đọc song song trong khi ghi.
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", -4000),  # ~4 MB
+    ("busy_timeout", 10000)
+)
+STATEMENT_CACHE_SIZE = 128  # Số câu lệnh đã biên dịch giữ lại trên mỗi kết nối
+POOL_SIZE = 4  # Số kết nối rảnh giữ lại để dùng lại cho các luồng sau
+SCHEMA_VERSION = 1  # Lưu trong PRAGMA user_version
+SESSION_TOTAL = ''  # Giá trị cột position của daily_usage cho tổng thời gian phiên
+
+_local = threading.local()
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_init_lock = threading.Lock()
+_initialized = False
+_writer = None
+
+def _connect():
+    """Mở kết nối mới và áp dụng các pragma"""
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    # Kết nối được chuyển giữa các luồng qua pool, nhưng mỗi lúc chỉ một luồng dùng
+    conn = sqlite3.connect(DB_PATH, timeout=10, cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False)
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+class _Lease:
+    """Kết nối mượn từ pool cho một luồng; trả lại pool khi luồng kết thúc"""
+    def __init__(self):
+        try:
+            self.conn = _pool.get_nowait()
+        except queue.Empty:
+            self.conn = _connect()
+
+    def __del__(self):
+        # threading.local bị xóa khi luồng kết thúc (werkzeug tạo một luồng cho mỗi request)
+        try:
+            _pool.put_nowait(self.conn)
+        except queue.Full:
+            self.conn.close()
+
+def get_connection():
+    """Kết nối của luồng hiện tại, mượn từ pool ở lần gọi đầu tiên của luồng.
+
+    sqlite3 giữ bộ đệm câu lệnh đã chuẩn bị theo từng kết nối, nên dùng lại
+    kết nối đồng nghĩa với dùng lại các câu lệnh đã biên dịch. Luồng ngắn hạn
+    (mỗi request Flask) nhận lại kết nối đã mở thay vì mở mới và chạy lại pragma.
+    """
+    lease = getattr(_local, 'lease', None)
+    if lease is None:
+        lease = _local.lease = _Lease()
+    return lease.conn
+
+def fetchone(sql, params=()):
+    """Chạy truy vấn đọc trên kết nối của luồng hiện tại và trả về một dòng"""
+    return get_connection().execute(sql, params).fetchone()
+
+def fetchall(sql, params=()):
+    """Chạy truy vấn đọc trên kết nối của luồng hiện tại và trả về mọi dòng"""
+    return get_connection().execute(sql, params).fetchall()
+
+class WriteQueue:
+    """Hàng đợi ghi duy nhất: một luồng nền thực hiện tuần tự mọi thao tác ghi.
+
+    Mỗi công việc là hàm func(conn, *args) chạy trong một giao dịch; lỗi được
+    rollback và trả lại cho bên gọi qua Future.
+    """
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="db-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, func, *args):
+        future = Future()
+        self.jobs.put((func, args, future))
+        return future
+
+    def _run(self):
+        conn = _connect()  # Kết nối riêng của luồng ghi, không lấy từ pool đọc
+        while True:
+            func, args, future = self.jobs.get()
+            if func is None:
+                conn.close()
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with conn:
+                    result = func(conn, *args)
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+
+    def stop(self):
+        self.jobs.put((None, None, None))
+        self.thread.join(timeout=2)
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        with _init_lock:
+            if _writer is None:
+                _writer = WriteQueue()
+    return _writer
+
+def write(func, *args, timeout=10):
+    """Đưa func(conn, *args) vào hàng đợi ghi, chờ và trả về kết quả"""
+    return _get_writer().submit(func, *args).result(timeout=timeout)
+
+def write_async(func, *args):
+    """Đưa func(conn, *args) vào hàng đợi ghi mà không chờ, trả về Future"""
+    return _get_writer().submit(func, *args)
+
+def _create_sessions_table(conn, name="sessions"):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            user_name TEXT,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            duration REAL,
+            notes TEXT
+        )
+    ''')
+
+def _create_schema(conn):
+    _create_sessions_table(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS positions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            user_id TEXT,
+            position TEXT,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            duration REAL,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_heights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            sitting_height REAL,
+            standing_height REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS height_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            position TEXT,
+            height REAL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_usage (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            position TEXT NOT NULL,
+            seconds REAL NOT NULL DEFAULT 0,
+            entries INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, position)
+        ) WITHOUT ROWID
+    ''')
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def _drop_unique_user_id(conn):
+    """Bỏ ràng buộc UNIQUE trên sessions.user_id của các database cũ.
+
+    Ràng buộc này khiến mỗi người dùng chỉ có được một phiên.
+    """
+    unique = [row for row in conn.execute("PRAGMA index_list(sessions)") if row[2] and row[3] == 'u']
+    if not unique:
+        return
+    columns = ', '.join(c for c in _columns(conn, "sessions")
+                        if c in ('id', 'user_id', 'user_name', 'start_time', 'end_time', 'duration', 'notes'))
+    _create_sessions_table(conn, "sessions_new")
+    conn.execute(f"INSERT INTO sessions_new ({columns}) SELECT {columns} FROM sessions")
+    conn.execute("DROP TABLE sessions")
+    conn.execute("ALTER TABLE sessions_new RENAME TO sessions")
+    logging.info("Đã bỏ ràng buộc UNIQUE trên sessions.user_id")
+
+def _migrate_v1(conn):
+    """Thêm chỉ mục và bảng tổng hợp daily_usage, điền dữ liệu từ các phiên cũ"""
+    _drop_unique_user_id(conn)
+    # Database rất cũ có bảng positions thiếu các cột này
+    existing = _columns(conn, "positions")
+    for column, column_type in (("user_id", "TEXT"), ("start_time", "TIMESTAMP"), ("end_time", "TIMESTAMP")):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE positions ADD COLUMN {column} {column_type}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_start_time ON sessions(start_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_open ON sessions(user_id, start_time) WHERE end_time IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_user_id ON positions(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_session_id ON positions(session_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_positions_open ON positions(session_id) WHERE end_time IS NULL")
+    conn.execute("DELETE FROM daily_usage")
+    # Điền từng phiên qua add_daily_usage để phiên qua nửa đêm cũng được chia theo ngày
+    rows = conn.execute('''
+        SELECT user_id, start_time, duration FROM sessions
+        WHERE end_time IS NOT NULL AND start_time IS NOT NULL
+    ''').fetchall()
+    for user_id, start_time, duration in rows:
+        add_daily_usage(conn, user_id, start_time, duration)
+    rows = conn.execute('''
+        SELECT user_id, start_time, duration, position FROM positions
+        WHERE end_time IS NOT NULL AND start_time IS NOT NULL AND COALESCE(position, '') != ''
+    ''').fetchall()
+    for user_id, start_time, duration, position in rows:
+        add_daily_usage(conn, user_id, start_time, duration, position)
+
+MIGRATIONS = {1: _migrate_v1}
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            MIGRATIONS[target](conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logging.info(f"Đã nâng cấp cơ sở dữ liệu lên phiên bản {target}")
+
+def split_by_day(start_time, seconds):
+    """Chia khoảng thời gian bắt đầu từ `start_time` thành [(ngày, số giây)] tại các mốc nửa đêm"""
+    try:
+        start = datetime.fromisoformat(str(start_time))
+    except ValueError:
+        return [(str(start_time)[:10], seconds)]  # Định dạng lạ: tính cả vào ngày bắt đầu
+    parts = []
+    remaining = seconds
+    while remaining > 0:
+        midnight = start.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        chunk = min(remaining, (midnight - start).total_seconds())
+        parts.append((start.date().isoformat(), chunk))
+        remaining -= chunk
+        start = midnight
+    return parts
+
+def add_daily_usage(conn, user_id, start_time, seconds, position=SESSION_TOTAL):
+    """Cộng dồn thời gian đã kết thúc vào bảng daily_usage (gọi trong công việc ghi).
+
+    Phiên kéo qua nửa đêm được chia cho từng ngày theo số giây thực tế; mỗi ngày
+    mà phiên chạm tới được tính thêm một lượt (entries).
+    """
+    if not start_time or not seconds or seconds <= 0:
+        return
+    for day, day_seconds in split_by_day(start_time, seconds):
+        conn.execute('''
+            INSERT INTO daily_usage (user_id, day, position, seconds, entries)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (user_id, day, position)
+            DO UPDATE SET seconds = seconds + excluded.seconds, entries = entries + 1
+        ''', (str(user_id or ''), day, (position or SESSION_TOTAL).lower(), day_seconds))
+
+def init_database():
+    """Tạo các bảng nếu chưa có (chỉ chạy một lần cho mỗi tiến trình)"""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = _connect()
+        try:
+            with conn:
+                _create_schema(conn)
+            conn.isolation_level = None  # Tự quản lý giao dịch khi nâng cấp schema
+            _migrate(conn)
+        finally:
+            conn.close()
+        _initialized = True
+        logging.info("Khởi tạo cơ sở dữ liệu thành công")
+
+def shutdown():
+    """Dừng luồng ghi và đóng kết nối của luồng hiện tại cùng các kết nối rảnh trong pool"""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+    _local.lease = None  # __del__ trả kết nối của luồng này về pool trước khi đóng tất cả
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
@@ -0,0 +1,123 @@
+# detection_bus.py - Kênh IPC nhị phân (Unix datagram socket) từ module_ai sang app.py
+
+import os
+import socket
+import struct
+import time
+import logging
+from collections import namedtuple
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.path.join(BASE_PATH, "data", "detection.sock")
+
+# epoch (ngẫu nhiên cho mỗi tiến trình module_ai), seq, thời điểm, độ tin cậy,
+# số người (box YOLO), user_id, tên (UTF-8, đệm byte 0)
+RECORD_FORMAT = struct.Struct("<IIdfH32s64s")
+HEARTBEAT_INTERVAL = 2  # Gửi lại bản ghi mới nhất định kỳ để app khởi động sau vẫn nhận được
+
+DetectionRecord = namedtuple("DetectionRecord", "epoch seq timestamp confidence box_count user_id user_name")
+
+def _encode(text, size):
+    data = (text or "").encode("utf-8")[:size]
+    # Không cắt giữa một ký tự UTF-8 nhiều byte
+    return data.decode("utf-8", errors="ignore").encode("utf-8")
+
+def pack_record(epoch, seq, timestamp, confidence, box_count, user_id, user_name):
+    return RECORD_FORMAT.pack(epoch, seq & 0xFFFFFFFF, timestamp, confidence, min(box_count, 0xFFFF),
+                              _encode(user_id, 32), _encode(user_name, 64))
+
+def unpack_record(data):
+    epoch, seq, timestamp, confidence, box_count, user_id, user_name = RECORD_FORMAT.unpack(data)
+    return DetectionRecord(epoch, seq, timestamp, confidence, box_count,
+                           user_id.rstrip(b"\0").decode("utf-8"), user_name.rstrip(b"\0").decode("utf-8"))
+
+class DetectionPublisher:
+    """Phía module_ai: gửi bản ghi khi người dùng hoặc số người thay đổi.
+
+    Không ghi gì xuống thẻ nhớ; nếu app.py chưa chạy thì bản ghi bị bỏ qua và
+    được gửi lại ở nhịp heartbeat tiếp theo.
+    """
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # seq bắt đầu lại từ 0 mỗi khi module_ai khởi động lại; epoch giúp app.py
+        # phân biệt bản ghi của tiến trình mới với bản ghi cũ có cùng seq
+        self.epoch = struct.unpack("<I", os.urandom(4))[0]
+        self.seq = 0
+        self.user_id = ""
+        self.user_name = ""
+        self.confidence = 0.0
+        self.box_count = 0
+        self.last_sent = 0.0
+
+    def set_user(self, user, confidence=0.0):
+        """Cập nhật người dùng nhận diện được ({"user_id", "user_name"} hoặc None)"""
+        user_id = str(user.get("user_id", "")) if user else ""
+        user_name = user.get("user_name", "") if user else ""
+        changed = user_id != self.user_id or user_name != self.user_name
+        self.user_id, self.user_name = user_id, user_name
+        self.confidence = confidence if user else 0.0
+        self._update(changed)
+
+    def set_box_count(self, box_count):
+        """Cập nhật số người YOLO phát hiện trong khung hình"""
+        changed = box_count != self.box_count
+        self.box_count = box_count
+        self._update(changed)
+
+    def _update(self, changed):
+        if changed:
+            self.seq += 1
+            self._send()
+        elif time.monotonic() - self.last_sent >= HEARTBEAT_INTERVAL:
+            self._send()
+
+    def _send(self):
+        self.last_sent = time.monotonic()
+        record = pack_record(self.epoch, self.seq, time.time(), self.confidence, self.box_count,
+                             self.user_id, self.user_name)
+        try:
+            self.sock.sendto(record, self.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass  # app.py chưa lắng nghe
+        except OSError as e:
+            logging.debug(f"Không gửi được bản ghi nhận diện: {e}")
+
+    def close(self):
+        self.sock.close()
+
+class DetectionListener:
+    """Phía app.py: chặn tới khi có bản ghi mới thay vì đọc file định kỳ"""
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)  # Socket cũ của lần chạy trước
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.last_key = None  # (epoch, seq) của bản ghi trước
+        self.latest = None
+
+    def wait(self, timeout=None):
+        """Chờ bản ghi kế tiếp; trả về (bản ghi, có thay đổi hay không) hoặc (None, False) khi hết giờ"""
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(RECORD_FORMAT.size)
+        except socket.timeout:
+            return None, False
+        if len(data) != RECORD_FORMAT.size:
+            logging.warning(f"Bỏ qua bản ghi nhận diện sai kích thước: {len(data)} byte")
+            return None, False
+        record = unpack_record(data)
+        key = (record.epoch, record.seq)
+        changed = key != self.last_key
+        self.last_key = key
+        self.latest = record
+        return record, changed
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,184 @@
+# environment_service.py - Dịch vụ dữ liệu môi trường (thời tiết, UV, chất lượng không khí) có cache dùng chung
+
+import os
+import json
+import time
+import threading
+import logging
+import requests
+from config import *
+
+def parse_weather(data):
+    if 'cod' in data and str(data['cod']) != '200':
+        raise ValueError(f"Lỗi API OpenWeatherMap: {data.get('message', 'Không rõ')}")
+    if 'main' not in data or 'weather' not in data or 'wind' not in data or 'clouds' not in data:
+        raise ValueError("Dữ liệu thời tiết không đúng định dạng")
+    return {
+        'temperature': round(data['main']['temp'], 1),
+        'humidity': int(data['main']['humidity']),
+        'description': data['weather'][0]['description'].capitalize(),
+        'wind_speed': round(data['wind']['speed'], 1),
+        'pressure': int(data['main']['pressure']),
+        'clouds': int(data['clouds']['all'])
+    }
+
+def parse_uv(data):
+    # Phân loại chỉ số UV
+    uv_value = data['value']
+    if uv_value <= 2:
+        uv_description = "Thấp"
+    elif uv_value <= 5:
+        uv_description = "Trung bình"
+    elif uv_value <= 7:
+        uv_description = "Cao"
+    elif uv_value <= 10:
+        uv_description = "Rất cao"
+    else:
+        uv_description = "Nguy hiểm"
+    return {'value': uv_value, 'description': uv_description}
+
+def parse_air_quality(data):
+    if 'list' not in data or not data['list']:
+        raise ValueError("Dữ liệu chất lượng không khí không đúng định dạng")
+    aqi = data['list'][0]['main']['aqi']
+    aqi_descriptions = {
+        1: "Rất tốt",
+        2: "Tốt",
+        3: "Trung bình",
+        4: "Kém",
+        5: "Rất kém"
+    }
+    return {'aqi': aqi, 'description': aqi_descriptions.get(aqi, "Không xác định")}
+
+# Tên -> (đường dẫn API, tham số, hàm phân tích)
+ENDPOINTS = {
+    "weather": ("weather", {'q': ENV_CITY, 'units': 'metric', 'lang': 'vi'}, parse_weather),
+    "uv": ("uvi", {'lat': ENV_LAT, 'lon': ENV_LON}, parse_uv),
+    "air": ("air_pollution", {'lat': ENV_LAT, 'lon': ENV_LON}, parse_air_quality)
+}
+
+class EnvironmentService:
+    """Cache dữ liệu môi trường dùng chung cho app.py và TestAPIMoiTruong.py.
+
+    Mỗi endpoint có TTL riêng (ENV_TTL). Hết TTL nhưng chưa quá ENV_MAX_STALE
+    thì trả ngay bản cũ và làm mới trong nền (stale-while-revalidate); các lần
+    làm mới đồng thời của cùng một endpoint chỉ gọi API một lần (single-flight).
+    Bản tốt gần nhất được lưu vào ENV_SNAPSHOT_PATH để trang tải ngay sau khi
+    khởi động lại. Sau một lần gọi lỗi, endpoint đó không được gọi lại trong
+    ENV_RETRY_BACKOFF giây (trả bản đang có hoặc None) để mỗi lượt tải trang
+    không tạo thêm request hay phải chờ khi API đang hỏng.
+    """
+    def __init__(self, base_url=ENV_API_BASE_URL, api_key=ENV_API_KEY, snapshot_path=ENV_SNAPSHOT_PATH):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.snapshot_path = snapshot_path
+        self.lock = threading.Lock()
+        self.entries = {}  # tên -> {"data": ..., "fetched": thời điểm}
+        self.inflight = {}  # tên -> threading.Event của lần làm mới đang chạy
+        self.failed_at = {}  # tên -> thời điểm lần gọi lỗi gần nhất
+        self.api_calls = 0
+        self.load_snapshot()
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            self.entries = {name: entry for name, entry in entries.items() if name in ENDPOINTS}
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save_snapshot(self):
+        with self.lock:
+            entries = dict(self.entries)
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            temp_path = self.snapshot_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            logging.error(f"Không lưu được dữ liệu môi trường: {e}")
+
+    def get(self, name):
+        """Dữ liệu đã phân tích của endpoint `name`, None nếu chưa từng lấy được"""
+        with self.lock:
+            entry = self.entries.get(name)
+            failed_at = self.failed_at.get(name)
+        now = time.time()
+        age = now - entry["fetched"] if entry else None
+        if entry and age < ENV_TTL[name]:
+            return entry["data"]
+        if failed_at is not None and now - failed_at < ENV_RETRY_BACKOFF:
+            return entry["data"] if entry else None
+        if entry and age < ENV_MAX_STALE:
+            self.refresh(name, wait=False)
+            return entry["data"]
+        return self.refresh(name, wait=True)
+
+    def fetched_at(self, name):
+        """Thời điểm lấy được dữ liệu hiện có của endpoint, None nếu chưa có"""
+        with self.lock:
+            entry = self.entries.get(name)
+        return entry["fetched"] if entry else None
+
+    def refresh(self, name, wait=True):
+        """Làm mới một endpoint; chỉ một luồng gọi API, các luồng khác chờ kết quả đó"""
+        with self.lock:
+            event = self.inflight.get(name)
+            leader = event is None
+            if leader:
+                event = self.inflight[name] = threading.Event()
+        if leader:
+            if wait:
+                self._fetch(name, event)
+            else:
+                thread = threading.Thread(target=self._fetch, args=(name, event), name=f"env-{name}")
+                thread.daemon = True
+                thread.start()
+        if wait:
+            event.wait(ENV_TIMEOUT + 1)
+        with self.lock:
+            entry = self.entries.get(name)
+        return entry["data"] if entry else None
+
+    def _fetch(self, name, event):
+        path, params, parse = ENDPOINTS[name]
+        try:
+            self.api_calls += 1
+            response = requests.get(f"{self.base_url}/{path}", params=dict(params, appid=self.api_key),
+                                    timeout=ENV_TIMEOUT)
+            data = parse(response.json())
+            with self.lock:
+                self.entries[name] = {"data": data, "fetched": time.time()}
+                self.failed_at.pop(name, None)
+            self.save_snapshot()
+            logging.info(f"Đã cập nhật dữ liệu môi trường '{name}': {data}")
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            # Giữ bản tốt gần nhất (nếu có) và tạm dừng gọi lại endpoint này
+            with self.lock:
+                self.failed_at[name] = time.time()
+            logging.error(f"Lỗi khi lấy dữ liệu môi trường '{name}': {e}")
+        finally:
+            with self.lock:
+                del self.inflight[name]
+            event.set()
+
+    def weather(self):
+        return self.get("weather")
+
+    def uv_index(self):
+        return self.get("uv")
+
+    def air_quality(self):
+        return self.get("air")
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_environment_service():
+    """Dịch vụ dùng chung trong tiến trình"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EnvironmentService()
+        return _service
@@ -0,0 +1,86 @@
+# event_bus.py - Kênh publish/subscribe trong tiến trình cho luồng Server-Sent Events
+
+import copy
+import json
+import queue
+import threading
+
+_MISSING = object()  # Đánh dấu khóa chưa có trong trạng thái (khác cả None)
+
+class EventBus:
+    """Lưu trạng thái mới nhất theo từng chủ đề và chỉ phát phần thay đổi.
+
+    Các luồng phần cứng gọi `publish(topic, data)`; mỗi kết nối SSE giữ một
+    hàng đợi riêng có giới hạn, khi đầy thì bỏ sự kiện cũ nhất.
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.state = {}
+        self.subscribers = {}  # hàng đợi -> tập chủ đề quan tâm (None = tất cả)
+        self.lock = threading.Lock()
+
+    def publish(self, topic, data):
+        """Gộp `data` vào trạng thái của `topic`, phát các khóa có giá trị thay đổi"""
+        with self.lock:
+            current = self.state.setdefault(topic, {})
+            diff = {key: value for key, value in data.items() if current.get(key, _MISSING) != value}
+            if not diff:
+                return False
+            diff = copy.deepcopy(diff)  # Bên gọi có thể sửa dict/list sau khi publish
+            current.update(diff)
+            for subscriber, topics in self.subscribers.items():
+                if topics is None or topic in topics:
+                    self._put(subscriber, (topic, diff))
+        return True
+
+    def _put(self, subscriber, event):
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            subscriber.put_nowait(event)
+
+    def subscribe(self, topics=None):
+        """Tạo hàng đợi mới nhận các chủ đề `topics` (None = tất cả); trả về (hàng đợi, bản chụp trạng thái hiện tại)"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers[subscriber] = set(topics) if topics is not None else None
+            snapshot = {topic: dict(values) for topic, values in self.state.items()}
+        return subscriber, snapshot
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.pop(subscriber, None)
+
+    def has_subscribers(self, topic=None):
+        """Có kết nối nào đang nhận `topic` không (None = bất kỳ chủ đề nào)"""
+        with self.lock:
+            if topic is None:
+                return bool(self.subscribers)
+            return any(topics is None or topic in topics for topics in self.subscribers.values())
+
+    def stream(self, topics=None, keepalive=15):
+        """Sinh các khung SSE: bản chụp đầu tiên rồi các thay đổi của `topics`"""
+        subscriber, snapshot = self.subscribe(topics)
+        try:
+            for topic, values in snapshot.items():
+                if topics is None or topic in topics:
+                    yield format_sse(topic, values)
+            while True:
+                try:
+                    topic, diff = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(topic, diff)
+        finally:
+            self.unsubscribe(subscriber)
+
+def format_sse(topic, data):
+    return f"event: {topic}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Tạo instance toàn cục để sử dụng
+event_bus = EventBus()
@@ -3,10 +3,12 @@
 import cv2
 import os
 import numpy as np
-from datetime import datetime
-import pickle
 import time
+import queue
+import threading
 from config import *
+from face_store import get_face_store, normalize_face
+from face_recognizers import create_recognizer
 
 def load_face_detector():
     """Tải bộ phát hiện khuôn mặt sử dụng Haar Cascade"""
@@ -54,165 +56,315 @@ def load_face_detector():
     print(f"Đã tải bộ phát hiện khuôn mặt từ: {detector_path}")
     return face_detector
 
-def detect_faces(frame, face_detector):
-    """Phát hiện khuôn mặt trong khung hình"""
+def detect_faces(frame, face_detector, profile="accurate"):
+    """Phát hiện khuôn mặt trong toàn khung hình (mặc định độ phân giải gốc, dùng khi đăng ký)"""
+    settings = FACE_DETECTION_PROFILES[profile]
     # Chuyển sang ảnh xám để xử lý nhanh hơn
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     
     # Phát hiện khuôn mặt trong ảnh xám
     faces = face_detector.detectMultiScale(
         gray, 
-        scaleFactor=1.1,        # Hệ số tỷ lệ khi thay đổi kích thước ảnh
-        minNeighbors=5,         # Số lượng hàng xóm tối thiểu
-        minSize=(30, 30),       # Kích thước tối thiểu của khuôn mặt
+        scaleFactor=settings["scale_factor"],     # Hệ số tỷ lệ khi thay đổi kích thước ảnh
+        minNeighbors=settings["min_neighbors"],   # Số lượng hàng xóm tối thiểu
+        minSize=(settings["min_size"],) * 2,      # Kích thước tối thiểu của khuôn mặt
         flags=cv2.CASCADE_SCALE_IMAGE
     )
     
     # Trả về danh sách các khuôn mặt (x, y, w, h)
     return faces
 
+class FaceFinder:
+    """Phát hiện khuôn mặt theo hồ sơ FACE_DETECTION_PROFILE trong config.
+
+    Ảnh được thu nhỏ theo `scale` trước khi quét rồi đổi box về tọa độ khung hình
+    gốc. Khi hồ sơ bật ROI, chỉ quét vùng bao quanh các khuôn mặt lần trước và
+    phần trên của box người từ YOLO; quét toàn khung khi không có vùng nào, khi
+    ROI chỉ dựa vào khuôn mặt cũ mà không thấy lại, hoặc sau mỗi
+    FACE_FULL_SCAN_INTERVAL lần. Có box người mà ROI không thấy khuôn mặt (người
+    quay đi) thì không quét lại toàn khung.
+    """
+    def __init__(self, cascade, profile=FACE_DETECTION_PROFILE):
+        settings = FACE_DETECTION_PROFILES[profile]
+        self.cascade = cascade
+        self.profile = profile
+        self.scale = settings["scale"]
+        self.scale_factor = settings["scale_factor"]
+        self.min_neighbors = settings["min_neighbors"]
+        self.min_size = max(1, int(settings["min_size"] * self.scale))
+        self.use_roi = settings["roi"]
+        self.last_faces = []
+        self.roi_runs = 0
+        self.roi_scans = 0
+        self.full_scans = 0
+    
+    def roi_region(self, width, height, person_boxes):
+        """Vùng cần quét lần này (x0, y0, x1, y1), None nếu phải quét toàn khung hình"""
+        if not self.use_roi or self.roi_runs >= FACE_FULL_SCAN_INTERVAL:
+            self.roi_runs = 0
+            return None
+        areas = []
+        for x, y, w, h in self.last_faces:
+            margin_x, margin_y = int(w * FACE_ROI_MARGIN), int(h * FACE_ROI_MARGIN)
+            areas.append((x - margin_x, y - margin_y, x + w + margin_x, y + h + margin_y))
+        for x, y, w, h in person_boxes:
+            areas.append((x, y, x + w, y + int(h * FACE_PERSON_UPPER)))
+        if not areas:
+            return None
+        self.roi_runs += 1
+        region = (max(0, min(a[0] for a in areas)), max(0, min(a[1] for a in areas)),
+                  min(width, max(a[2] for a in areas)), min(height, max(a[3] for a in areas)))
+        if region[2] - region[0] < self.min_size / self.scale or region[3] - region[1] < self.min_size / self.scale:
+            return None  # Vùng quá nhỏ, quét toàn khung hình
+        return region
+    
+    def detect_region(self, frame, region):
+        x0, y0, x1, y1 = region
+        # Chỉ chuyển ảnh xám và thu nhỏ phần cần quét
+        gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        if self.scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        faces = self.cascade.detectMultiScale(
+            gray,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            minSize=(self.min_size, self.min_size),
+            flags=cv2.CASCADE_SCALE_IMAGE
+        )
+        return [(int(x / self.scale) + x0, int(y / self.scale) + y0, int(w / self.scale), int(h / self.scale))
+                for x, y, w, h in faces]
+    
+    def detect(self, frame, person_boxes=()):
+        """Trả về danh sách box khuôn mặt (x, y, w, h) theo tọa độ khung hình gốc"""
+        height, width = frame.shape[:2]
+        region = self.roi_region(width, height, person_boxes)
+        if region is not None:
+            faces = self.detect_region(frame, region)
+            if faces or len(person_boxes) > 0:
+                self.roi_scans += 1
+                self.last_faces = faces
+                return faces
+        faces = self.detect_region(frame, (0, 0, width, height))
+        self.full_scans += 1
+        self.last_faces = faces
+        return faces
+
 def create_face_recognizer():
-    """Tạo và tải bộ nhận diện khuôn mặt"""
-    # Sử dụng LBPH (Local Binary Patterns Histograms) - nhẹ và hiệu quả cho Raspberry Pi
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    return recognizer
+    """Tạo bộ nhận diện khuôn mặt theo FACE_RECOGNIZER_BACKEND (mặc định LBPH)"""
+    return create_recognizer()
+
+def load_face_mapping():
+    """Thông tin người dùng {face_id: thông tin} từ kho mẫu"""
+    return get_face_store().users()
+
+def score_face(face, box):
+    """Chấm điểm một mẫu đã chuẩn hóa, trả về (điểm 0..1, độ nét, kích thước, độ chính diện).
+
+    Độ nét là phương sai Laplacian; độ chính diện đo bằng độ đối xứng trái-phải
+    của ảnh (khuôn mặt quay nghiêng lệch nhiều so với ảnh lật của nó).
+    """
+    x, y, w, h = box
+    sharpness = min(1.0, cv2.Laplacian(face, cv2.CV_64F).var() / ENROLL_SHARPNESS_TARGET)
+    size = min(1.0, min(w, h) / ENROLL_TARGET_FACE_SIZE)
+    asymmetry = cv2.absdiff(face, cv2.flip(face, 1)).mean() / 255.0
+    frontal = max(0.0, 1.0 - 4 * asymmetry)
+    return sharpness * size * frontal, sharpness, size, frontal
 
-def register_new_face(frame, face_detector, name=None):
-    """Đăng ký khuôn mặt mới từ khung hình"""
-    # Phát hiện khuôn mặt
-    faces = detect_faces(frame, face_detector)
+class EnrollmentSession:
+    """Gom khuôn mặt lớn nhất của nhiều khung hình và giữ lại K mẫu tốt nhất, khác nhau"""
+    def __init__(self, face_detector, keep=ENROLL_KEEP_SAMPLES):
+        self.face_detector = face_detector
+        self.keep = keep
+        self.candidates = []  # (điểm, mẫu đã chuẩn hóa)
+        self.frames = 0
     
-    if len(faces) == 0:
-        return False, "Không tìm thấy khuôn mặt trong khung hình"
-    
-    # Nếu phát hiện nhiều khuôn mặt, lấy khuôn mặt lớn nhất
-    if len(faces) > 1:
-        print(f"Phát hiện {len(faces)} khuôn mặt, đang chọn khuôn mặt lớn nhất")
-        # Tính diện tích của mỗi khuôn mặt
-        face_areas = [w*h for (x, y, w, h) in faces]
-        # Chọn khuôn mặt có diện tích lớn nhất
-        largest_face_idx = np.argmax(face_areas)
-        x, y, w, h = faces[largest_face_idx]
-    else:
-        x, y, w, h = faces[0]
+    def add_frame(self, frame):
+        """Thêm một khung hình, trả về điểm của khuôn mặt tìm thấy hoặc None"""
+        self.frames += 1
+        faces = detect_faces(frame, self.face_detector)
+        if len(faces) == 0:
+            return None
+        # Nếu có nhiều khuôn mặt, lấy khuôn mặt lớn nhất
+        x, y, w, h = max(faces, key=lambda box: box[2] * box[3])
+        if min(w, h) < ENROLL_MIN_FACE_SIZE:
+            return None
+        face = normalize_face(frame[y:y+h, x:x+w])
+        score = score_face(face, (x, y, w, h))[0]
+        if score >= ENROLL_MIN_SCORE:
+            self.candidates.append((score, face))
+        return score
     
-    # Đảm bảo thư mục tồn tại
-    os.makedirs(SAMPLES_DIR, exist_ok=True)
+    def best(self):
+        """Các mẫu điểm cao nhất, bỏ mẫu gần như trùng với mẫu đã chọn"""
+        chosen = []
+        for score, face in sorted(self.candidates, key=lambda item: item[0], reverse=True):
+            if all(cv2.absdiff(face, other).mean() >= ENROLL_MIN_DIFFERENCE for other in chosen):
+                chosen.append(face)
+                if len(chosen) == self.keep:
+                    break
+        return chosen
+
+def register_new_face(frames, face_detector, name=None):
+    """Đăng ký khuôn mặt mới từ một hoặc nhiều khung hình, trả về (thành công, thông báo, face_id)"""
+    if isinstance(frames, np.ndarray):
+        frames = [frames]
+    session = EnrollmentSession(face_detector)
+    for frame in frames:
+        session.add_frame(frame)
+    faces = session.best()
     
-    # Đọc file mapping hiện tại hoặc tạo mới
-    face_info = {}
-    next_id = 1
+    if len(faces) == 0:
+        return False, "Không tìm thấy khuôn mặt đủ rõ trong khung hình", None
+    print(f"Chọn {len(faces)} mẫu tốt nhất từ {session.frames} khung hình")
     
-    if os.path.exists(FACE_MAPPING_PATH):
-        with open(FACE_MAPPING_PATH, 'rb') as f:
-            face_info = pickle.load(f)
-            # Tìm ID tiếp theo
-            if face_info:
-                next_id = max(face_info.keys()) + 1
+    store = get_face_store()
     
     # Tạo ID mới cho khuôn mặt
-    face_id = next_id
+    face_id = store.next_id()
     
     # Nếu không có tên, tạo tên mặc định
     if not name or name.strip() == "":
         name = f"Người dùng {face_id}"
     
-    # Cắt khuôn mặt
-    face_roi = frame[y:y+h, x:x+w]
-    
-    # Chuyển sang ảnh xám
-    face_gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-    
-    # Lưu ảnh khuôn mặt (lưu 5 mẫu để tăng độ chính xác)
-    for i in range(1, 6):
-        filename = f"face_{face_id}_sample_{i}.jpg"
-        filepath = os.path.join(SAMPLES_DIR, filename)
-        cv2.imwrite(filepath, face_gray)
-        print(f"Đã lưu mẫu {i} cho khuôn mặt {face_id}")
-    
-    # Cập nhật mapping
-    face_info[face_id] = {
-        "name": name,
-        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "samples": 5
-    }
-    
-    # Lưu mapping
-    with open(FACE_MAPPING_PATH, 'wb') as f:
-        pickle.dump(face_info, f)
+    # Ghi các mẫu đã chuẩn hóa và thông tin người dùng vào kho mẫu
+    store.add_user(name, faces, face_id=face_id)
+    print(f"Đã lưu {len(faces)} mẫu cho khuôn mặt {face_id}")
     
-    # Tạo file âm thanh cá nhân cho người dùng mới
+    # Tạo file âm thanh cá nhân cho người dùng mới trong luồng nền, không chờ mạng
     try:
-        print(f"Đang tạo âm thanh cá nhân cho {name}...")
-        
         # Import module tạo âm thanh
-        from tts_generator import create_time_based_greetings
-        create_time_based_greetings(face_id, name)
+        from tts_generator import queue_time_based_greetings
+        queue_time_based_greetings(face_id, name)
         
-        print(f"Đã tạo âm thanh cá nhân cho người dùng {name}")
+        print(f"Đang tạo âm thanh cá nhân cho {name} trong nền...")
     except Exception as e:
         print(f"Lỗi khi tạo âm thanh cá nhân: {e}")
     
-    return True, f"Đã đăng ký khuôn mặt mới: {name} (ID: {face_id})"
+    return True, f"Đã đăng ký khuôn mặt mới: {name} (ID: {face_id})", face_id
+
+def load_face_samples(face_id=None):
+    """Đọc ảnh mẫu (ảnh xám) của một face_id, hoặc của tất cả nếu face_id là None"""
+    # Kho mẫu là một file liên tiếp nên đây là một lần đọc tuần tự
+    samples, labels = get_face_store().samples(face_id)
+    return list(np.ascontiguousarray(samples)), labels.tolist()
+
+def save_face_model(face_recognizer):
+    """Ghi mô hình ra file tạm rồi đổi tên, để không bao giờ để lại file mô hình ghi dở"""
+    model_path = face_recognizer.model_path
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    root, ext = os.path.splitext(model_path)
+    temp_path = f"{root}.tmp{ext}"  # Giữ phần mở rộng để OpenCV chọn đúng định dạng
+    face_recognizer.save(temp_path)
+    os.replace(temp_path, model_path)
 
 def train_face_recognizer(face_recognizer):
     """Huấn luyện bộ nhận diện khuôn mặt với dữ liệu đã lưu"""
-    # Danh sách ảnh và nhãn
-    face_samples = []
-    face_ids = []
-    
-    # Nếu thư mục samples không tồn tại thì tạo mới
-    if not os.path.exists(SAMPLES_DIR):
-        os.makedirs(SAMPLES_DIR)
-        return False, "Chưa có dữ liệu khuôn mặt để huấn luyện"
-    
-    # Đọc file mapping nếu có
-    face_info = {}
-    if os.path.exists(FACE_MAPPING_PATH):
-        with open(FACE_MAPPING_PATH, 'rb') as f:
-            face_info = pickle.load(f)
-    
-    # Duyệt qua tất cả các file ảnh trong thư mục samples
-    for filename in os.listdir(SAMPLES_DIR):
-        if filename.endswith('.jpg') or filename.endswith('.png'):
-            # Lấy face_id từ tên file (ví dụ: face_1_sample_1.jpg -> face_id = 1)
-            face_id = int(filename.split('_')[1])
-            
-            # Đọc ảnh
-            img_path = os.path.join(SAMPLES_DIR, filename)
-            img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)  # Đọc dưới dạng ảnh xám
-            
-            # Thêm vào danh sách
-            face_samples.append(img)
-            face_ids.append(face_id)
+    face_samples, face_ids = load_face_samples()
     
     # Kiểm tra xem có đủ dữ liệu không
     if len(face_samples) == 0:
-        return False, "Không có ảnh khuôn mặt trong thư mục samples"
+        return False, "Chưa có dữ liệu khuôn mặt để huấn luyện"
     
     # Huấn luyện recognizer
     print(f"Đang huấn luyện với {len(face_samples)} ảnh khuôn mặt...")
-    face_recognizer.train(face_samples, np.array(face_ids))
+    face_recognizer.train(face_samples, face_ids)
     
     # Lưu mô hình đã huấn luyện
-    os.makedirs(os.path.dirname(FACE_MODEL_PATH), exist_ok=True)
-    face_recognizer.save(FACE_MODEL_PATH)
+    save_face_model(face_recognizer)
     
     return True, f"Đã huấn luyện xong với {len(face_samples)} ảnh khuôn mặt"
 
+def update_face_recognizer(face_recognizer, face_samples, face_ids):
+    """Thêm mẫu mới vào mô hình hiện có bằng update(), không đọc lại mẫu cũ"""
+    if len(face_samples) == 0:
+        return False, "Không có mẫu khuôn mặt mới"
+    face_recognizer.update(face_samples, face_ids)
+    return True, f"Đã cập nhật mô hình với {len(face_samples)} ảnh khuôn mặt mới"
+
+class RecognizerTrainer:
+    """Luồng nền huấn luyện mô hình khuôn mặt rồi thay thế mô hình đang dùng.
+
+    Luồng giữ một bản mô hình dự phòng đồng bộ với bản đang dùng. Khi đăng ký,
+    mẫu mới được update() vào bản dự phòng, lưu file rồi trao cho
+    `on_ready(recognizer)`; hàm này thay mô hình đang dùng và trả lại bản cũ,
+    bản cũ được update() cùng mẫu để trở thành bản dự phòng tiếp theo. Nhờ đó
+    thời gian đăng ký không tăng theo số người đã đăng ký.
+    """
+    def __init__(self, on_ready):
+        self.on_ready = on_ready
+        self.spare = None
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="face-trainer")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def enroll(self, face_id):
+        """Thêm mẫu của face_id vừa đăng ký vào mô hình (không chặn)"""
+        self.jobs.put(("enroll", face_id))
+    
+    def rebuild(self):
+        """Huấn luyện lại toàn bộ từ mọi mẫu đã lưu (không chặn)"""
+        self.jobs.put(("rebuild", None))
+    
+    def stop(self):
+        self.jobs.put((None, None))
+        self.thread.join(timeout=2)
+    
+    def _run(self):
+        while True:
+            action, face_id = self.jobs.get()
+            if action is None:
+                break
+            try:
+                started = time.time()
+                if action == "enroll":
+                    message = self._enroll(face_id)
+                else:
+                    message = self._rebuild()
+                print(f"{message} ({time.time() - started:.2f}s)")
+            except Exception as e:
+                print(f"Lỗi khi huấn luyện mô hình khuôn mặt: {e}")
+                self.spare = None
+    
+    def _load_spare(self):
+        if self.spare is None:
+            self.spare = create_face_recognizer()
+            if os.path.exists(self.spare.model_path):
+                self.spare.read(self.spare.model_path)
+        return self.spare
+    
+    def _enroll(self, face_id):
+        face_samples, face_ids = load_face_samples(face_id)
+        recognizer = self._load_spare()
+        success, message = update_face_recognizer(recognizer, face_samples, face_ids)
+        if not success:
+            return message
+        save_face_model(recognizer)
+        retired = self.on_ready(recognizer)
+        # Bản cũ nhận cùng mẫu để đồng bộ với bản vừa thay vào
+        if retired is not None:
+            update_face_recognizer(retired, face_samples, face_ids)
+        self.spare = retired
+        return message
+    
+    def _rebuild(self):
+        recognizer = create_face_recognizer()
+        success, message = train_face_recognizer(recognizer)
+        if success:
+            self.on_ready(recognizer)
+        # Bản dự phòng sẽ được đọc lại từ file mô hình mới ở lần đăng ký sau
+        self.spare = None
+        return message
+
 def load_face_data(face_recognizer):
     """Tải dữ liệu khuôn mặt và mô hình nhận diện"""
-    face_info = {}
-    
     # Kiểm tra và tải mapping
-    if os.path.exists(FACE_MAPPING_PATH):
-        with open(FACE_MAPPING_PATH, 'rb') as f:
-            face_info = pickle.load(f)
+    face_info = load_face_mapping()
     
     # Kiểm tra và tải mô hình
-    if os.path.exists(FACE_MODEL_PATH):
-        face_recognizer.read(FACE_MODEL_PATH)
-        print("Đã tải mô hình nhận diện khuôn mặt")
+    if os.path.exists(face_recognizer.model_path):
+        face_recognizer.read(face_recognizer.model_path)
+        print(f"Đã tải mô hình nhận diện khuôn mặt ({face_recognizer.name})")
         return True, face_info
     else:
         print("Không tìm thấy mô hình nhận diện khuôn mặt")
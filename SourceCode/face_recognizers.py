@@ -0,0 +1,201 @@
+# face_recognizers.py - Các backend nhận diện khuôn mặt dùng chung một giao diện (LBPH, embedding DNN)
+
+import os
+import sys
+import time
+import threading
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+from config import *
+
+class FaceRecognizer(ABC):
+    """Giao diện chung của các backend nhận diện.
+
+    Mẫu vào là ảnh xám đã chuẩn hóa (FACE_SAMPLE_SIZE x FACE_SAMPLE_SIZE).
+    predict() trả về (face_id, % tin cậy), hoặc (None, 0.0) nếu dưới ngưỡng
+    của backend; các hàm khác không cần biết thang điểm riêng của backend.
+    """
+    name = None
+    model_path = None
+
+    @abstractmethod
+    def train(self, face_samples, face_ids):
+        """Huấn luyện lại từ đầu với toàn bộ mẫu"""
+
+    @abstractmethod
+    def update(self, face_samples, face_ids):
+        """Thêm mẫu mới vào mô hình hiện có"""
+
+    @abstractmethod
+    def predict(self, face):
+        """(face_id, % tin cậy) hoặc (None, 0.0)"""
+
+    @abstractmethod
+    def read(self, path):
+        """Nạp mô hình đã lưu"""
+
+    @abstractmethod
+    def save(self, path):
+        """Lưu mô hình"""
+
+class LBPHRecognizer(FaceRecognizer):
+    """LBPH (Local Binary Patterns Histograms) - nhẹ và hiệu quả cho Raspberry Pi.
+
+    Thời gian predict tăng tuyến tính theo số histogram đã lưu.
+    """
+    name = "lbph"
+    model_path = FACE_MODEL_PATH
+
+    def __init__(self, threshold=FACE_CONFIDENCE_THRESHOLD):
+        self.model = cv2.face.LBPHFaceRecognizer_create()
+        self.threshold = threshold
+
+    def train(self, face_samples, face_ids):
+        self.model.train(face_samples, np.array(face_ids))
+
+    def update(self, face_samples, face_ids):
+        self.model.update(face_samples, np.array(face_ids))
+
+    def predict(self, face):
+        face_id, distance = self.model.predict(face)
+        # Khoảng cách nhỏ hơn = tin cậy hơn
+        if distance < self.threshold:
+            return face_id, 100.0 - distance
+        return None, 0.0
+
+    def read(self, path):
+        self.model.read(path)
+
+    def save(self, path):
+        self.model.save(path)
+
+_embedding_net = None
+_embedding_lock = threading.Lock()
+
+def load_embedding_net():
+    """Mạng embedding (OpenFace nn4.small2) dùng chung cho mọi bản EmbeddingRecognizer"""
+    global _embedding_net
+    with _embedding_lock:
+        if _embedding_net is None:
+            if not os.path.exists(FACE_EMBEDDING_MODEL):
+                raise FileNotFoundError(f"Không tìm thấy mô hình embedding: {FACE_EMBEDDING_MODEL}")
+            net = cv2.dnn.readNetFromTorch(FACE_EMBEDDING_MODEL)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            _embedding_net = net
+        return _embedding_net
+
+def embed_faces(faces):
+    """Chuyển các mẫu khuôn mặt thành ma trận vector đặc trưng đã chuẩn hóa L2 (N x D)"""
+    if len(faces) == 0:
+        return np.zeros((0, FACE_EMBEDDING_SIZE), dtype=np.float32)
+    images = [cv2.cvtColor(face, cv2.COLOR_GRAY2BGR) if face.ndim == 2 else face for face in faces]
+    blob = cv2.dnn.blobFromImages(images, 1.0 / 255, (FACE_EMBEDDING_INPUT, FACE_EMBEDDING_INPUT),
+                                  (0, 0, 0), swapRB=True, crop=False)
+    net = load_embedding_net()
+    with _embedding_lock:  # forward() của một cv2.dnn.Net không an toàn khi gọi từ nhiều luồng
+        net.setInput(blob)
+        vectors = net.forward().astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+class EmbeddingRecognizer(FaceRecognizer):
+    """Embedding DNN trên CPU + tìm láng giềng gần nhất bằng một phép nhân ma trận.
+
+    Mỗi mẫu được lưu thành một hàng của ma trận embedding; predict tính độ
+    tương đồng cosine với mọi hàng bằng một phép nhân NumPy.
+    """
+    name = "embedding"
+    model_path = FACE_EMBEDDING_PATH
+
+    def __init__(self, threshold=FACE_EMBEDDING_THRESHOLD):
+        load_embedding_net()
+        self.threshold = threshold
+        self.embeddings = np.zeros((0, FACE_EMBEDDING_SIZE), dtype=np.float32)
+        self.labels = np.zeros(0, dtype=np.int32)
+
+    def train(self, face_samples, face_ids):
+        self.embeddings = embed_faces(face_samples)
+        self.labels = np.array(face_ids, dtype=np.int32)
+
+    def update(self, face_samples, face_ids):
+        self.embeddings = np.vstack([self.embeddings, embed_faces(face_samples)])
+        self.labels = np.concatenate([self.labels, np.array(face_ids, dtype=np.int32)])
+
+    def predict(self, face):
+        if len(self.labels) == 0:
+            return None, 0.0
+        similarities = self.embeddings @ embed_faces([face])[0]
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.threshold:
+            return int(self.labels[best]), float(similarities[best]) * 100.0
+        return None, 0.0
+
+    def read(self, path):
+        with np.load(path) as data:
+            self.embeddings = data["embeddings"]
+            self.labels = data["labels"]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, embeddings=self.embeddings, labels=self.labels)
+
+RECOGNIZER_BACKENDS = {
+    LBPHRecognizer.name: LBPHRecognizer,
+    EmbeddingRecognizer.name: EmbeddingRecognizer
+}
+
+def create_recognizer(backend=FACE_RECOGNIZER_BACKEND):
+    """Tạo bộ nhận diện theo tên backend; dùng LBPH nếu backend không dùng được"""
+    try:
+        return RECOGNIZER_BACKENDS[backend]()
+    except Exception as e:
+        if backend == LBPHRecognizer.name:
+            raise
+        print(f"Không thể dùng backend '{backend}' ({e}), chuyển sang LBPH")
+        return LBPHRecognizer()
+
+def benchmark(backends=tuple(RECOGNIZER_BACKENDS)):
+    """So sánh độ trễ và độ chính xác trên mẫu trong kho.
+
+    Với mỗi người dùng, mẫu thứ 1, 3, 5... dùng để huấn luyện và các mẫu còn
+    lại để kiểm tra; người chỉ có một mẫu chỉ góp vào tập huấn luyện.
+    """
+    from face_store import get_face_store
+    samples, labels = get_face_store().samples()
+    samples = np.ascontiguousarray(samples)
+    train_rows, test_rows = [], []
+    for face_id in np.unique(labels):
+        rows = np.flatnonzero(labels == face_id)
+        train_rows.extend(rows[::2])
+        test_rows.extend(rows[1::2])
+    if not train_rows or not test_rows:
+        print("Cần ít nhất một người dùng có từ 2 mẫu trở lên để đánh giá")
+        return
+    print(f"{len(train_rows)} mẫu huấn luyện, {len(test_rows)} mẫu kiểm tra, {len(np.unique(labels))} người dùng")
+    for backend in backends:
+        try:
+            recognizer = RECOGNIZER_BACKENDS[backend]()
+        except Exception as e:
+            print(f"{backend}: bỏ qua ({e})")
+            continue
+        started = time.perf_counter()
+        recognizer.train([samples[i] for i in train_rows], labels[train_rows].tolist())
+        train_time = time.perf_counter() - started
+        correct = unknown = 0
+        started = time.perf_counter()
+        for i in test_rows:
+            face_id, _ = recognizer.predict(samples[i])
+            if face_id is None:
+                unknown += 1
+            elif face_id == labels[i]:
+                correct += 1
+        predict_ms = (time.perf_counter() - started) / len(test_rows) * 1000
+        print(f"{backend}: huấn luyện {train_time:.2f}s, predict {predict_ms:.2f} ms/mẫu, "
+              f"đúng {correct}/{len(test_rows)} ({correct / len(test_rows) * 100:.0f}%), "
+              f"không xác định {unknown}")
+
+if __name__ == "__main__":
+    # python face_recognizers.py [lbph] [embedding]: đánh giá trên kho mẫu hiện có
+    benchmark(sys.argv[1:] or tuple(RECOGNIZER_BACKENDS))
@@ -0,0 +1,176 @@
+# face_store.py - Kho mẫu khuôn mặt đóng gói: một file nhị phân ảnh đã chuẩn hóa và một file chỉ mục
+
+import os
+import sys
+import json
+import pickle
+import threading
+from datetime import datetime
+import cv2
+import numpy as np
+from config import *
+
+INDEX_VERSION = 1
+
+def normalize_face(face):
+    """Chuyển ảnh khuôn mặt về ảnh xám FACE_SAMPLE_SIZE x FACE_SAMPLE_SIZE"""
+    if face.ndim == 3:
+        face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(face, (FACE_SAMPLE_SIZE, FACE_SAMPLE_SIZE), interpolation=cv2.INTER_AREA)
+
+class FaceStore:
+    """Mẫu khuôn mặt lưu liên tiếp trong một file uint8 (N x size x size), đọc bằng np.memmap.
+
+    File chỉ mục JSON giữ số mẫu, nhãn face_id của từng mẫu và thông tin người
+    dùng (thay cho face_mapping.pkl). Mẫu mới chỉ được ghi nối vào cuối file dữ
+    liệu; chỉ mục được ghi sau cùng bằng os.replace nên một lần ghi dở không
+    làm hỏng kho.
+    """
+    def __init__(self, data_path=FACE_STORE_PATH, index_path=FACE_INDEX_PATH, size=FACE_SAMPLE_SIZE):
+        self.data_path = data_path
+        self.index_path = index_path
+        self.size = size
+        self.lock = threading.RLock()
+        self.index_mtime = None
+        self.count = 0
+        self.labels = np.zeros(0, dtype=np.int32)
+        self.user_info = {}
+        self.refresh()
+
+    def refresh(self):
+        """Đọc lại chỉ mục nếu file đã thay đổi (ví dụ do tiến trình khác đăng ký)"""
+        with self.lock:
+            try:
+                mtime = os.stat(self.index_path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime == self.index_mtime:
+                return
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("size") != self.size:
+                raise ValueError(f"Kho mẫu dùng kích thước {index.get('size')}, cấu hình là {self.size}")
+            self.count = index["count"]
+            self.labels = np.array(index["labels"], dtype=np.int32)
+            self.user_info = {int(face_id): info for face_id, info in index["users"].items()}
+            self.index_mtime = mtime
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def users(self):
+        """{face_id: {"name", "created", "samples"}}"""
+        self.refresh()
+        with self.lock:
+            return dict(self.user_info)
+
+    def next_id(self):
+        return max(self.user_info) + 1 if self.user_info else 1
+
+    def samples(self, face_id=None):
+        """Trả về (mảng mẫu N x size x size, mảng nhãn) của một face_id hoặc của tất cả"""
+        self.refresh()
+        with self.lock:
+            count, labels = self.count, self.labels
+        if count == 0:
+            return np.zeros((0, self.size, self.size), dtype=np.uint8), labels
+        data = np.memmap(self.data_path, dtype=np.uint8, mode='r', shape=(count, self.size, self.size))
+        if face_id is None:
+            return data, labels
+        rows = np.flatnonzero(labels == face_id)
+        return data[rows], labels[rows]
+
+    def add_user(self, name, faces, face_id=None, created=None):
+        """Chuẩn hóa và ghi nối các mẫu của một người dùng mới, trả về face_id"""
+        crops = [normalize_face(face) for face in faces]
+        with self.lock:
+            self.refresh()
+            if face_id is None:
+                face_id = self.next_id()
+            sample_bytes = self.size * self.size
+            os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+            with open(self.data_path, 'ab') as f:
+                f.truncate(self.count * sample_bytes)  # Bỏ phần thừa của lần ghi dở trước đó
+                for crop in crops:
+                    f.write(crop.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.count += len(crops)
+            self.labels = np.concatenate([self.labels, np.full(len(crops), face_id, dtype=np.int32)])
+            self.user_info[face_id] = {
+                "name": name,
+                "created": created or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "samples": self.user_info.get(face_id, {}).get("samples", 0) + len(crops)
+            }
+            self._write_index()
+        return face_id
+
+    def _write_index(self):
+        index = {
+            "version": INDEX_VERSION,
+            "size": self.size,
+            "count": self.count,
+            "labels": self.labels.tolist(),
+            "users": {str(face_id): info for face_id, info in sorted(self.user_info.items())}
+        }
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+        self.index_mtime = os.stat(self.index_path).st_mtime_ns
+
+def import_legacy(store, samples_dir=SAMPLES_DIR, mapping_path=FACE_MAPPING_PATH):
+    """Nhập các file face_{id}_sample_{n}.jpg và face_mapping.pkl cũ vào kho, trả về số mẫu đã nhập"""
+    face_info = {}
+    if os.path.exists(mapping_path):
+        with open(mapping_path, 'rb') as f:
+            face_info = pickle.load(f)
+    faces = {}
+    if os.path.exists(samples_dir):
+        for filename in sorted(os.listdir(samples_dir)):
+            if filename.startswith("face_") and (filename.endswith('.jpg') or filename.endswith('.png')):
+                img = cv2.imread(os.path.join(samples_dir, filename), cv2.IMREAD_GRAYSCALE)
+                if img is not None:
+                    faces.setdefault(int(filename.split('_')[1]), []).append(img)
+    imported = 0
+    existing = store.users()
+    for face_id in sorted(set(face_info) | set(faces)):
+        if face_id in existing:
+            continue
+        info = face_info.get(face_id, {})
+        store.add_user(info.get("name", f"Người dùng {face_id}"), faces.get(face_id, []),
+                       face_id=face_id, created=info.get("created"))
+        imported += len(faces.get(face_id, []))
+    return imported
+
+def discard_stale_model(model_path=FACE_MODEL_PATH):
+    """Đổi tên mô hình huấn luyện trên ảnh cắt chưa chuẩn hóa (định dạng cũ) để không bị nạp nữa"""
+    if os.path.exists(model_path):
+        os.replace(model_path, model_path + ".legacy")
+        print(f"Mô hình cũ không khớp với mẫu đã chuẩn hóa, đã chuyển sang {model_path}.legacy - cần huấn luyện lại")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_face_store():
+    """Kho mẫu dùng chung trong tiến trình; tự nhập dữ liệu cũ ở lần dùng đầu tiên"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FaceStore()
+            if not _store.exists() and (os.path.exists(FACE_MAPPING_PATH) or os.path.exists(SAMPLES_DIR)):
+                count = import_legacy(_store)
+                print(f"Đã nhập {count} mẫu khuôn mặt cũ vào {FACE_STORE_PATH}")
+                if count > 0:
+                    discard_stale_model()
+        return _store
+
+if __name__ == "__main__":
+    # python face_store.py [thư_mục_samples] [face_mapping.pkl]: nhập dữ liệu cũ vào kho
+    samples_dir = sys.argv[1] if len(sys.argv) > 1 else SAMPLES_DIR
+    mapping_path = sys.argv[2] if len(sys.argv) > 2 else FACE_MAPPING_PATH
+    store = FaceStore()
+    count = import_legacy(store, samples_dir, mapping_path)
+    if count > 0:
+        discard_stale_model()
+    print(f"Đã nhập {count} mẫu, kho hiện có {store.count} mẫu của {len(store.users())} người dùng")
@@ -0,0 +1,111 @@
+# face_tracker.py - Theo dõi box qua các khung hình để chỉ nhận diện lại khi cần
+
+import math
+import itertools
+from collections import Counter, deque
+from config import *
+
+def iou(a, b):
+    """Tỷ lệ giao/hợp của hai box (x, y, w, h)"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    return inter / float(aw * ah + bw * bh - inter)
+
+def centroid_distance(a, b):
+    """Khoảng cách tâm hai box, chia cho kích thước trung bình của chúng"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = (ax + aw / 2) - (bx + bw / 2)
+    dy = (ay + ah / 2) - (by + bh / 2)
+    return math.hypot(dx, dy) / max(1.0, (aw + ah + bw + bh) / 4)
+
+class Track:
+    """Một đối tượng được theo dõi: box hiện tại, danh tính và lịch sử độ tin cậy"""
+    _ids = itertools.count(1)
+
+    def __init__(self, box, now):
+        self.id = next(self._ids)
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.missed = 0  # Số lần phát hiện liên tiếp không được ghép
+        self.last_recognized = None
+        self.identity = None  # face_id đã xác nhận, None = chưa biết
+        self.votes = Counter()
+        self.confidences = deque(maxlen=TRACK_HISTORY)
+
+    def confidence(self, now):
+        """Độ tin cậy trung bình, giảm một nửa sau mỗi TRACK_CONFIDENCE_HALF_LIFE giây không nhận diện lại"""
+        if not self.confidences or self.last_recognized is None:
+            return 0.0
+        age = now - self.last_recognized
+        return sum(self.confidences) / len(self.confidences) * 0.5 ** (age / TRACK_CONFIDENCE_HALF_LIFE)
+
+    def needs_recognition(self, now):
+        if self.last_recognized is None:
+            return True  # Track mới
+        if self.identity is None:
+            return now - self.last_recognized >= TRACK_UNKNOWN_RETRY
+        return self.confidence(now) < TRACK_MIN_CONFIDENCE
+
+class BoxTracker:
+    """Ghép box của khung hình mới với các track hiện có theo IoU, dự phòng bằng khoảng cách tâm.
+
+    Track không được ghép trong TRACK_MAX_MISSED lần cập nhật liên tiếp bị xóa;
+    đếm theo lần chạy nên track vẫn sống qua các chu kỳ dài khi cổng chuyển động
+    giãn nhịp. Nếu người đó quay lại sau khi track bị xóa sẽ thành track mới và
+    được nhận diện lại.
+    """
+    def __init__(self):
+        self.tracks = []
+        self.recognitions = 0
+        self.observations = 0
+
+    def update(self, boxes, now):
+        """Cập nhật với các box (x, y, w, h) của khung hình, trả về [(track, cần nhận diện)]"""
+        pairs = sorted(((iou(track.box, box), -centroid_distance(track.box, box), t, b)
+                        for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)), reverse=True)
+        matched_tracks = set()
+        matched_boxes = {}
+        for overlap, neg_distance, t, b in pairs:
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            if overlap < TRACK_IOU_THRESHOLD and -neg_distance > TRACK_MAX_CENTROID_DISTANCE:
+                continue
+            matched_tracks.add(t)
+            matched_boxes[b] = self.tracks[t]
+        for b, box in enumerate(boxes):
+            track = matched_boxes.get(b)
+            if track is None:
+                track = Track(tuple(box), now)
+                self.tracks.append(track)
+                matched_boxes[b] = track
+            track.box = tuple(box)
+            track.last_seen = now
+        seen = set(map(id, matched_boxes.values()))
+        for track in self.tracks:
+            track.missed = 0 if id(track) in seen else track.missed + 1
+        self.tracks = [track for track in self.tracks if track.missed <= TRACK_MAX_MISSED]
+        self.observations += len(boxes)
+        return [(matched_boxes[b], matched_boxes[b].needs_recognition(now)) for b in range(len(boxes))]
+
+    def record(self, track, identity, confidence, now):
+        """Lưu kết quả nhận diện; danh tính là face_id được bỏ phiếu nhiều nhất trong lịch sử"""
+        self.recognitions += 1
+        track.last_recognized = now
+        track.confidences.append(confidence if identity is not None else 0.0)
+        if identity is not None:
+            track.votes[identity] += 1
+            track.identity = track.votes.most_common(1)[0][0]
+        elif not track.votes:
+            track.identity = None
+        return track.identity
+
+    def recognition_rate(self):
+        """Tỷ lệ số lần gọi bộ nhận diện trên số khuôn mặt quan sát được"""
+        return self.recognitions / self.observations if self.observations else 0.0
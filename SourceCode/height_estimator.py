@@ -0,0 +1,154 @@
+# height_estimator.py - Ước lượng độ cao bàn đã lọc nhiễu từ các mẫu siêu âm
+
+import math
+import threading
+import time
+from collections import deque
+
+class MedianFilter:
+    """Trung vị trượt trên cửa sổ cố định"""
+    def __init__(self, window=5):
+        self.window = deque(maxlen=window)
+
+    def update(self, value):
+        self.window.append(value)
+        values = sorted(self.window)
+        return values[len(values) // 2]
+
+    def spread(self):
+        """Độ lệch tuyệt đối trung vị (MAD) của cửa sổ hiện tại"""
+        if not self.window:
+            return float('inf')
+        values = sorted(self.window)
+        median = values[len(values) // 2]
+        deviations = sorted(abs(v - median) for v in values)
+        return deviations[len(deviations) // 2]
+
+class ExponentialFilter:
+    """Bộ lọc trung bình mũ"""
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+        self.variance = 0.0
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+            return value
+        error = value - self.value
+        self.value += self.alpha * error
+        self.variance = (1 - self.alpha) * (self.variance + self.alpha * error * error)
+        return self.value
+
+class KalmanHeightFilter:
+    """Bộ lọc Kalman 1 chiều: dự đoán theo số bước đã phát, hiệu chỉnh bằng mẫu siêu âm.
+
+    Mẫu có sai số lệch quá `gate` độ lệch chuẩn bị loại bỏ; sau `max_rejects`
+    lần loại liên tiếp bộ lọc tự khởi tạo lại theo mẫu mới.
+    """
+    def __init__(self, measurement_noise=1.0, step_noise=0.0005, drift_noise=0.01, gate=3.0, max_rejects=5):
+        self.measurement_noise = measurement_noise  # Phương sai mẫu siêu âm (cm^2)
+        self.step_noise = step_noise  # Phương sai thêm vào cho mỗi bước (cm^2)
+        self.drift_noise = drift_noise  # Phương sai thêm vào mỗi lần cập nhật (cm^2)
+        self.gate = gate
+        self.max_rejects = max_rejects
+        self.value = None
+        self.variance = 100.0
+        self.rejects = 0
+        self.rejected_total = 0
+
+    def predict(self, delta_cm, steps=0):
+        if self.value is None:
+            return
+        self.value += delta_cm
+        self.variance += self.step_noise * steps
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+            self.variance = self.measurement_noise
+            return value
+        self.variance += self.drift_noise
+        innovation = value - self.value
+        innovation_variance = self.variance + self.measurement_noise
+        if innovation * innovation > self.gate * self.gate * innovation_variance:
+            self.rejects += 1
+            self.rejected_total += 1
+            if self.rejects < self.max_rejects:
+                return self.value
+            # Quá nhiều mẫu bị loại liên tiếp: ước lượng đã sai, khởi tạo lại
+            self.value = value
+            self.variance = self.measurement_noise
+            self.rejects = 0
+            return value
+        self.rejects = 0
+        gain = self.variance / innovation_variance
+        self.value += gain * innovation
+        self.variance *= (1 - gain)
+        return self.value
+
+class HeightEstimator:
+    """Lớp ước lượng độ cao dùng chung giữa luồng lấy mẫu và luồng động cơ.
+
+    `mode` là "median", "ema" hoặc "kalman". Mọi chế độ đều trả về độ cao,
+    vận tốc (cm/giây) và độ tin cậy trong khoảng [0, 1].
+    """
+    MODES = ("median", "ema", "kalman")
+
+    def __init__(self, mode="kalman", median_window=5, alpha=0.3, cm_per_step=0.005):
+        if mode not in self.MODES:
+            raise ValueError(f"Chế độ lọc không hợp lệ: {mode}")
+        self.mode = mode
+        self.cm_per_step = cm_per_step
+        self.median = MedianFilter(median_window)
+        self.ema = ExponentialFilter(alpha)
+        self.kalman = KalmanHeightFilter()
+        self.lock = threading.Lock()
+        self.height = -1
+        self.velocity = 0.0
+        self.confidence = 0.0
+        self.updated = 0.0
+        self._last_value = None
+        self._last_time = None
+
+    def update(self, timestamp, value):
+        """Đưa một mẫu siêu âm (cm) vào bộ lọc; dùng làm listener cho HeightSampler"""
+        with self.lock:
+            median = self.median.update(value)
+            if self.mode == "median":
+                height = median
+                spread = self.median.spread()
+            elif self.mode == "ema":
+                # Lọc trung vị trước để loại tiếng vọng sai trước khi làm mượt
+                height = self.ema.update(median)
+                spread = math.sqrt(self.ema.variance)
+            else:
+                height = self.kalman.update(value)
+                spread = math.sqrt(self.kalman.variance)
+            self._set(timestamp, height, spread)
+
+    def add_steps(self, steps, direction):
+        """Dự đoán độ cao theo số bước đã phát (direction True = đi lên)"""
+        if steps <= 0 or self.mode != "kalman":
+            return
+        delta = steps * self.cm_per_step * (1 if direction else -1)
+        with self.lock:
+            self.kalman.predict(delta, steps)
+            if self.kalman.value is not None:
+                self._set(time.monotonic(), self.kalman.value, math.sqrt(self.kalman.variance))
+
+    def _set(self, timestamp, height, spread):
+        if self._last_time is not None and timestamp > self._last_time:
+            instant = (height - self._last_value) / (timestamp - self._last_time)
+            self.velocity = 0.7 * self.velocity + 0.3 * instant
+        self._last_value = height
+        self._last_time = timestamp
+        self.height = height
+        self.confidence = 1.0 / (1.0 + spread)
+        self.updated = timestamp
+
+    def estimate(self, max_age=2):
+        """Trả về (độ cao, vận tốc, độ tin cậy); độ cao = -1 nếu dữ liệu đã cũ"""
+        if self.updated == 0.0 or time.monotonic() - self.updated > max_age:
+            return -1, 0.0, 0.0
+        return self.height, self.velocity, self.confidence
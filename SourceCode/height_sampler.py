@@ -0,0 +1,110 @@
+# height_sampler.py - Luồng lấy mẫu cảm biến siêu âm và bộ đệm vòng dùng chung
+
+import time
+import threading
+import logging
+from array import array
+
+class RingBuffer:
+    """Bộ đệm vòng kích thước cố định lưu (thời điểm, giá trị) trên mảng array"""
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.index = 0  # Vị trí ghi tiếp theo
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, value):
+        with self.lock:
+            self.timestamps[self.index] = timestamp
+            self.values[self.index] = value
+            self.index = (self.index + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+
+    def latest(self):
+        """Trả về (thời điểm, giá trị) mới nhất hoặc None nếu bộ đệm rỗng"""
+        with self.lock:
+            if self.count == 0:
+                return None
+            i = self.index - 1
+            return self.timestamps[i], self.values[i]
+
+    def recent(self, n):
+        """Trả về tối đa n giá trị gần nhất, cũ trước mới sau"""
+        with self.lock:
+            n = min(n, self.count)
+            start = self.index - n
+            return [self.values[i] for i in range(start, self.index)]
+
+class HeightSampler:
+    """Luồng duy nhất sở hữu cảm biến khoảng cách và ghi mẫu vào bộ đệm vòng.
+
+    `read_func` trả về khoảng cách (cm) hoặc -1 khi đo lỗi. Các luồng khác chỉ
+    đọc bộ đệm nên không bao giờ chờ cảm biến.
+    """
+    def __init__(self, read_func, interval=0.06, capacity=64):
+        self.read_func = read_func
+        self.interval = interval
+        self.buffer = RingBuffer(capacity)
+        self.errors = 0
+        self.samples = 0
+        self.listeners = []
+        self.running = False
+        self.thread = None
+
+    def add_listener(self, callback):
+        """Đăng ký hàm callback(timestamp, value) được gọi cho mỗi mẫu hợp lệ"""
+        self.listeners.append(callback)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._sample_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info("Height sampler thread started")
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=1)
+
+    def _sample_loop(self):
+        while self.running:
+            started = time.monotonic()
+            try:
+                value = self.read_func()
+            except Exception as e:
+                logging.error(f"Lỗi khi lấy mẫu cảm biến khoảng cách: {e}")
+                value = -1
+            if value > 0:
+                now = time.monotonic()
+                self.buffer.append(now, value)
+                self.samples += 1
+                for callback in self.listeners:
+                    try:
+                        callback(now, value)
+                    except Exception as e:
+                        logging.error(f"Lỗi trong callback của height sampler: {e}")
+            else:
+                self.errors += 1
+            remaining = self.interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def latest(self, max_age=2):
+        """Giá trị mới nhất nếu không cũ hơn `max_age` giây, ngược lại -1"""
+        sample = self.buffer.latest()
+        if sample is None or time.monotonic() - sample[0] > max_age:
+            return -1
+        return sample[1]
+
+    def median(self, n=5, max_age=2):
+        """Trung vị của n mẫu gần nhất (trả về -1 nếu dữ liệu đã cũ)"""
+        if self.latest(max_age) < 0:
+            return -1
+        values = sorted(self.buffer.recent(n))
+        return values[len(values) // 2]
@@ -0,0 +1,194 @@
+# light_sensor.py - Cảm biến ánh sáng BH1750: đo liên tục, lấy mẫu thích ứng, làm mượt và công tắc đèn có trễ
+
+import time
+import threading
+import logging
+
+try:
+    import smbus2
+    has_smbus = True
+except ImportError:
+    has_smbus = False
+
+# Hằng số cho cảm biến BH1750
+BH1750_ADDRESS = 0x23  # Địa chỉ I2C mặc định
+POWER_ON = 0x01
+CONTINUOUS_HIGH_RES_MODE = 0x10
+MEASUREMENT_TIME = 0.18  # Thời gian đo tối đa ở chế độ độ phân giải cao (giây)
+
+class BH1750:
+    """Cảm biến BH1750 được đặt chế độ đo liên tục một lần duy nhất.
+
+    Sau đó mỗi lần đọc chỉ là một giao dịch I2C lấy 2 byte kết quả mới nhất,
+    không gửi lại lệnh đo và không phải chờ. Gặp lỗi I2C thì lần đọc sau cấu
+    hình lại cảm biến (ví dụ sau khi mất nguồn).
+    """
+    def __init__(self, bus_number=1, address=BH1750_ADDRESS):
+        if not has_smbus:
+            raise RuntimeError("Thư viện smbus2 không khả dụng")
+        self.bus = smbus2.SMBus(bus_number)
+        self.address = address
+        self.lock = threading.Lock()
+        self.configured = False
+        self.transactions = 0  # Số giao dịch I2C đã thực hiện
+
+    def configure(self):
+        self.bus.write_byte(self.address, POWER_ON)
+        self.bus.write_byte(self.address, CONTINUOUS_HIGH_RES_MODE)
+        self.transactions += 2
+        time.sleep(MEASUREMENT_TIME)  # Chờ kết quả đo đầu tiên
+        self.configured = True
+        logging.info("Đã đặt BH1750 ở chế độ đo liên tục")
+
+    def read(self):
+        """Độ rọi hiện tại (lux)"""
+        with self.lock:
+            try:
+                if not self.configured:
+                    self.configure()
+                message = smbus2.i2c_msg.read(self.address, 2)
+                self.bus.i2c_rdwr(message)
+                self.transactions += 1
+                high, low = list(message)
+                return round(((high << 8) | low) / 1.2, 2)
+            except OSError:
+                self.configured = False
+                raise
+
+class LightSampler:
+    """Luồng duy nhất đọc cảm biến ánh sáng với chu kỳ thích ứng.
+
+    Khi độ rọi thay đổi nhiều hơn `change_ratio` (hoặc `min_change` lux) so với
+    giá trị đã làm mượt thì đọc lại sau `min_interval`; khi ổn định thì chu kỳ
+    tăng gấp đôi tới `max_interval`. Giá trị được làm mượt bằng EMA hệ số
+    `smoothing`. `active()` trả về False thì không đọc cảm biến (không bật đèn
+    tự động và không có trang nào theo dõi).
+    """
+    def __init__(self, read_func, min_interval=0.2, max_interval=5, change_ratio=0.1,
+                 min_change=5, smoothing=0.3, active=None):
+        self.read_func = read_func
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.change_ratio = change_ratio
+        self.min_change = min_change
+        self.smoothing = smoothing
+        self.active = active
+        self.interval = min_interval
+        self.value = None  # Giá trị đã làm mượt
+        self.timestamp = 0.0
+        self.samples = 0
+        self.errors = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.sample_lock = threading.Lock()  # Mỗi lần chỉ một mẫu được đọc và xử lý
+        self.wake_event = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def add_listener(self, callback):
+        """Đăng ký hàm callback(timestamp, lux) được gọi với giá trị đã làm mượt sau mỗi mẫu"""
+        self.listeners.append(callback)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._sample_loop, name="light-sampler")
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info("Light sampler thread started")
+
+    def stop(self):
+        self.running = False
+        self.wake_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=1)
+
+    def wake(self):
+        """Đọc ngay ở chu kỳ nhanh nhất (ví dụ khi vừa bật đèn tự động)"""
+        self.interval = self.min_interval
+        self.wake_event.set()
+
+    def _sample_loop(self):
+        while self.running:
+            if self.active is None or self.active():
+                self.sample_now()
+                timeout = self.interval
+            else:
+                timeout = self.max_interval
+            self.wake_event.wait(timeout)
+            self.wake_event.clear()
+
+    def sample_now(self):
+        """Đọc cảm biến một lần, cập nhật giá trị đã làm mượt và báo cho listener"""
+        # Luồng lấy mẫu và luồng request Flask (read_light_level) có thể cùng gọi:
+        # tuần tự hóa để listener (quyết định bật/tắt đèn) không chạy song song
+        with self.sample_lock:
+            try:
+                raw = self.read_func()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Lỗi khi đọc cảm biến ánh sáng: {e}")
+                return None
+            now = time.monotonic()
+            with self.lock:
+                previous = self.value
+                if previous is None or now - self.timestamp > 2 * self.max_interval:
+                    # Chưa có mẫu hoặc mẫu cũ đã quá lâu: bắt đầu lại từ giá trị đo
+                    self.value = raw
+                    self.interval = self.min_interval
+                else:
+                    self.value += self.smoothing * (raw - self.value)
+                    if abs(raw - previous) > max(self.min_change, self.change_ratio * previous):
+                        self.interval = self.min_interval
+                    else:
+                        self.interval = min(self.interval * 2, self.max_interval)
+                self.timestamp = now
+                self.samples += 1
+                value = round(self.value, 1)
+            for callback in self.listeners:
+                try:
+                    callback(now, value)
+                except Exception as e:
+                    logging.error(f"Lỗi trong callback của light sampler: {e}")
+            return value
+
+    def latest(self, max_age=None):
+        """Giá trị đã làm mượt mới nhất, None nếu chưa có hoặc cũ hơn `max_age` giây"""
+        with self.lock:
+            if self.value is None:
+                return None
+            if max_age is not None and time.monotonic() - self.timestamp > max_age:
+                return None
+            return round(self.value, 1)
+
+class HysteresisSwitch:
+    """Quyết định bật/tắt đèn theo độ rọi với vùng trễ và thời gian giữ tối thiểu.
+
+    Bật khi độ rọi dưới `on_below`, tắt khi từ `off_above` trở lên; ở giữa hai
+    ngưỡng thì giữ nguyên. Sau mỗi lần chuyển trạng thái phải chờ ít nhất
+    `min_dwell` giây mới được chuyển tiếp.
+    """
+    def __init__(self, on_below=40, off_above=70, min_dwell=30):
+        if on_below >= off_above:
+            raise ValueError("Ngưỡng bật phải nhỏ hơn ngưỡng tắt")
+        self.on_below = on_below
+        self.off_above = off_above
+        self.min_dwell = min_dwell
+        self.last_change = None
+        self.switches = 0
+
+    def update(self, lux, current, now=None):
+        """Trạng thái mới (True/False) nếu cần chuyển đèn, None nếu giữ nguyên"""
+        now = time.monotonic() if now is None else now
+        if current and lux >= self.off_above:
+            wanted = False
+        elif not current and lux < self.on_below:
+            wanted = True
+        else:
+            return None
+        if self.last_change is not None and now - self.last_change < self.min_dwell:
+            return None
+        self.last_change = now
+        self.switches += 1
+        return wanted
@@ -7,17 +7,22 @@ import os
 import time
 import sys
 import signal
+import argparse
 import threading
-import tkinter as tk
-from tkinter import simpledialog
 from datetime import datetime
-import json
 import logging
 
 # Cấu hình logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Import các module phụ thuộc
+try:
+    import tkinter as tk
+    from tkinter import simpledialog
+    has_tkinter = True
+except ImportError:
+    has_tkinter = False  # Thiết bị không màn hình: đăng ký qua ai_control
+
 try:
     from picamera2 import Picamera2
     has_picamera = True
@@ -27,7 +32,7 @@ except ImportError:
 
 # Import audio_player
 try:
-    from audio_player import play_welcome_sound, play_personalized_greeting
+    from audio_player import play_welcome_sound, play_personalized_greeting, get_audio_service
     has_audio = True
 except ImportError:
     has_audio = False
@@ -36,22 +41,60 @@ except ImportError:
 # Import face_detector
 try:
     from face_detector import (
-        load_face_detector, detect_faces, create_face_recognizer, load_face_data,
-        register_new_face, train_face_recognizer
+        load_face_detector, create_face_recognizer, load_face_data,
+        load_face_mapping, register_new_face, RecognizerTrainer, FaceFinder
     )
+    from face_store import normalize_face
     has_face_detection = True
 except ImportError:
     has_face_detection = False
     logging.warning("Không tìm thấy module face_detector - tắt tính năng nhận diện khuôn mặt")
 
+# Import face_tracker
+try:
+    from face_tracker import BoxTracker
+    has_face_tracker = True
+except ImportError:
+    has_face_tracker = False
+    logging.warning("Không tìm thấy module face_tracker - nhận diện lại mọi khuôn mặt mỗi lần phát hiện")
+
 # Import yolo_detector
 try:
-    from yolo_detector import load_yolo_model, detect_people
+    from yolo_detector import load_yolo_model, PersonDetector
     has_yolo = True
 except ImportError:
     has_yolo = False
     logging.warning("Không tìm thấy module yolo_detector - tắt tính năng nhận diện người")
 
+from ai_pipeline import DropOldestQueue, StageStats
+from config import ENROLL_FRAMES, ENROLL_DURATION, AI_PREVIEW_WIDTH, AI_CONTROL_HOST, AI_CONTROL_PORT, AI_CONTROL_BIND
+
+# Import máy chủ điều khiển dùng cho chế độ không màn hình
+try:
+    from ai_control import ControlServer
+    has_ai_control = True
+except ImportError:
+    has_ai_control = False
+    logging.warning("Không tìm thấy module ai_control - chế độ --headless không thể đăng ký người dùng")
+
+# Import cổng chuyển động
+try:
+    from motion_gate import MotionGate
+    has_motion_gate = True
+except ImportError:
+    has_motion_gate = False
+    logging.warning("Không tìm thấy module motion_gate - các bộ nhận diện chạy theo chu kỳ cố định")
+
+# Import kênh IPC gửi kết quả nhận diện sang app.py
+try:
+    from detection_bus import DetectionPublisher
+    detection_publisher = DetectionPublisher()
+    has_detection_bus = True
+except (ImportError, AttributeError, OSError) as e:  # AttributeError: hệ điều hành không có AF_UNIX
+    detection_publisher = None
+    has_detection_bus = False
+    logging.warning(f"Không khởi tạo được detection_bus - app.py sẽ không nhận được người dùng: {e}")
+
 # Import modules quản lý độ cao và theo dõi người dùng
 try:
     from usage_tracker import usage_tracker
@@ -63,7 +106,6 @@ except ImportError:
 
 # Đường dẫn thư mục
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
-DETECTED_USER_FILE = os.path.join(BASE_PATH, "data", "detected_user.json")
 
 # Cấu hình mặc định
 CAMERA_WIDTH = 640
@@ -77,27 +119,31 @@ WELCOME_COOLDOWN = 30  # giây
 # Tần suất phát hiện
 DETECTION_INTERVAL = 5  # Phát hiện người mỗi x khung hình
 FACE_DETECTION_INTERVAL = 10  # Nhận diện khuôn mặt mỗi x khung hình
+# Mỗi luồng suy luận chạy theo nhịp riêng (giây), quy đổi từ số khung hình ở trên
+YOLO_PERIOD = DETECTION_INTERVAL / FRAME_RATE
+FACE_PERIOD = FACE_DETECTION_INTERVAL / FRAME_RATE
+STATS_INTERVAL = 10  # Ghi log FPS/độ trễ của từng tầng mỗi x giây
 
 # Biến toàn cục
 running = True
-is_playing_sound = False
-file_lock = threading.Lock()
+shutdown_event = threading.Event()  # Đánh thức luồng chính ngay khi nhận tín hiệu tắt
 
 def signal_handler(sig, frame):
     """Xử lý tín hiệu tắt chương trình"""
     global running
     logging.info("\nĐang tắt chương trình...")
     running = False
+    shutdown_event.set()
 
-def save_detected_user(user):
-    """Lưu thông tin người dùng được nhận diện vào detected_user.json"""
-    try:
-        with file_lock:
-            with open(DETECTED_USER_FILE, 'w') as f:
-                json.dump(user if user else {}, f)
-            logging.debug(f"Đã lưu detected_user.json: {json.dumps(user)}")
-    except Exception as e:
-        logging.error(f"Lỗi khi lưu detected_user.json: {e}")
+def publish_detected_user(user, confidence=0.0):
+    """Gửi người dùng được nhận diện (None = không có) sang app.py qua detection_bus"""
+    if has_detection_bus:
+        detection_publisher.set_user(user, confidence)
+
+def publish_person_count(count):
+    """Gửi số người phát hiện trong khung hình sang app.py"""
+    if has_detection_bus:
+        detection_publisher.set_box_count(count)
 
 class AIDetector:
     def __init__(self):
@@ -108,36 +154,56 @@ class AIDetector:
         self.recognized_faces = {}  # {face_id: last_time}
         self.person_detected = False
         self.last_person_time = 0
+        self.face_lock = threading.Lock()  # Luồng nhận diện và luồng đăng ký dùng chung face_recognizer
+        self.face_tracker = BoxTracker() if has_face_tracker else None
         
         # Khởi tạo các thành phần nhận diện
         self.init_detectors()
+        
+        # Khởi động dịch vụ phát âm thanh: tìm trình phát và giải mã sẵn các file chào
+        self.audio = get_audio_service() if has_audio else None
     
     def init_detectors(self):
         """Khởi tạo các bộ nhận diện"""
         # Khởi tạo bộ nhận diện khuôn mặt
         self.face_detector = None
+        self.face_finder = None
         self.face_recognizer = None
         self.face_info = {}
+        self.trainer = None
         
         if has_face_detection:
             logging.info("Đang khởi tạo bộ phát hiện khuôn mặt...")
             self.face_detector = load_face_detector()
             if self.face_detector is not None:
+                self.face_finder = FaceFinder(self.face_detector)
+                logging.info(f"Hồ sơ phát hiện khuôn mặt: {self.face_finder.profile} "
+                             f"(x{self.face_finder.scale}, ROI={'bật' if self.face_finder.use_roi else 'tắt'})")
                 self.face_recognizer = create_face_recognizer()
                 has_face_model, self.face_info = load_face_data(self.face_recognizer)
                 if has_face_model:
                     logging.info(f"Đã tải thông tin cho {len(self.face_info)} khuôn mặt")
+                self.trainer = RecognizerTrainer(self.swap_recognizer)
+                if not has_face_model and self.face_info:
+                    # Có mẫu nhưng chưa có mô hình (ví dụ vừa nhập dữ liệu cũ): huấn luyện nền
+                    logging.info("Chưa có mô hình cho các mẫu đã lưu - đang huấn luyện lại")
+                    self.trainer.rebuild()
         
         # Khởi tạo bộ nhận diện người (YOLO)
         self.yolo_net = None
         self.output_layers = None
         self.person_class_id = None
+        self.person_detector = None
         
         if has_yolo:
             logging.info("Đang khởi tạo bộ phát hiện người...")
             self.yolo_net, self.output_layers, self.person_class_id = load_yolo_model()
             if self.yolo_net is None:
                 logging.error("Không thể tải mô hình YOLO")
+            else:
+                self.person_detector = PersonDetector(self.yolo_net, self.output_layers, self.person_class_id)
+                logging.info(f"Hồ sơ phát hiện người: {self.person_detector.profile} "
+                             f"({self.person_detector.input_size}px, ROI={'bật' if self.person_detector.use_roi else 'tắt'})")
     
     def init_camera(self):
         """Khởi tạo camera"""
@@ -182,29 +248,82 @@ class AIDetector:
     
     def detect_people_in_frame(self, frame):
         """Nhận diện người trong khung hình"""
-        if self.yolo_net is None or not has_yolo:
+        if self.person_detector is None or not has_yolo:
             return [], []
         
-        return detect_people(frame, self.yolo_net, self.output_layers, self.person_class_id)
+        return self.person_detector.detect(frame)
     
-    def detect_faces_in_frame(self, frame):
-        """Nhận diện khuôn mặt trong khung hình"""
-        if self.face_detector is None or not has_face_detection:
+    def detect_faces_in_frame(self, frame, person_boxes=()):
+        """Nhận diện khuôn mặt trong khung hình, ưu tiên vùng quanh các box người"""
+        if self.face_finder is None or not has_face_detection:
             return []
         
-        return detect_faces(frame, self.face_detector)
+        return self.face_finder.detect(frame, person_boxes)
+    
+    def recognize_faces(self, frame, current_time, person_boxes=()):
+        """Phát hiện và nhận diện khuôn mặt, trả về danh sách (x, y, w, h, nhãn, màu, độ tin cậy) để vẽ.
+
+        Khuôn mặt được ghép với track của các lần trước; bộ nhận diện chỉ chạy cho track
+        mới, track đã mất hoặc track có độ tin cậy đã giảm dưới ngưỡng.
+        """
+        faces = self.detect_faces_in_frame(frame, person_boxes)
+        if self.face_tracker is None:
+            return [self.recognize_face(frame, box, current_time) for box in faces]
+        results = []
+        for track, needs_recognition in self.face_tracker.update(faces, current_time):
+            x, y, w, h = track.box
+            if needs_recognition:
+                face_id, confidence_value = self.predict_face(frame, track.box)
+                known = face_id is not None and face_id in self.face_info
+                identity = self.face_tracker.record(track, face_id if known else None, confidence_value, current_time)
+                if identity is not None:
+                    self.handle_recognized_face(identity, track.confidence(current_time), current_time)
+                else:
+                    publish_detected_user(None)
+            if track.identity is not None:
+                results.append((x, y, w, h, self.face_info[track.identity]["name"], (0, 255, 0),
+                                f"{track.confidence(current_time):.1f}%"))
+            else:
+                results.append((x, y, w, h, "Khong xac dinh", (0, 0, 255), None))
+        return results
+    
+    def predict_face(self, frame, box):
+        """Chạy bộ nhận diện trên vùng khuôn mặt, trả về (face_id, % tin cậy) hoặc (None, 0) nếu dưới ngưỡng"""
+        x, y, w, h = box
+        # Cắt vùng khuôn mặt, chuẩn hóa giống mẫu trong kho để nhận diện
+        face_gray = normalize_face(frame[y:y+h, x:x+w])
+        try:
+            with self.face_lock:
+                # Mỗi backend tự áp ngưỡng và đổi điểm của nó sang % tin cậy
+                return self.face_recognizer.predict(face_gray)
+        except Exception as e:
+            logging.error(f"Lỗi khi nhận diện khuôn mặt: {e}")
+            return None, 0.0
+    
+    def recognize_face(self, frame, box, current_time):
+        """Nhận diện một khuôn mặt không qua tracker"""
+        x, y, w, h = box
+        face_id, confidence_value = self.predict_face(frame, box)
+        if face_id is None:
+            # Khuôn mặt không xác định
+            publish_detected_user(None)
+            return (x, y, w, h, "Khong xac dinh", (0, 0, 255), None)
+        if face_id not in self.face_info:
+            return (x, y, w, h, f"ID: {face_id}", (0, 255, 0), None)
+        # Xử lý khuôn mặt đã nhận diện
+        self.handle_recognized_face(face_id, confidence_value, current_time)
+        return (x, y, w, h, self.face_info[face_id]["name"], (0, 255, 0), f"{confidence_value:.1f}%")
     
     def handle_recognized_face(self, face_id, confidence, current_time):
         """Xử lý khi nhận diện được khuôn mặt"""
-        global is_playing_sound
         
         if face_id in self.face_info:
             person_name = self.face_info[face_id]["name"]
             logging.info(f"Nhận diện: {person_name} (ID: {face_id}, Độ tin cậy: {confidence:.1f}%)")
             
-            # Lưu thông tin người dùng vào detected_user.json
+            # Gửi thông tin người dùng sang app.py
             user_data = {"user_id": str(face_id), "user_name": person_name}
-            save_detected_user(user_data)
+            publish_detected_user(user_data, confidence)
             
             # Bắt đầu theo dõi thời gian sử dụng cho người dùng này
             if has_height_features:
@@ -217,68 +336,94 @@ class AIDetector:
             
             # Phát âm thanh chào nếu là người mới xuất hiện
             if face_id not in self.recognized_faces or current_time - self.recognized_faces.get(face_id, 0) > FACE_GREETING_COOLDOWN:
-                if not is_playing_sound and has_audio:
-                    is_playing_sound = True
-                    
-                    # Tạo thread riêng để phát âm thanh
-                    def play_sound_thread():
-                        global is_playing_sound
-                        play_personalized_greeting(person_name, face_id)
-                        is_playing_sound = False
-                    
-                    sound_thread = threading.Thread(target=play_sound_thread)
-                    sound_thread.daemon = True
-                    sound_thread.start()
-                    
+                # Dịch vụ phát tự xếp hàng và gộp lời chào trùng, không chặn luồng nhận diện
+                if has_audio and play_personalized_greeting(person_name, face_id):
                     # Cập nhật thời gian cuối cùng phát hiện
                     self.recognized_faces[face_id] = current_time
     
-    def register_new_user(self):
-        """Đăng ký người dùng mới nếu chưa có trong database"""
-        if not has_face_detection:
+    def capture_enrollment_frames(self, next_frame=None):
+        """Chụp ENROLL_FRAMES khung hình cách đều trong ENROLL_DURATION giây"""
+        next_frame = next_frame or self.get_frame
+        interval = ENROLL_DURATION / ENROLL_FRAMES
+        frames = []
+        deadline = time.time() + ENROLL_DURATION + 1
+        while len(frames) < ENROLL_FRAMES and time.time() < deadline:
+            started = time.time()
+            frame = next_frame()
+            if frame is not None:
+                frames.append(frame)
+            time.sleep(max(0, interval - (time.time() - started)))
+        return frames
+    
+    def register_new_user(self, next_frame=None, user_name=None):
+        """Đăng ký người dùng mới, trả về (thành công, thông báo).
+
+        next_frame trả về khung hình mới nhất (của pipeline); mặc định lấy trực tiếp từ camera.
+        Không truyền user_name thì hỏi tên bằng hộp thoại.
+        """
+        if not has_face_detection or self.face_detector is None:
             logging.error("Không thể đăng ký người dùng mới - không có module face_detector")
-            return False
-            
-        # Lấy khung hình hiện tại
-        frame = self.get_frame()
-        if frame is None:
-            logging.error("Không thể lấy khung hình từ camera")
-            return False
-        
-        # Tạo cửa sổ dialog để nhập tên
-        root = tk.Tk()
-        root.withdraw()  # Ẩn cửa sổ chính
+            return False, "Không có bộ phát hiện khuôn mặt"
         
-        # Hiển thị dialog yêu cầu nhập tên
-        user_name = simpledialog.askstring("Đăng ký người dùng", "Nhập tên của bạn:")
-        root.destroy()
+        if user_name is None:
+            if not has_tkinter:
+                return False, "Không có tkinter để nhập tên"
+            # Tạo cửa sổ dialog để nhập tên
+            root = tk.Tk()
+            root.withdraw()  # Ẩn cửa sổ chính
+            
+            # Hiển thị dialog yêu cầu nhập tên
+            user_name = simpledialog.askstring("Đăng ký người dùng", "Nhập tên của bạn:")
+            root.destroy()
         
         if not user_name:
             logging.info("Người dùng đã hủy đăng ký")
-            return False
+            return False, "Đã hủy đăng ký"
+        
+        # Chụp nhiều khung hình trong khi người dùng xoay nhẹ đầu
+        logging.info(f"Hãy nhìn vào camera và xoay nhẹ đầu trong {ENROLL_DURATION} giây...")
+        frames = self.capture_enrollment_frames(next_frame)
+        if not frames:
+            logging.error("Không thể lấy khung hình từ camera")
+            return False, "Không thể lấy khung hình từ camera"
         
         # Gọi hàm đăng ký khuôn mặt
-        success, message = register_new_face(frame, self.face_detector, user_name)
+        success, message, face_id = register_new_face(frames, self.face_detector, user_name)
         
         if success:
             logging.info(message)
             
-            # Huấn luyện lại mô hình
-            train_success, train_message = train_face_recognizer(self.face_recognizer)
-            logging.info(train_message)
-            
-            if train_success:
-                # Tải lại dữ liệu khuôn mặt
-                has_face_model, self.face_info = load_face_data(self.face_recognizer)
-                logging.info("Đã tải lại dữ liệu khuôn mặt")
-                return True
-        else:
-            logging.error(f"Lỗi khi đăng ký người dùng mới: {message}")
+            # Cập nhật mô hình trong luồng nền, camera vẫn tiếp tục chạy
+            self.trainer.enroll(face_id)
+            return True, message
         
-        return False
+        logging.error(f"Lỗi khi đăng ký người dùng mới: {message}")
+        return False, message
+    
+    def rebuild_face_model(self):
+        """Yêu cầu huấn luyện lại toàn bộ mô hình từ mọi mẫu đã lưu (chạy nền)"""
+        if self.trainer is not None:
+            logging.info("Đang huấn luyện lại toàn bộ mô hình khuôn mặt...")
+            self.trainer.rebuild()
+    
+    def swap_recognizer(self, recognizer):
+        """Thay mô hình đang dùng bằng mô hình mới huấn luyện, trả về mô hình cũ"""
+        face_info = load_face_mapping()
+        with self.face_lock:
+            retired = self.face_recognizer
+            self.face_recognizer = recognizer
+            self.face_info = face_info
+        logging.info(f"Đã thay mô hình khuôn mặt ({len(face_info)} người dùng)")
+        return retired
     
     def release(self):
         """Giải phóng tài nguyên"""
+        if self.trainer is not None:
+            self.trainer.stop()
+        
+        if self.audio is not None:
+            self.audio.stop()
+        
         if self.camera is not None:
             if has_picamera:
                 self.camera.stop()
@@ -292,176 +437,240 @@ class AIDetector:
             usage_tracker.stop_tracking()
             logging.info("Đã dừng theo dõi thời gian sử dụng")
 
-def main():
-    """Hàm chính của chương trình"""
-    global running, is_playing_sound
-    
-    # Đăng ký xử lý tín hiệu tắt chương trình
-    signal.signal(signal.SIGINT, signal_handler)
-    
-    logging.info("\n=== MODULE NHẬN DIỆN AI ===")
-    
-    # Khởi tạo bộ nhận diện
-    detector = AIDetector()
+class DetectionPipeline:
+    """Pipeline nhiều luồng: capture -> (YOLO, khuôn mặt) -> hiển thị.
+
+    Các tầng nối với nhau bằng DropOldestQueue nên tầng chậm không kéo FPS của
+    tầng khác xuống; tầng hiển thị vẽ kết quả gần nhất của từng bộ nhận diện.
+    Ở chế độ headless không có tầng hiển thị: không sao chép, không vẽ, không
+    gọi GUI; chỉ ảnh xem trước (nếu có người xem) mới được vẽ.
+    """
+    def __init__(self, detector, headless=False):
+        self.detector = detector
+        self.headless = headless
+        self.yolo_queue = DropOldestQueue(1)
+        self.face_queue = DropOldestQueue(1)
+        self.display_queue = DropOldestQueue(2)
+        stages = ("capture", "yolo", "face") if headless else ("capture", "yolo", "face", "display")
+        self.stats = {name: StageStats(name) for name in stages}
+        self.latest = None  # (thời điểm chụp, khung hình) mới nhất của tầng capture
+        self.result_lock = threading.Lock()
+        self.person_boxes = []
+        self.person_confidences = []
+        self.face_results = []
+        self.greeting_until = 0
+        self.threads = []
+        self.motion_gate = MotionGate() if has_motion_gate else None
+        self.last_run = {}
     
-    # Khởi tạo camera
-    if not detector.init_camera():
-        logging.error("Không thể khởi tạo camera. Thoát chương trình.")
-        return
+    def should_run(self, name, period, captured):
+        """Quyết định bộ nhận diện có chạy trên khung hình này không (qua cổng chuyển động nếu có)"""
+        if self.motion_gate is not None:
+            return self.motion_gate.allow(name, period, captured)
+        if captured - self.last_run.get(name, 0) < period:
+            return False
+        self.last_run[name] = captured
+        return True
     
-    frame_count = 0
-    detected_boxes = []
-    detected_confidences = []
+    def start(self):
+        for name, target in (("capture", self.capture_loop), ("yolo", self.yolo_loop), ("face", self.face_loop)):
+            thread = threading.Thread(target=target, name=f"ai-{name}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
     
-    logging.info("\nĐang chạy... Nhấn Ctrl+C hoặc 'q' để thoát.")
-    logging.info("Nhấn 'r' để đăng ký người dùng mới.")
+    def stop(self):
+        for thread in self.threads:
+            thread.join(timeout=2)
     
-    try:
+    def capture_loop(self):
+        """Luôn giữ khung hình mới nhất trong hàng đợi của mỗi tầng phía sau"""
         while running:
-            start_time = time.time()
-            
-            # Lấy khung hình
-            frame = detector.get_frame()
+            started = time.time()
+            frame = self.detector.get_frame()
             if frame is None:
                 logging.warning("Không thể lấy khung hình. Thử lại...")
                 time.sleep(0.1)
                 continue
+            if self.motion_gate is not None:
+                self.motion_gate.observe(frame)
+            item = (started, frame)
+            self.latest = item
+            self.yolo_queue.put(item)
+            self.face_queue.put(item)
+            if not self.headless:
+                self.display_queue.put(item)
+            self.stats["capture"].record(time.time() - started)
             
-            # Tạo bản sao để hiển thị
-            display_frame = frame.copy()
-            height, width = frame.shape[:2]
-            
-            # Tăng frame count
-            frame_count += 1
-            
-            # Phát hiện người bằng YOLO mỗi vài khung hình
-            if frame_count % DETECTION_INTERVAL == 0 and has_yolo:
-                detected_boxes, detected_confidences = detector.detect_people_in_frame(frame)
-            
-            # Nhận diện khuôn mặt mỗi vài khung hình
-            if has_face_detection and frame_count % FACE_DETECTION_INTERVAL == 0:
-                # Phát hiện khuôn mặt
-                faces = detector.detect_faces_in_frame(frame)
-                
-                current_time = time.time()
-                
-                # Xử lý từng khuôn mặt phát hiện được
-                for (x, y, w, h) in faces:
-                    # Vẽ hình chữ nhật xung quanh khuôn mặt
-                    cv2.rectangle(display_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                    
-                    # Cắt vùng khuôn mặt
-                    face_roi = frame[y:y+h, x:x+w]
-                    
-                    # Chuyển sang ảnh xám để nhận diện
-                    face_gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-                    
-                    # Nhận diện khuôn mặt
-                    try:
-                        face_id, confidence = detector.face_recognizer.predict(face_gray)
-                        confidence_value = 100.0 - confidence  # Chuyển ngược lại thành % tin cậy
-                        
-                        # Kiểm tra độ tin cậy (số nhỏ hơn = tin cậy hơn cho LBPH)
-                        if confidence < 70:  # Ngưỡng tin cậy
-                            # Vẽ tên và độ tin cậy
-                            if face_id in detector.face_info:
-                                person_name = detector.face_info[face_id]["name"]
-                                cv2.putText(display_frame, person_name, (x, y-10), 
-                                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                                cv2.putText(display_frame, f"{confidence_value:.1f}%", (x+w-70, y-10), 
-                                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-                                
-                                # Xử lý khuôn mặt đã nhận diện
-                                detector.handle_recognized_face(face_id, confidence_value, current_time)
-                            else:
-                                cv2.putText(display_frame, f"ID: {face_id}", (x, y-10), 
-                                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                        else:
-                            # Khuôn mặt không xác định
-                            cv2.putText(display_frame, "Khong xac dinh", (x, y-10), 
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-                            # Xóa detected_user.json nếu không nhận diện được
-                            save_detected_user(None)
-                    except Exception as e:
-                        logging.error(f"Lỗi khi nhận diện khuôn mặt: {e}")
-            
-            # Vẽ bounding boxes từ YOLO
-            count = 0
-            for i, (x, y, w, h) in enumerate(detected_boxes):
-                confidence = detected_confidences[i]
-                
-                # Vẽ rectangle và text
-                cv2.rectangle(display_frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
-                cv2.putText(display_frame, f"Nguoi: {confidence:.2f}", (x, y - 10), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-                count += 1
-            
-            # Xử lý logic phát hiện người và phát âm thanh
-            current_time = time.time()
-            person_present_now = count > 0
-            
-            # Nếu phát hiện người và trước đó không có người
-            if person_present_now and not detector.person_detected:
-                detector.person_detected = True
-                
-                # Kiểm tra thời gian kể từ lần cuối phát âm thanh
-                if current_time - detector.last_person_time > WELCOME_COOLDOWN and not is_playing_sound and has_audio:
-                    # Đánh dấu đang phát âm thanh
-                    is_playing_sound = True
-                    
-                    # Tạo thread riêng để phát âm thanh
-                    def play_sound_thread():
-                        global is_playing_sound
-                        play_welcome_sound()
-                        is_playing_sound = False
-                    
-                    sound_thread = threading.Thread(target=play_sound_thread)
-                    sound_thread.daemon = True
-                    sound_thread.start()
-                    
-                    # Cập nhật thời gian cuối cùng phát âm thanh
-                    detector.last_person_time = current_time
-                    
-                    # Hiển thị thông báo
-                    cv2.putText(display_frame, "Xin chao ban!", (width - 200, 60), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            
-            # Nếu không còn phát hiện người
-            elif not person_present_now:
-                detector.person_detected = False
-                # Xóa detected_user.json nếu không có người
-                save_detected_user(None)
-            
-            # Tính FPS
-            fps = 1.0 / (time.time() - start_time)
-            
-            # Hiển thị thông tin
-            cv2.putText(display_frame, f"FPS: {fps:.1f}", (10, 30), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            cv2.putText(display_frame, f"So nguoi: {count}", (10, 60), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            cv2.putText(display_frame, time.strftime("%H:%M:%S"), (width - 150, 30), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
-            
-            # Hiển thị trạng thái
-            status_text = "Trang thai: co nguoi" if detector.person_detected else "Trang thai: khong co nguoi"
-            cv2.putText(display_frame, status_text, (10, 90), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 255), 2)
-            
-            # Hiển thị tên người dùng đang theo dõi nếu có
-            if has_height_features and hasattr(usage_tracker, 'tracking_active') and usage_tracker.tracking_active:
-                current_user = usage_tracker.get_current_user()
-                if current_user:
-                    user_text = f"Nguoi dung: {current_user.get('user_name', 'Khong xac dinh')}"
-                    cv2.putText(display_frame, user_text, (10, 120), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            # Điều chỉnh tốc độ frame
+            if FRAME_RATE > 0:
+                time_to_sleep = 1.0 / FRAME_RATE - (time.time() - started)
+                if time_to_sleep > 0:
+                    time.sleep(time_to_sleep)
+    
+    def yolo_loop(self):
+        if not has_yolo or self.detector.yolo_net is None:
+            return
+        while running:
+            item = self.yolo_queue.get(timeout=0.5)
+            if item is None or not self.should_run("yolo", YOLO_PERIOD, item[0]):
+                continue
+            captured, frame = item
+            started = time.time()
+            boxes, confidences = self.detector.detect_people_in_frame(frame)
+            with self.result_lock:
+                self.person_boxes, self.person_confidences = boxes, confidences
+            self.handle_presence(len(boxes), time.time())
+            self.stats["yolo"].record(time.time() - started)
+    
+    def face_loop(self):
+        if not has_face_detection or self.detector.face_detector is None:
+            return
+        while running:
+            item = self.face_queue.get(timeout=0.5)
+            if item is None or not self.should_run("face", FACE_PERIOD, item[0]):
+                continue
+            captured, frame = item
+            started = time.time()
+            with self.result_lock:
+                person_boxes = list(self.person_boxes)
+            results = self.detector.recognize_faces(frame, started, person_boxes)
+            with self.result_lock:
+                self.face_results = results
+            self.stats["face"].record(time.time() - started)
+    
+    def handle_presence(self, count, current_time):
+        """Xử lý logic phát hiện người và phát âm thanh chào"""
+        detector = self.detector
+        person_present_now = count > 0
+        publish_person_count(count)
+        
+        # Nếu phát hiện người và trước đó không có người
+        if person_present_now and not detector.person_detected:
+            detector.person_detected = True
             
-            # Hiển thị hướng dẫn đăng ký
-            cv2.putText(display_frame, "Nhan 'r' de dang ky nguoi dung moi", 
-                        (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+            # Kiểm tra thời gian kể từ lần cuối phát âm thanh (dịch vụ phát chỉ xếp hàng, không chặn)
+            if current_time - detector.last_person_time > WELCOME_COOLDOWN and has_audio and play_welcome_sound():
+                # Cập nhật thời gian cuối cùng phát âm thanh
+                detector.last_person_time = current_time
+                self.greeting_until = current_time + 2
+        
+        # Nếu không còn phát hiện người
+        elif not person_present_now:
+            detector.person_detected = False
+            # Báo không còn người dùng nếu không có người
+            publish_detected_user(None)
+    
+    def draw(self, display_frame):
+        """Vẽ kết quả gần nhất của các bộ nhận diện lên khung hình hiển thị"""
+        height, width = display_frame.shape[:2]
+        with self.result_lock:
+            boxes, confidences, faces = self.person_boxes, self.person_confidences, self.face_results
+        
+        for (x, y, w, h, label, color, confidence_text) in faces:
+            cv2.rectangle(display_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+            cv2.putText(display_frame, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+            if confidence_text:
+                cv2.putText(display_frame, confidence_text, (x+w-70, y-10), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+        
+        # Vẽ bounding boxes từ YOLO
+        for (x, y, w, h), confidence in zip(boxes, confidences):
+            cv2.rectangle(display_frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+            cv2.putText(display_frame, f"Nguoi: {confidence:.2f}", (x, y - 10), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+        
+        if time.time() < self.greeting_until:
+            cv2.putText(display_frame, "Xin chao ban!", (width - 200, 60), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        
+        # Hiển thị thông tin
+        cv2.putText(display_frame, f"FPS: {self.stats.get('display', self.stats['capture']).fps():.1f}", (10, 30), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        cv2.putText(display_frame, f"So nguoi: {len(boxes)}", (10, 60), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        cv2.putText(display_frame, time.strftime("%H:%M:%S"), (width - 150, 30), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+        
+        # Hiển thị trạng thái
+        status_text = "Trang thai: co nguoi" if self.detector.person_detected else "Trang thai: khong co nguoi"
+        cv2.putText(display_frame, status_text, (10, 90), 
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 255), 2)
+        
+        # Hiển thị tên người dùng đang theo dõi nếu có
+        if has_height_features and hasattr(usage_tracker, 'tracking_active') and usage_tracker.tracking_active:
+            current_user = usage_tracker.get_current_user()
+            if current_user:
+                user_text = f"Nguoi dung: {current_user.get('user_name', 'Khong xac dinh')}"
+                cv2.putText(display_frame, user_text, (10, 120), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        
+        # Hiển thị hướng dẫn đăng ký
+        cv2.putText(display_frame, "Nhan 'r' de dang ky nguoi dung moi", 
+                    (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    
+    def report(self):
+        dropped = self.yolo_queue.dropped + self.face_queue.dropped + self.display_queue.dropped
+        report = " | ".join(stats.summary() for stats in self.stats.values()) + f" | bỏ {dropped} khung"
+        person_detector = self.detector.person_detector
+        if person_detector and person_detector.use_roi:
+            report += f" | YOLO ROI {person_detector.roi_scans}, toàn khung {person_detector.full_scans}"
+        face_finder = self.detector.face_finder
+        if face_finder and face_finder.use_roi:
+            report += f" | Haar ROI {face_finder.roi_scans}, toàn khung {face_finder.full_scans}"
+        if self.motion_gate is not None:
+            report += f" | {self.motion_gate.summary()}"
+        face_tracker = self.detector.face_tracker
+        if face_tracker is not None:
+            report += (f" | nhận diện {face_tracker.recognitions}/{face_tracker.observations} khuôn mặt "
+                       f"({face_tracker.recognition_rate() * 100:.0f}%), {len(face_tracker.tracks)} track")
+        return report
+    
+    def latest_frame(self):
+        """Khung hình mới nhất của tầng capture (dùng khi đăng ký)"""
+        item = self.latest
+        return item[1] if item is not None else None
+    
+    def preview_frame(self):
+        """Bản sao thu nhỏ của khung hình mới nhất đã vẽ kết quả, cho ảnh xem trước MJPEG"""
+        frame = self.latest_frame()
+        if frame is None:
+            return None
+        display_frame = frame.copy()
+        self.draw(display_frame)
+        height, width = display_frame.shape[:2]
+        if width > AI_PREVIEW_WIDTH:
+            display_frame = cv2.resize(display_frame, (AI_PREVIEW_WIDTH, height * AI_PREVIEW_WIDTH // width),
+                                       interpolation=cv2.INTER_AREA)
+        return display_frame
+    
+    def headless_loop(self):
+        """Thay cho display_loop khi không có màn hình: chỉ ghi log thống kê định kỳ"""
+        # Chờ trên event thay vì sleep để SIGTERM được xử lý ngay, kịp dọn dẹp
+        # trước khi app.py hết thời gian chờ và kill() tiến trình
+        while running and not shutdown_event.wait(STATS_INTERVAL):
+            logging.info(f"Pipeline: {self.report()}")
+    
+    def display_loop(self):
+        """Tầng hiển thị chạy trên luồng chính (yêu cầu của cv2.imshow)"""
+        global running
+        last_report = time.time()
+        while running:
+            item = self.display_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            captured, frame = item
             
-            # Hiển thị khung hình
+            # Tạo bản sao để hiển thị
+            display_frame = frame.copy()
+            self.draw(display_frame)
             cv2.imshow("AI Recognition", display_frame)
+            # Độ trễ của tầng hiển thị tính từ lúc chụp khung hình
+            self.stats["display"].record(time.time() - captured)
+            
+            if time.time() - last_report >= STATS_INTERVAL:
+                last_report = time.time()
+                logging.info(f"Pipeline: {self.report()}")
             
             # Kiểm tra phím bấm
             key = cv2.waitKey(1) & 0xFF
@@ -473,21 +682,85 @@ def main():
             # Nhấn 'r' để đăng ký người dùng mới
             elif key == ord('r'):
                 logging.info("Đang bắt đầu đăng ký người dùng mới...")
-                detector.register_new_user()
+                self.detector.register_new_user(self.latest_frame)
             
-            # Điều chỉnh tốc độ frame
-            if FRAME_RATE > 0:
-                time_to_sleep = 1.0 / FRAME_RATE - (time.time() - start_time)
-                if time_to_sleep > 0:
-                    time.sleep(time_to_sleep)
+            # Nhấn 't' để huấn luyện lại toàn bộ mô hình
+            elif key == ord('t'):
+                self.detector.rebuild_face_model()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Module nhận diện người và khuôn mặt")
+    parser.add_argument("--headless", action="store_true",
+                        help="Không hiển thị cửa sổ; đăng ký/huấn luyện qua HTTP "
+                             f"http://{AI_CONTROL_HOST}:{AI_CONTROL_PORT}")
+    parser.add_argument("--preview", action="store_true",
+                        help="Cùng --headless: phục vụ ảnh xem trước MJPEG tại /preview.mjpg")
+    return parser.parse_args()
+
+def main():
+    """Hàm chính của chương trình"""
+    global running
+    args = parse_args()
+    
+    # Đăng ký xử lý tín hiệu tắt chương trình (app.py dừng module bằng SIGTERM)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
+    logging.info("\n=== MODULE NHẬN DIỆN AI ===")
+    
+    # Khởi tạo bộ nhận diện
+    detector = AIDetector()
+    
+    # Khởi tạo camera
+    if not detector.init_camera():
+        logging.error("Không thể khởi tạo camera. Thoát chương trình.")
+        return
+    
+    pipeline = DetectionPipeline(detector, headless=args.headless)
+    control = None
+    
+    if args.headless:
+        logging.info("\nĐang chạy không màn hình... Nhấn Ctrl+C để thoát.")
+        if has_ai_control:
+            try:
+                control = ControlServer(
+                    register=lambda name: detector.register_new_user(pipeline.latest_frame, name),
+                    rebuild=detector.rebuild_face_model,
+                    status=pipeline.report,
+                    snapshot=pipeline.preview_frame if args.preview else None)
+                control.start()
+                logging.info(f"Đăng ký: POST http://{AI_CONTROL_HOST}:{AI_CONTROL_PORT}/register {{\"name\": ...}}")
+                if args.preview:
+                    logging.info(f"Xem trước: http://<địa chỉ Pi>:{AI_CONTROL_PORT}/preview.mjpg (lắng nghe trên {AI_CONTROL_BIND})")
+            except OSError as e:
+                logging.error(f"Không mở được cổng điều khiển {AI_CONTROL_PORT}: {e}")
+    else:
+        logging.info("\nĐang chạy... Nhấn Ctrl+C hoặc 'q' để thoát.")
+        logging.info("Nhấn 'r' để đăng ký người dùng mới.")
+        logging.info("Nhấn 't' để huấn luyện lại toàn bộ mô hình khuôn mặt.")
+    
+    try:
+        pipeline.start()
+        if args.headless:
+            pipeline.headless_loop()
+        else:
+            pipeline.display_loop()
     
     except Exception as e:
         logging.error(f"Lỗi: {e}")
     
     finally:
-        # Giải phóng tài nguyên
+        # Dừng các luồng rồi giải phóng tài nguyên
+        running = False
+        if control is not None:
+            control.stop()
+        pipeline.stop()
         detector.release()
-        cv2.destroyAllWindows()
+        if has_detection_bus:
+            publish_detected_user(None)
+            detection_publisher.close()
+        if not args.headless:
+            cv2.destroyAllWindows()
         logging.info("Chương trình đã kết thúc")
 
 if __name__ == "__main__":
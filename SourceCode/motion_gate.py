@@ -0,0 +1,73 @@
+# motion_gate.py - Cổng chuyển động rẻ tiền quyết định khi nào chạy YOLO và nhận diện khuôn mặt
+
+import time
+import threading
+import cv2
+from config import *
+
+class MotionGate:
+    """So sánh ảnh xám thu nhỏ của từng khung hình với nền cập nhật dần.
+
+    Khi cảnh đứng yên, chu kỳ của các bộ nhận diện được kéo dài dần tới
+    MOTION_MAX_IDLE_FACTOR lần chu kỳ gốc; có chuyển động thì trở lại ngay
+    chu kỳ gốc. Tỷ lệ bỏ qua được tính so với số lần chạy nếu không có cổng.
+    """
+    def __init__(self):
+        self.background = None
+        self.score = 0.0  # Tỷ lệ điểm ảnh thay đổi của khung hình gần nhất
+        self.last_motion = time.time()
+        self.lock = threading.Lock()
+        self.last_run = {}
+        self.last_due = {}
+        self.runs = {}
+        self.due = {}
+
+    def observe(self, frame):
+        """Cập nhật mức chuyển động từ một khung hình BGR, trả về tỷ lệ điểm ảnh thay đổi"""
+        small = cv2.resize(frame, MOTION_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self.background is None:
+            self.background = gray.astype("float32")
+            return 0.0
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        changed = cv2.countNonZero(cv2.threshold(diff, MOTION_PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)[1])
+        cv2.accumulateWeighted(gray, self.background, MOTION_BACKGROUND_RATE)
+        score = changed / diff.size
+        with self.lock:
+            self.score = score
+            if score >= MOTION_MIN_AREA:
+                self.last_motion = time.time()
+        return score
+
+    def idle_factor(self, now):
+        """Hệ số kéo dài chu kỳ theo thời gian cảnh đứng yên"""
+        with self.lock:
+            idle = now - self.last_motion - MOTION_ACTIVE_HOLD
+        if idle <= 0:
+            return 1.0
+        return min(MOTION_MAX_IDLE_FACTOR, 1.0 + idle / MOTION_IDLE_RAMP)
+
+    def allow(self, name, base_period, now):
+        """True nếu bộ nhận diện `name` (chu kỳ gốc `base_period` giây) nên chạy lúc `now`"""
+        with self.lock:
+            if now - self.last_due.get(name, 0) >= base_period:
+                self.last_due[name] = now
+                self.due[name] = self.due.get(name, 0) + 1
+            elapsed = now - self.last_run.get(name, 0)
+        if elapsed < base_period * self.idle_factor(now):
+            return False
+        with self.lock:
+            self.last_run[name] = now
+            self.runs[name] = self.runs.get(name, 0) + 1
+        return True
+
+    def skip_rate(self, name):
+        """Tỷ lệ số lần chạy bị bỏ so với không có cổng chuyển động"""
+        with self.lock:
+            due = self.due.get(name, 0)
+            runs = self.runs.get(name, 0)
+        return max(0.0, 1 - runs / due) if due else 0.0
+
+    def summary(self):
+        rates = ", ".join(f"{name} bỏ {self.skip_rate(name) * 100:.0f}%" for name in sorted(self.due))
+        return f"chuyển động {self.score * 100:.1f}%, hệ số x{self.idle_factor(time.time()):.1f}, {rates}"
@@ -0,0 +1,81 @@
+# motion_planner.py - Lập lịch tăng tốc/chạy đều/giảm tốc cho động cơ nâng hạ
+
+import math
+import logging
+from array import array
+
+# Cài đặt mặc định (micro giây cho nửa chu kỳ xung)
+START_PULSE = 1000  # Nửa chu kỳ khi khởi động và khi dừng (tương đương PULSE_SLOW)
+CRUISE_PULSE = 500  # Nửa chu kỳ khi chạy đều (tương đương PULSE_SPEED)
+ACCELERATION = 2000  # Gia tốc (bước/giây^2)
+STEPS_PER_CM = 200  # Số bước cho mỗi cm, cần hiệu chuẩn cho từng bàn
+SLOW_ZONE_CM = 10  # Vùng chạy chậm của thuật toán cũ
+
+def plan_trapezoid(steps, start_pulse=START_PULSE, cruise_pulse=CRUISE_PULSE, acceleration=ACCELERATION):
+    """Tạo lịch nửa chu kỳ (micro giây) cho từng bước theo hình thang.
+
+    Tăng tốc đều từ tốc độ khởi động lên tốc độ chạy đều, giữ nguyên, rồi giảm
+    tốc đối xứng về tốc độ khởi động. Nếu quãng đường ngắn, lịch có dạng tam giác.
+    """
+    steps = max(0, int(steps))
+    schedule = array('I', [cruise_pulse]) * steps
+    if steps == 0:
+        return schedule
+    v_start = 1000000 / (2 * start_pulse)
+    v_cruise = 1000000 / (2 * cruise_pulse)
+    if v_cruise <= v_start:
+        for i in range(steps):
+            schedule[i] = start_pulse
+        return schedule
+    ramp_steps = int(math.ceil((v_cruise ** 2 - v_start ** 2) / (2 * acceleration)))
+    ramp_steps = min(ramp_steps, steps // 2)
+    for i in range(ramp_steps):
+        v = math.sqrt(v_start ** 2 + 2 * acceleration * i)
+        half_period = int(round(1000000 / (2 * v)))
+        half_period = max(cruise_pulse, min(start_pulse, half_period))
+        schedule[i] = half_period
+        schedule[steps - 1 - i] = half_period
+    if steps % 2 and ramp_steps == steps // 2:
+        # Bước giữa của lịch tam giác dùng tốc độ đỉnh của sườn tăng tốc
+        schedule[ramp_steps] = schedule[ramp_steps - 1] if ramp_steps else start_pulse
+    return schedule
+
+def plan_move(current_height, target_height, steps_per_cm=STEPS_PER_CM, **kwargs):
+    """Chuyển quãng đường từ độ cao hiện tại tới mục tiêu thành lịch bước"""
+    if current_height <= 0 or target_height <= 0:
+        return None
+    steps = int(round(abs(target_height - current_height) * steps_per_cm))
+    return plan_trapezoid(steps, **kwargs)
+
+def expected_move_time(schedule):
+    """Thời gian dự kiến (giây) để phát hết lịch bước"""
+    return 2 * sum(schedule) / 1000000
+
+def legacy_move_time(current_height, target_height, steps_per_cm=STEPS_PER_CM,
+                     fast_pulse=CRUISE_PULSE, slow_pulse=START_PULSE, slow_zone_cm=SLOW_ZONE_CM):
+    """Thời gian dự kiến của thuật toán cũ: chạy nhanh, chậm lại khi cách mục tiêu < 10 cm"""
+    distance = abs(target_height - current_height)
+    slow_cm = min(distance, slow_zone_cm)
+    fast_cm = distance - slow_cm
+    return 2 * (fast_cm * steps_per_cm * fast_pulse + slow_cm * steps_per_cm * slow_pulse) / 1000000
+
+def simulate_move(current_height, target_height, steps_per_cm=STEPS_PER_CM, **kwargs):
+    """Mô phỏng một lần di chuyển và so sánh với thuật toán cũ"""
+    schedule = plan_move(current_height, target_height, steps_per_cm, **kwargs)
+    if schedule is None:
+        return None
+    planned = expected_move_time(schedule)
+    legacy = legacy_move_time(current_height, target_height, steps_per_cm)
+    return {
+        'steps': len(schedule),
+        'planned_time': round(planned, 2),
+        'legacy_time': round(legacy, 2),
+        'speedup': round(legacy / planned, 2) if planned > 0 else 0.0
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for current, target in [(49, 58), (58, 49), (70, 110), (110, 70), (75, 76)]:
+        result = simulate_move(current, target)
+        logging.info(f"{current}cm -> {target}cm: {result['steps']} bước, lập lịch {result['planned_time']}s, "
+                     f"thuật toán cũ {result['legacy_time']}s (nhanh hơn x{result['speedup']})")
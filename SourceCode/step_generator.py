@@ -0,0 +1,192 @@
+# step_generator.py - Bộ tạo xung bước cho động cơ nâng hạ bàn
+
+import time
+import logging
+from abc import ABC, abstractmethod
+from array import array
+
+# Ngưỡng chuyển từ time.sleep sang chờ bận (giây). Với khoảng chờ ngắn hơn,
+# time.sleep phụ thuộc bộ lập lịch nên dùng vòng chờ trên perf_counter.
+SPIN_THRESHOLD = 0.002
+
+class SimulatedPin:
+    """Chân GPIO giả lập để đo hiệu năng bộ tạo xung khi không có phần cứng"""
+    def __init__(self):
+        self.value = 0
+        self.pulses = 0
+
+    def on(self):
+        self.value = 1
+        self.pulses += 1
+
+    def off(self):
+        self.value = 0
+
+class StepEngine(ABC):
+    """Lớp cơ sở cho các bộ tạo xung bước"""
+    name = "base"
+
+    def __init__(self, pul_pin):
+        self.pul_pin = pul_pin
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Xóa số liệu thống kê tốc độ bước"""
+        self.steps = 0
+        self.requested_time = 0.0  # Tổng thời gian theo lịch (giây)
+        self.elapsed_time = 0.0  # Tổng thời gian thực tế (giây)
+
+    def run(self, count, half_period_us, should_stop=None):
+        """Phát `count` bước với nửa chu kỳ cố định, trả về số bước đã phát"""
+        return self.run_schedule([half_period_us] * count, should_stop)
+
+    @abstractmethod
+    def run_schedule(self, half_periods_us, should_stop=None):
+        """Phát một chuỗi bước theo danh sách nửa chu kỳ (micro giây)"""
+
+    def stats(self):
+        """Trả về tốc độ bước yêu cầu và tốc độ thực tế (bước/giây)"""
+        requested_rate = self.steps / self.requested_time if self.requested_time > 0 else 0.0
+        achieved_rate = self.steps / self.elapsed_time if self.elapsed_time > 0 else 0.0
+        return {
+            'engine': self.name,
+            'steps': self.steps,
+            'requested_rate': round(requested_rate, 1),
+            'achieved_rate': round(achieved_rate, 1),
+            'ratio': round(achieved_rate / requested_rate, 3) if requested_rate > 0 else 0.0
+        }
+
+    def _record(self, steps, requested_time, elapsed_time):
+        self.steps += steps
+        self.requested_time += requested_time
+        self.elapsed_time += elapsed_time
+
+class SleepStepEngine(StepEngine):
+    """Bộ tạo xung cũ: bật/tắt chân PUL và time.sleep sau mỗi cạnh (dự phòng)"""
+    name = "sleep"
+
+    def run_schedule(self, half_periods_us, should_stop=None):
+        pul_pin = self.pul_pin
+        sleep = time.sleep
+        start = time.perf_counter()
+        requested = 0.0
+        steps = 0
+        for half_period_us in half_periods_us:
+            if should_stop is not None and should_stop():
+                break
+            half_period = half_period_us / 1000000
+            pul_pin.on()
+            sleep(half_period)
+            pul_pin.off()
+            sleep(half_period)
+            requested += 2 * half_period
+            steps += 1
+        self._record(steps, requested, time.perf_counter() - start)
+        return steps
+
+class BatchStepEngine(StepEngine):
+    """Phát từng loạt N bước theo bảng thời gian tính trước.
+
+    Mỗi cạnh xung được neo vào thời điểm tuyệt đối tính từ đầu loạt nên độ trễ
+    của một bước không cộng dồn sang các bước sau.
+    """
+    name = "batch"
+
+    def __init__(self, pul_pin, spin_threshold=SPIN_THRESHOLD):
+        super().__init__(pul_pin)
+        self.spin_threshold = spin_threshold
+        self._table_cache = {}
+
+    @staticmethod
+    def build_timing_table(half_periods_us):
+        """Tạo bảng thời điểm (giây, tính từ đầu loạt) cho mỗi cạnh lên và xuống"""
+        table = array('d', bytes(16 * len(half_periods_us)))
+        t = 0.0
+        i = 0
+        for half_period_us in half_periods_us:
+            table[i] = t  # Cạnh lên
+            t += half_period_us / 1000000
+            table[i + 1] = t  # Cạnh xuống
+            t += half_period_us / 1000000
+            i += 2
+        return table, t
+
+    def run(self, count, half_period_us, should_stop=None):
+        key = (count, half_period_us)
+        cached = self._table_cache.get(key)
+        if cached is None:
+            cached = self.build_timing_table([half_period_us] * count)
+            self._table_cache[key] = cached
+        return self.run_table(cached[0], cached[1], should_stop)
+
+    def run_schedule(self, half_periods_us, should_stop=None):
+        table, total = self.build_timing_table(half_periods_us)
+        return self.run_table(table, total, should_stop)
+
+    def run_table(self, table, total_time, should_stop=None):
+        """Phát các cạnh xung theo bảng thời điểm đã tính sẵn"""
+        pul_pin = self.pul_pin
+        clock = time.perf_counter
+        sleep = time.sleep
+        spin_threshold = self.spin_threshold
+        start = clock()
+        steps = 0
+        edges = len(table)
+        for i in range(edges):
+            rising = not (i & 1)
+            if rising and should_stop is not None and should_stop():
+                break
+            deadline = start + table[i]
+            remaining = deadline - clock()
+            if remaining > spin_threshold:
+                sleep(remaining - spin_threshold)
+            while clock() < deadline:
+                pass
+            if rising:
+                pul_pin.on()
+            else:
+                pul_pin.off()
+                steps += 1
+        # Chờ hết nửa chu kỳ thấp của bước cuối cùng
+        if steps == edges // 2:
+            deadline = start + total_time
+            while clock() < deadline:
+                pass
+            requested = total_time
+        else:
+            requested = table[2 * steps] if steps else 0.0
+        self._record(steps, requested, clock() - start)
+        return steps
+
+ENGINES = {
+    SleepStepEngine.name: SleepStepEngine,
+    BatchStepEngine.name: BatchStepEngine
+}
+
+def create_step_engine(pul_pin, engine_name="batch"):
+    """Tạo bộ tạo xung theo tên, quay về bộ sleep nếu tên không hợp lệ"""
+    engine_cls = ENGINES.get(engine_name)
+    if engine_cls is None:
+        logging.warning(f"Không có bộ tạo xung '{engine_name}', sử dụng 'sleep'")
+        engine_cls = SleepStepEngine
+    return engine_cls(pul_pin)
+
+def benchmark(steps=2000, half_period_us=500, burst=50):
+    """So sánh tốc độ bước yêu cầu và thực tế của các bộ tạo xung trên chân giả lập"""
+    results = []
+    for engine_cls in ENGINES.values():
+        pin = SimulatedPin()
+        engine = engine_cls(pin)
+        for _ in range(steps // burst):
+            engine.run(burst, half_period_us)
+        stats = engine.stats()
+        stats['pulses'] = pin.pulses
+        results.append(stats)
+    return results
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for result in benchmark():
+        logging.info(f"{result['engine']}: yêu cầu {result['requested_rate']} bước/s, "
+                     f"thực tế {result['achieved_rate']} bước/s (tỷ lệ {result['ratio']}), "
+                     f"{result['pulses']} xung")
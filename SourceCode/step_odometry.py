@@ -0,0 +1,76 @@
+# step_odometry.py - Ước lượng độ cao theo số bước đã phát (dead reckoning)
+
+import logging
+
+CHECK_EVERY_CM = 3  # Đối chiếu với cảm biến siêu âm sau mỗi x cm di chuyển
+CORRECTION_TOLERANCE = 1.5  # Sai lệch (cm) tối đa trước khi đặt lại mốc theo cảm biến
+MIN_CALIBRATION_CM = 3  # Quãng đường tối thiểu để học lại số bước/cm
+LEARNING_RATE = 0.3  # Trọng số của phép đo mới khi cập nhật hiệu chuẩn
+
+class StepOdometer:
+    """Đếm bước trong một lần di chuyển và quy đổi ra cm.
+
+    Cảm biến chỉ được đọc khi `due_for_check()` trả về True; cuối mỗi lần di
+    chuyển, `learn()` so sánh tổng số bước với quãng đường đo được để cập nhật
+    hệ số số bước/cm. Quãng đường này phải lấy từ mẫu cảm biến thô: độ cao đã
+    lọc (Kalman) được dự đoán bằng chính hệ số đang hiệu chỉnh nên kéo kết quả
+    về giá trị cũ.
+    """
+    def __init__(self, steps_per_cm, check_every_cm=CHECK_EVERY_CM):
+        self.steps_per_cm = steps_per_cm
+        self.check_every_cm = check_every_cm
+        self.begin(-1)
+
+    def begin(self, start_height, calibration_height=None):
+        """Bắt đầu một lần di chuyển mới từ độ cao đo được.
+
+        `calibration_height` là độ cao đo thô lúc bắt đầu dùng cho `learn()`
+        (mặc định bằng `start_height`).
+        """
+        self.start_height = start_height
+        self.calibration_start = start_height if calibration_height is None else calibration_height
+        self.anchor_height = start_height
+        self.net_steps = 0  # Dương = đi lên
+        self.anchor_steps = 0
+        self.last_check_steps = 0
+        self.sensor_reads = 1 if start_height > 0 else 0
+        self.corrections = 0
+
+    def add_steps(self, steps, direction):
+        self.net_steps += steps if direction else -steps
+
+    def position(self):
+        """Độ cao hiện tại suy ra từ số bước (cm), -1 nếu chưa có mốc"""
+        if self.anchor_height <= 0:
+            return -1
+        return self.anchor_height + (self.net_steps - self.anchor_steps) / self.steps_per_cm
+
+    def due_for_check(self):
+        """True khi đã đi đủ CHECK_EVERY_CM kể từ lần đối chiếu cảm biến trước"""
+        return abs(self.net_steps - self.last_check_steps) >= self.check_every_cm * self.steps_per_cm
+
+    def correct(self, measured_height):
+        """Đối chiếu với cảm biến, đặt lại mốc nếu sai lệch vượt ngưỡng"""
+        self.sensor_reads += 1
+        self.last_check_steps = self.net_steps
+        if measured_height <= 0:
+            return
+        if self.anchor_height <= 0 or abs(measured_height - self.position()) > CORRECTION_TOLERANCE:
+            self.anchor_height = measured_height
+            self.anchor_steps = self.net_steps
+            self.corrections += 1
+
+    def learn(self, end_height):
+        """Cập nhật số bước/cm từ độ cao thô đầu và cuối lần di chuyển, trả về giá trị mới"""
+        self.sensor_reads += 1
+        distance = abs(end_height - self.calibration_start)
+        if self.calibration_start <= 0 or end_height <= 0 or distance < MIN_CALIBRATION_CM or self.net_steps == 0:
+            return self.steps_per_cm
+        observed = abs(self.net_steps) / distance
+        # Bỏ qua phép đo vô lý (tiếng vọng sai, trượt động cơ)
+        if not 0.5 * self.steps_per_cm <= observed <= 2 * self.steps_per_cm:
+            logging.warning(f"Bỏ qua hiệu chuẩn bất thường: {observed:.1f} bước/cm")
+            return self.steps_per_cm
+        self.steps_per_cm = round((1 - LEARNING_RATE) * self.steps_per_cm + LEARNING_RATE * observed, 2)
+        logging.info(f"Hiệu chuẩn mới: {self.steps_per_cm} bước/cm (đo được {observed:.1f})")
+        return self.steps_per_cm
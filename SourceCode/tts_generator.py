@@ -1,22 +1,24 @@
 # tts_generator.py - Tạo âm thanh cá nhân bằng Text-to-Speech API
 
 import os
-import pickle
+import queue
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
 import requests
-import json
 from config import *
+from face_store import get_face_store
 
 def generate_personal_greetings():
     """Tạo âm thanh chào cá nhân cho tất cả người dùng đã đăng ký"""
-    # Kiểm tra file mapping
-    if not os.path.exists(FACE_MAPPING_PATH):
+    # Đọc dữ liệu người dùng từ kho mẫu
+    face_info = get_face_store().users()
+    if not face_info:
         print("Chưa có người dùng nào được đăng ký.")
         return False
     
-    # Đọc dữ liệu người dùng
-    with open(FACE_MAPPING_PATH, 'rb') as f:
-        face_info = pickle.load(f)
-    
     # Hiển thị danh sách người dùng
     print("\nĐang tạo âm thanh chào cho người dùng:")
     print("-" * 40)
@@ -32,82 +34,122 @@ def generate_personal_greetings():
     print("Đã hoàn thành việc tạo âm thanh!")
     return True
 
-def create_time_based_greetings(face_id, person_name):
-    """Tạo các file âm thanh theo thời gian cho một người dùng"""
-    greetings = {
+def greeting_texts(person_name):
+    """Lời chào theo buổi {buổi: văn bản} của một người dùng"""
+    return {
         "morning": f"Chào buổi sáng {person_name}, chúc bạn một ngày tốt lành",
         "afternoon": f"Chào buổi chiều {person_name}, chúc bạn có buổi chiều vui vẻ",
         "evening": f"Chào buổi tối {person_name}, chúc bạn một buổi tối an lành"
     }
-    
-    for time_key, text in greetings.items():
-        output_path = os.path.join(FACES_DIR, f"face_{face_id}_{time_key}.mp3")
-        
-        # Tạo file âm thanh
-        success = generate_tts(text, output_path)
-        if success:
+
+def greeting_path(face_id, time_key):
+    return os.path.join(FACES_DIR, f"face_{face_id}_{time_key}.mp3")
+
+def create_time_based_greetings(face_id, person_name):
+    """Tạo các file âm thanh theo thời gian cho một người dùng (chặn tới khi xong)"""
+    for time_key, text in greeting_texts(person_name).items():
+        # Tạo (hoặc lấy từ cache) rồi gắn vào tên file của người dùng
+        cached = synthesize(text)
+        if cached is not None and link_greeting(cached, greeting_path(face_id, time_key)):
             print(f"  ✓ Đã tạo âm thanh {time_key} cho {person_name}")
         else:
             print(f"  ✗ Lỗi khi tạo âm thanh {time_key} cho {person_name}")
 
-def generate_tts(text, output_path):
+def link_greeting(cached_path, output_path):
+    """Gắn file trong cache vào tên file lời chào bằng hard link (chép nếu không link được)"""
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        temp_path = output_path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(cached_path, temp_path)
+        except OSError:
+            shutil.copyfile(cached_path, temp_path)
+        os.replace(temp_path, output_path)
+        return True
+    except OSError as e:
+        print(f"Lỗi khi lưu file lời chào {output_path}: {e}")
+        return False
+
+def tts_cache_path(text, voice=TTS_VOICE, engine=TTS_ENGINE):
+    """Đường dẫn cache của một câu: hash(văn bản, giọng, engine) nên câu giống nhau chỉ tạo một lần"""
+    digest = hashlib.sha256(f"{engine}\0{voice}\0{text}".encode('utf-8')).hexdigest()[:32]
+    return os.path.join(TTS_CACHE_DIR, f"{digest}.mp3")
+
+def synthesize(text, voice=TTS_VOICE):
+    """Trả về file mp3 của câu `text` trong cache, tạo mới nếu chưa có.
+
+    Ưu tiên bản của API; nếu API lỗi hoặc quá TTS_TIMEOUT giây thì dùng espeak
+    (bản espeak có khóa cache riêng nên lần sau vẫn thử lại API).
+    """
+    cached = tts_cache_path(text, voice, TTS_ENGINE)
+    if os.path.exists(cached) or generate_tts(text, cached, voice, fallback=False):
+        return cached
+    fallback = tts_cache_path(text, voice, "espeak")
+    if os.path.exists(fallback) or generate_tts_fallback(text, fallback):
+        return fallback
+    return None
+
+def write_atomic(output_path, data):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = output_path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, output_path)
+
+def generate_tts(text, output_path, voice=TTS_VOICE, fallback=True):
     """Tạo file âm thanh từ văn bản sử dụng API"""
     try:
         # Sử dụng API miễn phí VoiceRSS (đăng ký tại https://www.voicerss.org/)
-        # Thay API_KEY bằng khóa API của bạn sau khi đăng ký
-        API_KEY = "YOUR_API_KEY"  # Thay thế bằng API key của bạn
-        
+        # Đặt khóa API qua biến môi trường VOICERSS_API_KEY
         # Chuẩn bị tham số
         params = {
-            'key': API_KEY,
+            'key': TTS_API_KEY,
             'src': text,
-            'hl': 'vi-vn',  # Tiếng Việt
+            'hl': voice,  # Tiếng Việt
             'r': '0',  # Tốc độ đọc bình thường
             'c': 'mp3',  # Định dạng MP3
             'f': '44khz_64bit_stereo'  # Chất lượng âm thanh
         }
         
-        # Gọi API
-        response = requests.get('https://api.voicerss.org/', params=params)
+        # Gọi API, không chờ quá TTS_TIMEOUT giây
+        response = requests.get(TTS_API_URL, params=params, timeout=TTS_TIMEOUT)
         
         # Kiểm tra kết quả
         if response.status_code == 200 and not response.text.startswith('ERROR'):
             # Lưu file
-            with open(output_path, 'wb') as f:
-                f.write(response.content)
+            write_atomic(output_path, response.content)
             return True
         else:
-            print(f"Lỗi API: {response.text}")
-            # Sử dụng phương án dự phòng
-            return generate_tts_fallback(text, output_path)
+            print(f"Lỗi API: {response.text[:200]}")
     
     except Exception as e:
         print(f"Lỗi khi tạo TTS: {e}")
-        # Sử dụng phương án dự phòng
-        return generate_tts_fallback(text, output_path)
+    
+    # Sử dụng phương án dự phòng
+    return generate_tts_fallback(text, output_path) if fallback else False
 
 def generate_tts_fallback(text, output_path):
     """Phương án dự phòng sử dụng espeak và lame"""
     try:
-        import subprocess
-        
         # Tạo thư mục nếu chưa tồn tại
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         
-        # Tạo file WAV tạm thời
-        temp_wav = os.path.join(os.path.dirname(output_path), "temp.wav")
-        
-        # Sử dụng espeak để tạo file WAV
-        espeak_cmd = f'espeak -v vi -s 130 -p 50 "{text}" -w {temp_wav}'
-        subprocess.run(espeak_cmd, shell=True, check=True)
-        
-        # Chuyển WAV sang MP3
-        lame_cmd = f"lame {temp_wav} {output_path}"
-        subprocess.run(lame_cmd, shell=True, check=True)
-        
-        # Dọn dẹp
-        if os.path.exists(temp_wav):
-            os.remove(temp_wav)
+        # File WAV tạm thời riêng cho mỗi lần gọi (có thể chạy song song)
+        fd, temp_wav = tempfile.mkstemp(suffix=".wav", dir=os.path.dirname(output_path))
+        os.close(fd)
+        try:
+            # Sử dụng espeak để tạo file WAV (truyền tham số dạng danh sách, không qua shell)
+            subprocess.run(["espeak", "-v", "vi", "-s", "130", "-p", "50", "-w", temp_wav, text], check=True)
+            
+            # Chuyển WAV sang MP3 rồi đổi tên, không để lại file mp3 ghi dở
+            subprocess.run(["lame", "--quiet", temp_wav, output_path + ".tmp"], check=True)
+            os.replace(output_path + ".tmp", output_path)
+        finally:
+            # Dọn dẹp
+            if os.path.exists(temp_wav):
+                os.remove(temp_wav)
         
         return True
     
@@ -115,10 +157,59 @@ def generate_tts_fallback(text, output_path):
         print(f"Lỗi khi tạo TTS dự phòng: {e}")
         return False
 
+class GreetingSynthesizer:
+    """Hàng đợi tạo lời chào trong luồng nền để đăng ký không phải chờ mạng.
+    
+    Mỗi việc là một người dùng; câu đã có trong cache không gọi API lần nữa và
+    các việc trùng đang chờ được gộp lại.
+    """
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="tts-greetings")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def submit(self, face_id, person_name):
+        """Xếp hàng tạo lời chào cho một người dùng (không chặn)"""
+        with self.lock:
+            if (face_id, person_name) in self.pending:
+                return
+            self.pending.add((face_id, person_name))
+        self.jobs.put((face_id, person_name))
+    
+    def wait(self):
+        """Chờ mọi việc đang xếp hàng xong"""
+        self.jobs.join()
+    
+    def _run(self):
+        while True:
+            face_id, person_name = self.jobs.get()
+            try:
+                create_time_based_greetings(face_id, person_name)
+            except Exception as e:
+                print(f"Lỗi khi tạo lời chào cho {person_name}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard((face_id, person_name))
+                self.jobs.task_done()
+
+_synthesizer = None
+_synthesizer_lock = threading.Lock()
+
+def queue_time_based_greetings(face_id, person_name):
+    """Tạo lời chào của một người dùng trong luồng nền dùng chung"""
+    global _synthesizer
+    with _synthesizer_lock:
+        if _synthesizer is None:
+            _synthesizer = GreetingSynthesizer()
+    _synthesizer.submit(face_id, person_name)
+    return _synthesizer
+
 if __name__ == "__main__":
     # Tạo thư mục cần thiết
     create_directories()
     
     # Tạo âm thanh cho tất cả người dùng
     generate_personal_greetings()
-    
\ No newline at end of file
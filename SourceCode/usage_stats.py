@@ -5,8 +5,8 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
 import datetime
-import sqlite3
 import os
+import database
 from usage_tracker import usage_tracker, DB_PATH
 
 class UsageStatsApp:
@@ -284,17 +284,18 @@ class UsageStatsApp:
             return
             
         # Truy vấn tổng thống kê từ database
-        conn = sqlite3.connect(DB_PATH)
+        conn = database.get_connection()
         cursor = conn.cursor()
         
         # Tổng thời gian và số phiên
         cursor.execute('''
             SELECT 
-                SUM(duration) as total_time,
-                COUNT(*) as total_sessions,
-                AVG(duration) as avg_duration
-            FROM sessions
-        ''')
+                SUM(seconds) as total_time,
+                SUM(entries) as total_sessions,
+                SUM(seconds) / MAX(SUM(entries), 1) as avg_duration
+            FROM daily_usage
+            WHERE position = ?
+        ''', (database.SESSION_TOTAL,))
         result = cursor.fetchone()
         if result:
             total_time, total_sessions, avg_duration = result
@@ -304,9 +305,10 @@ class UsageStatsApp:
         # Thời gian tuần này
         week_start = datetime.datetime.now() - datetime.timedelta(days=datetime.datetime.now().weekday())
         week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
-        week_start_str = week_start.strftime("%Y-%m-%d %H:%M:%S.%f")
+        week_start_str = week_start.strftime("%Y-%m-%d")
         
-        cursor.execute('SELECT SUM(duration) FROM sessions WHERE start_time >= ?', (week_start_str,))
+        cursor.execute('SELECT SUM(seconds) FROM daily_usage WHERE position = ? AND day >= ?',
+                       (database.SESSION_TOTAL, week_start_str))
         week_time = cursor.fetchone()[0] or 0
         
         # Phiên gần nhất
@@ -318,8 +320,6 @@ class UsageStatsApp:
         ''')
         last_session = cursor.fetchone()
         
-        conn.close()
-        
         # Cập nhật UI
         if total_time:
             hours = total_time / 3600
@@ -485,22 +485,24 @@ class UsageStatsApp:
         if not os.path.exists(DB_PATH):
             return []
             
-        conn = sqlite3.connect(DB_PATH)
+        conn = database.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT 
-                COALESCE(user_name, 'Không xác định') as user,
-                SUM(duration) as total_duration,
-                COUNT(*) as session_count,
-                AVG(duration) as avg_duration
-            FROM sessions
+                COALESCE((SELECT s.user_name FROM sessions s
+                          WHERE s.user_id = d.user_id AND s.user_name IS NOT NULL
+                          ORDER BY s.id DESC LIMIT 1), 'Không xác định') as user,
+                SUM(seconds) as total_duration,
+                SUM(entries) as session_count,
+                SUM(seconds) / MAX(SUM(entries), 1) as avg_duration
+            FROM daily_usage d
+            WHERE position = ?
             GROUP BY user_id
             ORDER BY total_duration DESC
-        ''')
+        ''', (database.SESSION_TOTAL,))
         
         result = cursor.fetchall()
-        conn.close()
         
         return result
     
@@ -509,21 +511,21 @@ class UsageStatsApp:
         if not os.path.exists(DB_PATH):
             return []
             
-        conn = sqlite3.connect(DB_PATH)
+        conn = database.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT 
                 position,
-                SUM(duration) as total_duration,
-                COUNT(*) as position_count
-            FROM positions
+                SUM(seconds) as total_duration,
+                SUM(entries) as position_count
+            FROM daily_usage
+            WHERE position != ?
             GROUP BY position
             ORDER BY total_duration DESC
-        ''')
+        ''', (database.SESSION_TOTAL,))
         
         result = cursor.fetchall()
-        conn.close()
         
         return result
     
@@ -612,7 +614,7 @@ class UsageStatsApp:
         start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
         
         # Kết nối database
-        conn = sqlite3.connect(DB_PATH)
+        conn = database.get_connection()
         cursor = conn.cursor()
         
         # Tạo danh sách ngày
@@ -621,23 +623,17 @@ class UsageStatsApp:
             day = start_date + datetime.timedelta(days=i)
             date_list.append(day.strftime("%Y-%m-%d"))
         
-        # Lấy dữ liệu từ database
-        durations = []
-        for date_str in date_list:
-            cursor.execute('''
-                SELECT SUM(duration)
-                FROM sessions
-                WHERE date(start_time) = ?
-            ''', (date_str,))
-            
-            total = cursor.fetchone()[0]
-            if total:
-                # Chuyển từ giây sang giờ
-                durations.append(total / 3600)
-            else:
-                durations.append(0)
-        
-        conn.close()
+        # Lấy dữ liệu từ bảng tổng hợp theo ngày trong một truy vấn
+        cursor.execute('''
+            SELECT day, SUM(seconds)
+            FROM daily_usage
+            WHERE position = ? AND day >= ?
+            GROUP BY day
+        ''', (database.SESSION_TOTAL, date_list[0]))
+        totals = dict(cursor.fetchall())
+        
+        # Chuyển từ giây sang giờ
+        durations = [(totals.get(date_str) or 0) / 3600 for date_str in date_list]
         
         # Định dạng lại ngày để hiển thị
         formatted_dates = [datetime.datetime.strptime(d, "%Y-%m-%d").strftime("%d/%m") for d in date_list]
@@ -1,17 +1,17 @@
 # usage_tracker.py - Theo dõi thời gian sử dụng
 import os
-import sqlite3
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
 import logging
+import database
 
 # Cấu hình logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Đường dẫn đến file database
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_PATH, "data", "usage_stats.db")
+DB_PATH = database.DB_PATH
 
 class UsageTracker:
     def __init__(self):
@@ -20,64 +20,38 @@ class UsageTracker:
         self.current_session = None
         self.tracking_thread = None
         self.stop_thread = False
-        self.db_lock = threading.Lock()
+        # Ghi database đã được tuần tự hóa bởi database.write; khóa này chỉ giữ cho
+        # việc chuyển phiên trong bộ nhớ (dừng phiên cũ, mở phiên mới) không xen kẽ
+        self.lock = threading.RLock()
         self._init_database()
     
     def _init_database(self):
         """Khởi tạo cơ sở dữ liệu"""
         try:
-            os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS sessions (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            user_id TEXT UNIQUE,
-                            user_name TEXT,
-                            start_time TIMESTAMP,
-                            end_time TIMESTAMP,
-                            duration REAL,
-                            notes TEXT
-                        )
-                    ''')
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS positions (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            session_id INTEGER,
-                            user_id TEXT,
-                            position TEXT,
-                            start_time TIMESTAMP,
-                            end_time TIMESTAMP,
-                            duration REAL,
-                            FOREIGN KEY (session_id) REFERENCES sessions(id)
-                        )
-                    ''')
-                    conn.commit()
-                    logging.info("Khởi tạo cơ sở dữ liệu usage_tracker thành công")
+            database.init_database()
+            logging.info("Khởi tạo cơ sở dữ liệu usage_tracker thành công")
         except Exception as e:
             logging.error(f"Lỗi khởi tạo cơ sở dữ liệu: {e}")
             raise
     
     def start_tracking(self, user_id=None, user_name=None, position=None):
         """Bắt đầu theo dõi thời gian sử dụng"""
+        with self.lock:
+            return self._start_tracking(user_id, user_name, position)
+    
+    def _start_tracking(self, user_id, user_name, position):
         try:
             if self.tracking_active:
                 self.stop_tracking()
             
             if user_id is None:
-                with self.db_lock:
-                    with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                        cursor = conn.cursor()
-                        if user_name:
-                            cursor.execute('SELECT user_id FROM sessions WHERE user_name = ? GROUP BY user_id', (user_name,))
-                            result = cursor.fetchone()
-                            if result:
-                                user_id = result[0]
-                        if user_id is None:
-                            cursor.execute('SELECT MAX(user_id) FROM sessions')
-                            result = cursor.fetchone()
-                            user_id = str(int(result[0]) + 1 if result[0] else 1)
+                if user_name:
+                    result = database.fetchone('SELECT user_id FROM sessions WHERE user_name = ? GROUP BY user_id', (user_name,))
+                    if result:
+                        user_id = result[0]
+                if user_id is None:
+                    result = database.fetchone('SELECT MAX(user_id) FROM sessions')
+                    user_id = str(int(result[0]) + 1 if result[0] else 1)
             
             current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
             self.current_session = {
@@ -102,6 +76,10 @@ class UsageTracker:
     
     def stop_tracking(self):
         """Dừng theo dõi và lưu thông tin"""
+        with self.lock:
+            return self._stop_tracking()
+    
+    def _stop_tracking(self):
         if not self.tracking_active:
             logging.warning("Không có phiên đang hoạt động để dừng")
             return None
@@ -121,37 +99,53 @@ class UsageTracker:
             self.current_session['end_time'] = end_time
             self.current_session['duration'] = duration
             
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
+            def save_session(conn, session):
+                # Đóng phiên tạm do _save_session_state tạo ra nếu có, thay vì thêm dòng trùng
+                result = conn.execute('''
+                    SELECT id FROM sessions 
+                    WHERE user_id = ? AND end_time IS NULL
+                    ORDER BY start_time DESC LIMIT 1
+                ''', (session['user_id'],)).fetchone()
+                
+                if result:
+                    session_id = result[0]
+                    conn.execute('''
+                        UPDATE sessions 
+                        SET end_time = ?, duration = ?, notes = ? 
+                        WHERE id = ?
+                    ''', (session['end_time'], session['duration'], session.get('notes', ''), session_id))
+                    conn.execute('DELETE FROM positions WHERE session_id = ? AND end_time IS NULL', (session_id,))
+                else:
+                    cursor = conn.execute('''
                         INSERT INTO sessions (user_id, user_name, start_time, end_time, duration, notes)
                         VALUES (?, ?, ?, ?, ?, ?)
                     ''', (
-                        self.current_session['user_id'],
-                        self.current_session['user_name'],
-                        self.current_session['start_time'],
-                        self.current_session['end_time'],
-                        self.current_session['duration'],
-                        self.current_session.get('notes', '')
+                        session['user_id'],
+                        session['user_name'],
+                        session['start_time'],
+                        session['end_time'],
+                        session['duration'],
+                        session.get('notes', '')
                     ))
-                    
                     session_id = cursor.lastrowid
-                    
-                    cursor.execute('''
-                        INSERT INTO positions (session_id, user_id, position, start_time, end_time, duration)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        session_id,
-                        self.current_session['user_id'],
-                        self.current_session['position'],
-                        self.current_session['start_time'],
-                        self.current_session['end_time'],
-                        self.current_session['duration']
-                    ))
-                    
-                    conn.commit()
-                    logging.info(f"Kết thúc theo dõi cho {self.current_session['user_name']} sau {duration:.1f} giây")
+                
+                conn.execute('''
+                    INSERT INTO positions (session_id, user_id, position, start_time, end_time, duration)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    session_id,
+                    session['user_id'],
+                    session['position'],
+                    session['start_time'],
+                    session['end_time'],
+                    session['duration']
+                ))
+                database.add_daily_usage(conn, session['user_id'], session['start_time'], session['duration'])
+                database.add_daily_usage(conn, session['user_id'], session['start_time'], session['duration'],
+                                         session['position'])
+            
+            database.write(save_session, self.current_session)
+            logging.info(f"Kết thúc theo dõi cho {self.current_session['user_name']} sau {duration:.1f} giây")
             
             session_data = self.current_session.copy()
             self.current_session = None
@@ -175,30 +169,30 @@ class UsageTracker:
             end_time_obj = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S.%f")
             duration = (end_time_obj - start_time_obj).total_seconds()
             
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT id FROM sessions 
-                        WHERE user_id = ? 
-                        ORDER BY start_time DESC LIMIT 1
-                    ''', (self.current_session['user_id'],))
-                    
-                    result = cursor.fetchone()
-                    if result:
-                        session_id = result[0]
-                        cursor.execute('''
-                            INSERT INTO positions (session_id, user_id, position, start_time, end_time, duration)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        ''', (
-                            session_id,
-                            self.current_session['user_id'],
-                            self.current_session['position'],
-                            self.current_session['start_time'],
-                            end_time,
-                            duration
-                        ))
-                        conn.commit()
+            def save_position(conn, session):
+                result = conn.execute('''
+                    SELECT id FROM sessions 
+                    WHERE user_id = ? 
+                    ORDER BY start_time DESC LIMIT 1
+                ''', (session['user_id'],)).fetchone()
+                
+                if result:
+                    session_id = result[0]
+                    conn.execute('''
+                        INSERT INTO positions (session_id, user_id, position, start_time, end_time, duration)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (
+                        session_id,
+                        session['user_id'],
+                        session['position'],
+                        session['start_time'],
+                        end_time,
+                        duration
+                    ))
+                    database.add_daily_usage(conn, session['user_id'], session['start_time'], duration,
+                                             session['position'])
+            
+            database.write(save_position, self.current_session)
             
             self.current_session['position'] = position
             self.current_session['start_time'] = end_time
@@ -210,33 +204,34 @@ class UsageTracker:
     def log_position(self, user_id, position):
         """Ghi trạng thái vị trí ngồi/đứng"""
         try:
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT id FROM sessions 
-                        WHERE user_id = ? AND end_time IS NULL
-                        ORDER BY start_time DESC LIMIT 1
-                    ''', (user_id,))
-                    result = cursor.fetchone()
-                    if not result:
-                        logging.warning(f"Không tìm thấy phiên đang hoạt động cho user_id={user_id}")
-                        return
-                    session_id = result[0]
-                    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-                    cursor.execute('''
-                        INSERT INTO positions (session_id, user_id, position, start_time, end_time, duration)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        session_id,
-                        user_id,
-                        position,
-                        current_time,
-                        current_time,
-                        0
-                    ))
-                    conn.commit()
-                    logging.info(f"Đã ghi trạng thái {position} cho user_id={user_id}, session_id={session_id}")
+            def save_log(conn):
+                result = conn.execute('''
+                    SELECT id FROM sessions 
+                    WHERE user_id = ? AND end_time IS NULL
+                    ORDER BY start_time DESC LIMIT 1
+                ''', (user_id,)).fetchone()
+                if not result:
+                    return None
+                session_id = result[0]
+                current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+                conn.execute('''
+                    INSERT INTO positions (session_id, user_id, position, start_time, end_time, duration)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    session_id,
+                    user_id,
+                    position,
+                    current_time,
+                    current_time,
+                    0
+                ))
+                return session_id
+            
+            session_id = database.write(save_log)
+            if session_id is None:
+                logging.warning(f"Không tìm thấy phiên đang hoạt động cho user_id={user_id}")
+                return
+            logging.info(f"Đã ghi trạng thái {position} cho user_id={user_id}, session_id={session_id}")
         except Exception as e:
             logging.error(f"Lỗi khi ghi trạng thái vị trí: {e}")
             raise
@@ -271,51 +266,47 @@ class UsageTracker:
             start_time_obj = datetime.strptime(self.current_session['start_time'], "%Y-%m-%d %H:%M:%S.%f")
             temp_duration = (now - start_time_obj).total_seconds()
             
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT id FROM sessions 
-                        WHERE user_id = ? AND end_time IS NULL
-                        ORDER BY start_time DESC LIMIT 1
-                    ''', (self.current_session['user_id'],))
-                    
-                    result = cursor.fetchone()
+            def save_state(conn, session):
+                result = conn.execute('''
+                    SELECT id FROM sessions 
+                    WHERE user_id = ? AND end_time IS NULL
+                    ORDER BY start_time DESC LIMIT 1
+                ''', (session['user_id'],)).fetchone()
+                
+                if result:
+                    session_id = result[0]
+                    conn.execute('''
+                        UPDATE sessions 
+                        SET duration = ? 
+                        WHERE id = ?
+                    ''', (temp_duration, session_id))
+                else:
+                    cursor = conn.execute('''
+                        INSERT INTO sessions (user_id, user_name, start_time, duration, notes)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (
+                        session['user_id'],
+                        session['user_name'],
+                        session['start_time'],
+                        temp_duration,
+                        session.get('notes', '')
+                    ))
                     
-                    if result:
-                        session_id = result[0]
-                        cursor.execute('''
-                            UPDATE sessions 
-                            SET duration = ? 
-                            WHERE id = ?
-                        ''', (temp_duration, session_id))
-                    else:
-                        cursor.execute('''
-                            INSERT INTO sessions (user_id, user_name, start_time, duration, notes)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (
-                            self.current_session['user_id'],
-                            self.current_session['user_name'],
-                            self.current_session['start_time'],
-                            temp_duration,
-                            self.current_session.get('notes', '')
-                        ))
-                        
-                        session_id = cursor.lastrowid
-                        
-                        cursor.execute('''
-                            INSERT INTO positions (session_id, user_id, position, start_time, duration)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (
-                            session_id,
-                            self.current_session['user_id'],
-                            self.current_session['position'],
-                            self.current_session['start_time'],
-                            temp_duration
-                        ))
+                    session_id = cursor.lastrowid
                     
-                    conn.commit()
-                    logging.debug(f"Đã lưu trạng thái phiên cho user_id={self.current_session['user_id']}")
+                    conn.execute('''
+                        INSERT INTO positions (session_id, user_id, position, start_time, duration)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (
+                        session_id,
+                        session['user_id'],
+                        session['position'],
+                        session['start_time'],
+                        temp_duration
+                    ))
+            
+            database.write(save_state, self.current_session)
+            logging.debug(f"Đã lưu trạng thái phiên cho user_id={self.current_session['user_id']}")
         except Exception as e:
             logging.error(f"Lỗi khi lưu trạng thái phiên: {e}")
     
@@ -332,22 +323,21 @@ class UsageTracker:
     def get_user_stats(self):
         """Lấy thống kê theo người dùng"""
         try:
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT 
-                            COALESCE(user_name, 'Không xác định') as user,
-                            SUM(duration) as total_duration,
-                            COUNT(*) as session_count,
-                            AVG(duration) as avg_duration
-                        FROM sessions
-                        GROUP BY user_id
-                        ORDER BY total_duration DESC
-                    ''')
-                    result = cursor.fetchall()
-                    logging.debug(f"User stats: {result}")
-                    return result
+            result = database.fetchall('''
+                SELECT 
+                    COALESCE((SELECT s.user_name FROM sessions s
+                              WHERE s.user_id = d.user_id AND s.user_name IS NOT NULL
+                              ORDER BY s.id DESC LIMIT 1), 'Không xác định') as user,
+                    SUM(seconds) as total_duration,
+                    SUM(entries) as session_count,
+                    SUM(seconds) / MAX(SUM(entries), 1) as avg_duration
+                FROM daily_usage d
+                WHERE position = ?
+                GROUP BY user_id
+                ORDER BY total_duration DESC
+            ''', (database.SESSION_TOTAL,))
+            logging.debug(f"User stats: {result}")
+            return result
         except Exception as e:
             logging.error(f"Lỗi khi lấy thống kê người dùng: {e}")
             return []
@@ -355,21 +345,18 @@ class UsageTracker:
     def get_position_stats(self):
         """Lấy thống kê theo vị trí"""
         try:
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT 
-                            position,
-                            SUM(duration) as total_duration,
-                            COUNT(*) as position_count
-                        FROM positions
-                        GROUP BY position
-                        ORDER BY total_duration DESC
-                    ''')
-                    result = cursor.fetchall()
-                    logging.debug(f"Position stats: {result}")
-                    return result
+            result = database.fetchall('''
+                SELECT 
+                    position,
+                    SUM(seconds) as total_duration,
+                    SUM(entries) as position_count
+                FROM daily_usage
+                WHERE position != ?
+                GROUP BY position
+                ORDER BY total_duration DESC
+            ''', (database.SESSION_TOTAL,))
+            logging.debug(f"Position stats: {result}")
+            return result
         except Exception as e:
             logging.error(f"Lỗi khi lấy thống kê vị trí: {e}")
             return []
@@ -378,23 +365,19 @@ class UsageTracker:
         """Lấy thống kê theo ngày"""
         try:
             end_date = datetime.now()
-            start_date = end_date - datetime.timedelta(days=days-1)
+            start_date = end_date - timedelta(days=days-1)
             start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
             start_date_str = start_date.strftime("%Y-%m-%d")
             
-            with self.db_lock:
-                with sqlite3.connect(DB_PATH, timeout=10) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT 
-                            date(start_time) as day,
-                            SUM(duration) as total_duration
-                        FROM sessions
-                        WHERE date(start_time) >= ?
-                        GROUP BY day
-                        ORDER BY day
-                    ''', (start_date_str,))
-                    result = cursor.fetchall()
+            result = database.fetchall('''
+                SELECT 
+                    day,
+                    SUM(seconds) as total_duration
+                FROM daily_usage
+                WHERE position = ? AND day >= ?
+                GROUP BY day
+                ORDER BY day
+            ''', (database.SESSION_TOTAL, start_date_str))
             
             days_data = {}
             for day, duration in result:
@@ -404,7 +387,7 @@ class UsageTracker:
             durations_list = []
             
             for i in range(days):
-                day = start_date + datetime.timedelta(days=i)
+                day = start_date + timedelta(days=i)
                 day_str = day.strftime("%Y-%m-%d")
                 days_list.append(day.strftime("%d/%m"))
                 durations_list.append(days_data.get(day_str, 0) / 3600)
@@ -60,21 +60,35 @@ def download_yolo_model():
     print("Đang tải file classes...")
     os.system(f"wget -O {YOLO_CLASSES} https://raw.githubusercontent.com/AlexeyAB/darknet/master/data/coco.names")
 
-def detect_people(frame, net, output_layers, person_class_id):
-    """Phát hiện người trong khung hình sử dụng YOLO"""
-    height, width = frame.shape[:2]
-    
-    # Chuẩn bị blob cho YOLO
-    blob = cv2.dnn.blobFromImage(frame, 1/255.0, (416, 416), swapRB=True, crop=False)
-    net.setInput(blob)
+def decode_people(outputs, width, height, person_class_id, conf_threshold=YOLO_CONFIDENCE_THRESHOLD):
+    """Giải mã các tensor đầu ra YOLO thành box người bằng phép toán NumPy theo lô.
+
+    Mỗi hàng là [cx, cy, w, h, objectness, điểm của từng lớp...]. Chỉ các hàng
+    có điểm lớp 'person' vượt ngưỡng và là lớp cao nhất mới được giữ lại.
+    Trả về (mảng box int [x, y, w, h], mảng độ tin cậy).
+    """
+    detections = np.concatenate([output.reshape(-1, output.shape[-1]) for output in outputs])
+    rows = detections[detections[:, 5 + person_class_id] > conf_threshold]
+    if len(rows):
+        rows = rows[np.argmax(rows[:, 5:], axis=1) == person_class_id]
     
-    # Chạy mô hình
-    outputs = net.forward(output_layers)
+    # Chuyển tâm/kích thước tương đối sang tọa độ điểm trên cùng bên trái (pixel),
+    # làm tròn về 0 giống int() của bộ giải mã cũ
+    center_x = (rows[:, 0] * width).astype(np.int32)
+    center_y = (rows[:, 1] * height).astype(np.int32)
+    w = (rows[:, 2] * width).astype(np.int32)
+    h = (rows[:, 3] * height).astype(np.int32)
+    x = (center_x - w / 2).astype(np.int32)
+    y = (center_y - h / 2).astype(np.int32)
     
-    # Xử lý kết quả
+    boxes = np.stack([x, y, w, h], axis=1)
+    confidences = rows[:, 5 + person_class_id].astype(np.float32)
+    return boxes, confidences
+
+def decode_people_loop(outputs, width, height, person_class_id, conf_threshold=YOLO_CONFIDENCE_THRESHOLD):
+    """Bộ giải mã cũ duyệt từng hàng bằng Python, chỉ giữ lại để so sánh trong benchmark"""
     boxes = []
     confidences = []
-    class_ids = []
     
     for output in outputs:
         for detection in output:
@@ -82,8 +96,8 @@ def detect_people(frame, net, output_layers, person_class_id):
             class_id = np.argmax(scores)
             confidence = scores[class_id]
             
-            # Chỉ quan tâm đến người và confidence > 0.5
-            if class_id == person_class_id and confidence > 0.5:
+            # Chỉ quan tâm đến người và confidence > ngưỡng
+            if class_id == person_class_id and confidence > conf_threshold:
                 # Tọa độ hình chữ nhật
                 center_x = int(detection[0] * width)
                 center_y = int(detection[1] * height)
@@ -96,22 +110,155 @@ def detect_people(frame, net, output_layers, person_class_id):
                 
                 boxes.append([x, y, w, h])
                 confidences.append(float(confidence))
-                class_ids.append(class_id)
     
-    # Non-maximum suppression để loại bỏ các bounding box chồng chéo
-    indices = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
+    return boxes, confidences
+
+def suppress_overlaps(boxes, confidences, conf_threshold=YOLO_CONFIDENCE_THRESHOLD, nms_threshold=YOLO_NMS_THRESHOLD):
+    """Non-maximum suppression để loại bỏ các bounding box chồng chéo, trả về danh sách Python"""
+    if len(boxes) == 0:
+        return [], []
+    boxes = boxes.tolist()
+    confidences = confidences.tolist()
+    indices = np.array(cv2.dnn.NMSBoxes(boxes, confidences, conf_threshold, nms_threshold)).flatten()
+    return [boxes[i] for i in indices], [confidences[i] for i in indices]
+
+def detect_people(frame, net, output_layers, person_class_id,
+                  conf_threshold=YOLO_CONFIDENCE_THRESHOLD, nms_threshold=YOLO_NMS_THRESHOLD, input_size=416):
+    """Phát hiện người trong khung hình sử dụng YOLO"""
+    height, width = frame.shape[:2]
     
-    result_boxes = []
-    result_confidences = []
+    # Chuẩn bị blob cho YOLO
+    blob = cv2.dnn.blobFromImage(frame, 1/255.0, (input_size, input_size), swapRB=True, crop=False)
+    net.setInput(blob)
     
-    if len(boxes) > 0:
-        if isinstance(indices, np.ndarray):
-            indices = indices.flatten()
-        else:
-            indices = indices.flatten() if len(indices) > 0 else []
-        
-        for i in indices:
-            result_boxes.append(boxes[i])
-            result_confidences.append(confidences[i])
+    # Chạy mô hình
+    outputs = net.forward(output_layers)
+    
+    # Giải mã theo lô, NMS chỉ nhận các box đã vượt ngưỡng
+    boxes, confidences = decode_people(outputs, width, height, person_class_id, conf_threshold)
+    return suppress_overlaps(boxes, confidences, conf_threshold, nms_threshold)
+
+class PersonDetector:
+    """Phát hiện người theo hồ sơ DETECTION_PROFILE trong config.
+
+    Bộ đệm ảnh và blob được cấp phát một lần theo kích thước đầu vào. Khi hồ sơ
+    bật ROI, chỉ vùng quanh box người lần trước được đưa vào mạng; quét toàn
+    khung khi ROI không thấy ai hoặc sau mỗi ROI_FULL_SCAN_INTERVAL lần.
+    """
+    def __init__(self, net, output_layers, person_class_id, profile=DETECTION_PROFILE,
+                 conf_threshold=YOLO_CONFIDENCE_THRESHOLD, nms_threshold=YOLO_NMS_THRESHOLD):
+        settings = DETECTION_PROFILES[profile]
+        self.net = net
+        self.output_layers = output_layers
+        self.person_class_id = person_class_id
+        self.profile = profile
+        self.input_size = settings["input_size"]
+        self.use_roi = settings["roi"]
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        size = self.input_size
+        self.resized = np.empty((size, size, 3), dtype=np.uint8)
+        self.rgb = np.empty((size, size, 3), dtype=np.uint8)
+        self.blob = np.empty((1, 3, size, size), dtype=np.float32)
+        self.last_box = None  # Vùng bao các người phát hiện lần trước (x0, y0, x1, y1)
+        self.roi_runs = 0
+        self.roi_scans = 0
+        self.full_scans = 0
+    
+    def make_blob(self, image):
+        """Giống cv2.dnn.blobFromImage(image, 1/255, (size, size), swapRB=True) nhưng ghi vào bộ đệm có sẵn"""
+        size = self.input_size
+        cv2.resize(image, (size, size), dst=self.resized)
+        cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        np.multiply(self.rgb.transpose(2, 0, 1), 1 / 255.0, out=self.blob[0], casting='unsafe')
+        return self.blob
+    
+    def roi_region(self, width, height):
+        """Vùng cần quét lần này, None nếu phải quét toàn khung hình"""
+        if not self.use_roi or self.last_box is None or self.roi_runs >= ROI_FULL_SCAN_INTERVAL:
+            self.roi_runs = 0
+            return None
+        self.roi_runs += 1
+        x0, y0, x1, y1 = self.last_box
+        margin_x = int((x1 - x0) * ROI_MARGIN)
+        margin_y = int((y1 - y0) * ROI_MARGIN)
+        region = max(0, x0 - margin_x), max(0, y0 - margin_y), min(width, x1 + margin_x), min(height, y1 + margin_y)
+        if region[2] - region[0] < 32 or region[3] - region[1] < 32:
+            return None  # Vùng quá nhỏ, quét toàn khung hình
+        return region
+    
+    def detect_region(self, frame, region):
+        x0, y0, x1, y1 = region
+        self.net.setInput(self.make_blob(frame[y0:y1, x0:x1]))
+        outputs = self.net.forward(self.output_layers)
+        boxes, confidences = decode_people(outputs, x1 - x0, y1 - y0, self.person_class_id, self.conf_threshold)
+        boxes[:, 0] += x0
+        boxes[:, 1] += y0
+        return suppress_overlaps(boxes, confidences, self.conf_threshold, self.nms_threshold)
     
-    return result_boxes, result_confidences
\ No newline at end of file
+    def detect(self, frame):
+        """Trả về (danh sách box [x, y, w, h], danh sách độ tin cậy) theo tọa độ khung hình gốc"""
+        height, width = frame.shape[:2]
+        region = self.roi_region(width, height)
+        if region is not None:
+            boxes, confidences = self.detect_region(frame, region)
+            if boxes:
+                self.roi_scans += 1
+                self.remember(boxes, width, height)
+                return boxes, confidences
+        boxes, confidences = self.detect_region(frame, (0, 0, width, height))
+        self.full_scans += 1
+        self.remember(boxes, width, height)
+        return boxes, confidences
+    
+    def remember(self, boxes, width, height):
+        if not boxes:
+            self.last_box = None
+            return
+        self.last_box = (max(0, min(x for x, _, _, _ in boxes)), max(0, min(y for _, y, _, _ in boxes)),
+                         min(width, max(x + w for x, _, w, _ in boxes)), min(height, max(y + h for _, y, _, h in boxes)))
+
+def record_outputs(frame, net, output_layers, path, input_size=416):
+    """Lưu tensor đầu ra của một khung hình thật ra file .npz để chạy benchmark"""
+    blob = cv2.dnn.blobFromImage(frame, 1/255.0, (input_size, input_size), swapRB=True, crop=False)
+    net.setInput(blob)
+    outputs = net.forward(output_layers)
+    np.savez(path, *outputs)
+    print(f"Đã lưu {len(outputs)} tensor vào {path}")
+
+def synthetic_outputs(people=2, seed=0):
+    """Tạo tensor giống đầu ra yolov4-tiny 416x416 (13x13 và 26x26, 3 anchor, 80 lớp)"""
+    rng = np.random.default_rng(seed)
+    outputs = []
+    for grid in (13, 26):
+        output = np.zeros((grid * grid * 3, 85), dtype=np.float32)
+        output[:, :4] = rng.random((len(output), 4), dtype=np.float32)
+        output[:, 5:] = rng.random((len(output), 80), dtype=np.float32) * 0.05
+        outputs.append(output)
+    for _ in range(people):
+        rows = rng.integers(0, len(outputs[1]), 5)
+        outputs[1][rows, 5] = rng.uniform(0.6, 0.95, 5)
+    return outputs
+
+def benchmark(outputs, person_class_id=0, width=640, height=480, repeat=200):
+    """So sánh thời gian giải mã (ms) giữa bộ giải mã cũ và bộ giải mã NumPy"""
+    import time
+    results = {}
+    for name, decoder in (("loop", decode_people_loop), ("vectorized", decode_people)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            boxes, confidences = decoder(outputs, width, height, person_class_id)
+        results[name] = ((time.perf_counter() - started) / repeat * 1000, len(boxes))
+    return results
+
+if __name__ == "__main__":
+    # python yolo_detector.py [tensors.npz]: benchmark trên tensor đã ghi hoặc tensor tổng hợp
+    import sys
+    if len(sys.argv) > 1:
+        recorded = np.load(sys.argv[1])
+        outputs = [recorded[key] for key in recorded.files]
+    else:
+        outputs = synthetic_outputs()
+    rows = sum(len(output) for output in outputs)
+    for name, (ms, count) in benchmark(outputs).items():
+        print(f"{name:>10}: {ms:.3f} ms/khung hình, {count} box trước NMS ({rows} hàng)")